@@ -1,24 +1,423 @@
-from qgis.core import QgsVectorLayer, QgsProject
-
-# Ejemplo: Descargar de Murcia
-wfs_url = "https://mapas-gis-inter.carm.es/geoserver/SIT_USU_PLA_URB_CARM/wfs"
-layer_name = "SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun"
-
-# Construir URL WFS
-uri = f"{wfs_url}?service=WFS&version=2.0.0&request=GetFeature&typename={layer_name}&srsname=EPSG:4326&outputFormat=application/json"
-
-# Cargar capa
-layer = QgsVectorLayer(uri, layer_name, "WFS")
-
-if layer.isValid():
-    # Guardar como GPKG
-    QgsVectorFileWriter.writeAsVectorFormat(
-        layer, 
-        "capas_urbanisticas/murcia/clasificacion_suelo.gpkg",
-        "UTF-8", 
-        layer.crs(), 
-        "GPKG"
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from xml.sax.saxutils import escape
+
+from osgeo import gdal, ogr
+
+from config.http_session import SESSION, cached_get
+
+logger = logging.getLogger("febrero.wfs")
+
+# Parser JSON rápido (Rust/SIMD) si está instalado; stdlib como respaldo
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps_bytes(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _json_loads(data):
+        return json.loads(data)
+
+    def _json_dumps_bytes(obj):
+        return json.dumps(obj).encode("utf-8")
+
+
+# Formatos de salida WFS por orden de preferencia (binarios antes que GeoJSON)
+FORMATOS_PREFERIDOS = [
+    ("application/flatgeobuf", ".fgb"),
+    ("SHAPE-ZIP", ".zip"),
+    ("application/gml+xml; version=3.2", ".gml"),
+]
+FORMATO_JSON = ("application/json", ".geojson")
+
+
+def elegir_formato_salida(session, wfs_url):
+    """Consulta GetCapabilities y elige el mejor outputFormat que ofrezca el servidor"""
+    try:
+        # Capabilities cacheadas en disco (~/.cache/febrero/wfs), revalidadas por ETag
+        contenido = cached_get(
+            wfs_url,
+            params={"service": "WFS", "version": "2.0.0", "request": "GetCapabilities"},
+            session=session,
+        )
+        root = ET.fromstring(contenido)
+    except Exception:
+        return FORMATO_JSON
+
+    disponibles = set()
+    for op in root.iter("{http://www.opengis.net/ows/1.1}Operation"):
+        if op.get("name") != "GetFeature":
+            continue
+        for param in op.iter("{http://www.opengis.net/ows/1.1}Parameter"):
+            if param.get("name") == "outputFormat":
+                disponibles.update(v.text.strip().lower() for v in param.iter() if v.text and v.text.strip())
+
+    for formato, extension in FORMATOS_PREFERIDOS:
+        if formato.lower() in disponibles:
+            return formato, extension
+    return FORMATO_JSON
+
+
+def construir_uri(wfs_url, params):
+    """Construye la URI de una petición WFS con los parámetros correctamente escapados"""
+    return f"{wfs_url}?{urlencode(params)}"
+
+
+# Campos que suelen ser clave única en las capas de GeoServer, por preferencia
+CAMPOS_ORDEN = ("gid", "fid", "ogc_fid", "objectid", "id")
+
+
+def campo_orden(session, wfs_url, layer_name):
+    """Campo clave de la capa para sortBy según DescribeFeatureType (None si no hay ninguno conocido)"""
+    try:
+        contenido = cached_get(
+            wfs_url,
+            params={"service": "WFS", "version": "2.0.0", "request": "DescribeFeatureType", "typename": layer_name},
+            session=session,
+        )
+        root = ET.fromstring(contenido)
+    except Exception:
+        return None
+    campos = {
+        el.get("name", "").lower(): el.get("name")
+        for el in root.iter("{http://www.w3.org/2001/XMLSchema}element")
+    }
+    for campo in CAMPOS_ORDEN:
+        if campo in campos:
+            return campos[campo]
+    return None
+
+
+def _numero_entidades(contenido):
+    """numberMatched de una respuesta hits; None si el servidor no lo sabe ("unknown")"""
+    try:
+        return int(ET.fromstring(contenido).attrib.get("numberMatched", ""))
+    except (ValueError, ET.ParseError):
+        return None
+
+
+def fetch_wfs_paged(wfs_url, layer_name, page_size=10000, workers=8, session=SESSION, huella_previa=None):
+    """Descarga una capa WFS por páginas en paralelo.
+
+    Devuelve (rutas GDAL de las páginas, huella SHA-256 de las entidades). Si
+    la capa está vacía o la huella coincide con `huella_previa`, las rutas son
+    una lista vacía (lo materializado para calcularla ya se ha liberado). Si el servidor no da el total
+    (numberMatched="unknown") las páginas se piden una tras otra en GeoJSON
+    hasta que una llega incompleta.
+    """
+    base_params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typename": layer_name,
+        "srsname": "EPSG:4326",
+    }
+
+    # 1. Número total de entidades (resultType=hits, sin geometrías)
+    r = session.get(wfs_url, params={**base_params, "resultType": "hits"}, timeout=60)
+    r.raise_for_status()
+    total = _numero_entidades(r.content)
+    if total == 0:
+        return [], None
+
+    # Con total conocido, el mejor formato binario; si no, GeoJSON para poder contar cada página
+    formato, extension = elegir_formato_salida(session, wfs_url) if total is not None else FORMATO_JSON
+
+    # 2. Orden estable con sortBy para que las páginas no se solapen (solo si la
+    #    capa tiene un campo clave conocido). La URI se codifica una sola vez;
+    #    cada página solo añade su startIndex.
+    params_paginas = {**base_params, "outputFormat": formato, "count": page_size}
+    orden = campo_orden(session, wfs_url, layer_name)
+    if orden:
+        params_paginas["sortBy"] = orden
+    uri_base = construir_uri(wfs_url, params_paginas)
+
+    def _pagina(k):
+        resp = session.get(f"{uri_base}&startIndex={k * page_size}", timeout=300)
+        resp.raise_for_status()
+        return resp.content
+
+    if total is not None:
+        # Páginas en paralelo
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            paginas = list(ex.map(_pagina, range(max(1, math.ceil(total / page_size)))))
+    else:
+        # Total desconocido: secuencial hasta la primera página incompleta
+        paginas = []
+        while True:
+            contenido = _pagina(len(paginas))
+            n = len(_json_loads(contenido).get("features", []))
+            if n:
+                paginas.append(contenido)
+            if n < page_size:
+                break
+        if not paginas:
+            return [], None
+
+    # 3a. Formato binario: cada página a /vsimem/ para que GDAL la lea sin tocar disco
+    if (formato, extension) != FORMATO_JSON:
+        rutas = []
+        prefijo = layer_name.replace(":", "_")
+        for k, contenido in enumerate(paginas):
+            ruta = f"/vsimem/{prefijo}_{k}{extension}"
+            gdal.FileFromMemBuffer(ruta, contenido)
+            rutas.append(f"/vsizip/{ruta}" if extension == ".zip" else ruta)
+        return _descartar_si_igual(rutas, huella_previa)
+
+    # 3b. GeoJSON: unir en un único FeatureCollection en disco (el orden Hilbert
+    #     lo aplica save() al escribir, igual que para los formatos binarios)
+    features = [f for pagina in paginas for f in _json_loads(pagina).get("features", [])]
+    coleccion = {
+        "type": "FeatureCollection",
+        "features": features,
+    }
+    with tempfile.NamedTemporaryFile(suffix=".geojson", prefix="wfs_", dir=_directorio_staging(), delete=False) as tmp:
+        try:
+            tmp.write(_json_dumps_bytes(coleccion))
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return _descartar_si_igual([tmp.name], huella_previa)
+
+
+def huella_entidades(rutas):
+    """Huella SHA-256 de las entidades (geometría WKB + atributos) de las rutas GDAL.
+
+    Se calcula sobre los datos ya leídos y no sobre los bytes de la respuesta:
+    GeoServer sella cada respuesta con un timeStamp distinto.
+    """
+    sha = hashlib.sha256()
+    for ruta in rutas:
+        ds = ogr.Open(ruta)
+        if ds is None:
+            raise RuntimeError(f"GDAL no puede abrir {ruta}")
+        for i in range(ds.GetLayerCount()):
+            for feature in ds.GetLayer(i):
+                geom = feature.GetGeometryRef()
+                sha.update(geom.ExportToIsoWkb() if geom is not None else b"")
+                sha.update(json.dumps(feature.items(), sort_keys=True, default=str).encode("utf-8"))
+        ds = None
+    return sha.hexdigest()
+
+
+def _descartar_si_igual(rutas, huella_previa):
+    """(rutas, huella); si los datos no han cambiado libera las rutas y devuelve ([], huella)"""
+    huella = huella_entidades(rutas)
+    if huella == huella_previa:
+        liberar_origenes(rutas)
+        return [], huella
+    return rutas, huella
+
+
+def liberar_origenes(origenes):
+    """Borra lo que fetch_wfs_paged() haya dejado en /vsimem/ o en disco (si sigue ahí)"""
+    for origen in origenes:
+        if origen.startswith("/vsi"):
+            ruta = origen.replace("/vsizip/", "", 1)
+            if gdal.VSIStatL(ruta) is not None:
+                gdal.Unlink(ruta)
+        elif os.path.exists(origen):
+            os.unlink(origen)
+
+
+def leer_huella(gpkg_path):
+    """Huella SHA-256 guardada junto al GPKG en la última escritura (o None)"""
+    if not os.path.exists(gpkg_path):
+        return None
+    try:
+        with open(gpkg_path + ".sha256", "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def guardar_huella(gpkg_path, huella):
+    """Actualiza el fichero .sha256 de forma atómica"""
+    tmp = gpkg_path + ".sha256.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(huella)
+    os.replace(tmp, gpkg_path + ".sha256")
+
+
+def _directorio_staging():
+    """Directorio en RAM (tmpfs) si existe; si no, el temporal del sistema"""
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return tempfile.gettempdir()
+
+
+# Extensión y opciones de capa por driver de salida. GPKG se escribe sin índice
+# (se construye al final en bloque); FlatGeobuf lleva el índice en el propio
+# fichero, no necesita SQLite y admite lectura remota vía /vsicurl/.
+FORMATOS_ESCRITURA = {
+    "GPKG": (".gpkg", ["SPATIAL_INDEX=NO"]),
+    "FlatGeobuf": (".fgb", ["SPATIAL_INDEX=YES"]),
+}
+
+
+def _ruta_staging(extension):
+    """Ruta libre en el directorio de staging (el fichero no se crea)"""
+    fd, ruta = tempfile.mkstemp(suffix=extension, dir=_directorio_staging())
+    os.close(fd)
+    os.unlink(ruta)
+    return ruta
+
+
+def _origen_unico(origenes, nombre_capa):
+    """
+    Un solo origen para VectorTranslate: el propio si solo hay uno o, si hay
+    varias páginas, un VRT en /vsimem/ que las une en una capa (FlatGeobuf
+    no admite añadir entidades a un fichero ya escrito).
+    """
+    if len(origenes) == 1:
+        return origenes[0]
+    capas = []
+    for k, origen in enumerate(origenes):
+        ds = ogr.Open(origen)
+        if ds is None:
+            raise RuntimeError(f"No se pudo abrir {origen}")
+        capas.append(
+            f'<OGRVRTLayer name="p{k}"><SrcDataSource>{escape(origen)}</SrcDataSource>'
+            f'<SrcLayer>{escape(ds.GetLayer(0).GetName())}</SrcLayer></OGRVRTLayer>'
+        )
+        ds = None
+    vrt = f"/vsimem/{nombre_capa}_union.vrt"
+    nombre_xml = escape(nombre_capa, {'"': "&quot;"})
+    xml = (
+        f'<OGRVRTDataSource><OGRVRTUnionLayer name="{nombre_xml}">'
+        f'{"".join(capas)}</OGRVRTUnionLayer></OGRVRTDataSource>'
     )
-    print("✅ Capa descargada")
-else:
-    print("❌ Error cargando capa")
\ No newline at end of file
+    gdal.FileFromMemBuffer(vrt, xml.encode("utf-8"))
+    return vrt
+
+
+def save(origenes, path, fmt="GPKG"):
+    """Genera la capa en un directorio temporal (RAM) y la mueve al destino ya terminada"""
+    if fmt not in FORMATOS_ESCRITURA:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    if isinstance(origenes, str):
+        origenes = [origenes]
+    extension, _ = FORMATOS_ESCRITURA[fmt]
+    nombre_capa = os.path.splitext(os.path.basename(path))[0]
+    tmp_path = _ruta_staging(extension)
+    ordenado = None
+    try:
+        if fmt == "GPKG":
+            # FlatGeobuf con índice guarda las entidades en orden de curva de Hilbert;
+            # volcándolo después al GPKG, la tabla y el RTree quedan con buena
+            # localidad de página, vengan las páginas en GeoJSON o en binario
+            ordenado = _ruta_staging(".fgb")
+            _escribir_capa(origenes, ordenado, nombre_capa, "FlatGeobuf")
+            _escribir_capa([ordenado], tmp_path, nombre_capa, fmt)
+        else:
+            _escribir_capa(origenes, tmp_path, nombre_capa, fmt)
+
+        # Mover al destino: copia a un fichero hermano y os.replace atómico,
+        # así nunca queda un fichero a medio escribir en la ruta final
+        destino_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(destino_dir, exist_ok=True)
+        parcial = path + ".part"
+        shutil.move(tmp_path, parcial)
+        os.replace(parcial, path)
+    finally:
+        for ruta in (tmp_path, ordenado):
+            if ruta and os.path.exists(ruta):
+                os.unlink(ruta)
+
+
+def write_gpkg(origenes, gpkg_path):
+    """Atajo de save() para GeoPackage"""
+    save(origenes, gpkg_path, fmt="GPKG")
+
+
+def _escribir_capa(origenes, path, nombre_capa, fmt):
+    """Vuelca los orígenes (ficheros, /vsimem/ o URI "WFS:") a una capa y, en GPKG, construye el RTree al final"""
+    gdal.UseExceptions()
+    gdal.SetConfigOption("OGR_SQLITE_CACHE", "512")
+    gdal.SetConfigOption("OGR_SQLITE_SYNCHRONOUS", "OFF")
+    gdal.SetConfigOption("SQLITE_USE_OGR_VFS", "YES")
+    gdal.SetConfigOption("OGR_SQLITE_JOURNAL", "MEMORY")
+    # Si el origen es el propio servicio WFS, el driver pagina automáticamente
+    gdal.SetConfigOption("OGR_WFS_PAGING_ALLOWED", "ON")
+    gdal.SetConfigOption("OGR_WFS_PAGE_SIZE", "10000")
+    _, layer_options = FORMATOS_ESCRITURA[fmt]
+
+    # Todas las páginas en una sola pasada (VRT de unión si hay varias)
+    origen = _origen_unico(origenes, nombre_capa)
+    try:
+        ds = gdal.VectorTranslate(
+            path,
+            origen,
+            format=fmt,
+            layerName=nombre_capa,
+            layerCreationOptions=layer_options,
+            # Agrupar inserciones en transacciones grandes (equivalente a -gt 100000)
+            options=["-gt", "100000"],
+        )
+        if ds is None:
+            raise RuntimeError(f"No se pudo escribir {path}")
+        ds = None
+    finally:
+        if origen not in origenes:
+            gdal.Unlink(origen)
+    for origen in origenes:
+        if origen.startswith(("/vsimem/", "/vsizip//vsimem/")):
+            gdal.Unlink(origen.replace("/vsizip/", "", 1))
+
+    if fmt != "GPKG":
+        return
+
+    # Construcción masiva del RTree en memoria (mucho más rápida que por entidad)
+    gdal.SetConfigOption("OGR_GPKG_MAX_RAM_USAGE_RTREE", "536870912")
+    ds = ogr.Open(path, update=1)
+    lyr = ds.GetLayer(0)
+    ds.StartTransaction()
+    ds.ExecuteSQL(
+        f"SELECT CreateSpatialIndex('{lyr.GetName()}', '{lyr.GetGeometryColumn()}')"
+    )
+    ds.CommitTransaction()
+    ds = None
+
+
+WFS_URL = "https://mapas-gis-inter.carm.es/geoserver/SIT_USU_PLA_URB_CARM/wfs"
+LAYER_NAME = "SIT_USU_PLA_URB_CARM:clases_plu_ze_37mun"
+GPKG_SALIDA = "capas_urbanisticas/murcia/clasificacion_suelo.gpkg"
+
+
+def main():
+    # Ejemplo: Descargar de Murcia
+    # Descargar por páginas y volcar a GPKG directamente con OGR (sin capa QGIS en memoria)
+    origenes = []
+    try:
+        origenes, huella = fetch_wfs_paged(WFS_URL, LAYER_NAME, huella_previa=leer_huella(GPKG_SALIDA))
+        if not origenes:
+            logger.info("↩ Capa vacía o sin cambios, no se reescribe el GPKG")
+            return
+        write_gpkg(origenes, GPKG_SALIDA)
+        guardar_huella(GPKG_SALIDA, huella)
+        logger.info("✅ Capa descargada")
+    except Exception as e:
+        logger.error(f"❌ Error cargando capa: {e}")
+        sys.exit(1)
+    finally:
+        # El GeoJSON temporal (o las páginas en /vsimem/ si la escritura falló)
+        liberar_origenes(origenes)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    main()
@@ -3,8 +3,23 @@
 afecciones/__init__.py
 Módulo de análisis de afecciones vectoriales y generación de PDFs
 """
-def get_vector_analyzer():
-    from .vector_analyzer import VectorAnalyzer
-    return VectorAnalyzer
+import functools
 
-__all__ = ['VectorAnalyzer', 'AfeccionesPDF']
\ No newline at end of file
+
+@functools.cache
+def _load(name):
+    # Importación diferida y única: geopandas/reportlab solo se cargan al primer acceso
+    if name == "VectorAnalyzer":
+        from .vector_analyzer import VectorAnalyzer
+        return VectorAnalyzer
+    if name == "AfeccionesPDF":
+        from .pdf_generator import AfeccionesPDF
+        return AfeccionesPDF
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __getattr__(name):
+    return _load(name)
+
+
+__all__ = ['VectorAnalyzer', 'AfeccionesPDF']
@@ -423,6 +423,25 @@ class AfeccionesPDF:
             c.drawString(x, y, "Error generando tabla de afecciones específicas")
 
 
+def generar_pdf_en_proceso(
+    output_dir: str,
+    referencia: str,
+    resultados: Dict,
+    mapas: List[str],
+    incluir_tabla: bool = True
+) -> Optional[Path]:
+    """
+    Punto de entrada para un ProcessPoolExecutor: solo recibe datos
+    serializables y crea el generador dentro del proceso hijo
+    """
+    return AfeccionesPDF(output_dir=output_dir).generar(
+        referencia=referencia,
+        resultados=resultados,
+        mapas=mapas,
+        incluir_tabla=incluir_tabla
+    )
+
+
 # Testing
 if __name__ == "__main__":
     import sys
@@ -1,7 +1,9 @@
+import json
 import os
 import sqlite3
 import pandas as pd
 import geopandas as gpd
+import shapely
 import matplotlib.pyplot as plt
 try:
     import contextily as cx
@@ -14,6 +16,15 @@ from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
 from mpl_toolkits.axes_grid1.anchored_artists import AnchoredSizeBar
 from pathlib import Path
+from typing import NamedTuple
+
+
+class ParcelaPrecargada(NamedTuple):
+    """Parcela ya leída y reproyectada, reutilizable entre capas"""
+    gdf: gpd.GeoDataFrame
+    geometria: object
+    area: float
+
 
 class VectorAnalyzer:
     def __init__(self, capas_dir="capas", crs_objetivo="EPSG:25830", urbanismo_service=None):
@@ -27,32 +38,65 @@ class VectorAnalyzer:
         Analiza intersección entre parcela y capa vectorial
         
         Args:
-            parcela_path: Ruta al archivo de la parcela (GML/GeoJSON)
+            parcela_path: Ruta al archivo de la parcela (GML/GeoJSON) o su contenido en bytes
             capa_input: Ruta o nombre del archivo de la capa
             campo_clasificacion: Campo para clasificar afecciones
             layer: Nombre de la capa específica (para archivos multicapa)
         """
         try:
-            import os
-            import warnings
-            
-            # Suprimir advertencias de GeoPandas
-            warnings.filterwarnings('ignore', category=UserWarning)
-            
-            parcela_path = Path(parcela_path)
-            
-            # Cargar geometría parcela
-            parcela_gdf = gpd.read_file(parcela_path)
-            if parcela_gdf.crs != self.crs_objetivo:
-                parcela_gdf = parcela_gdf.to_crs(self.crs_objetivo)
-            
-            geom_parcela = parcela_gdf.union_all()
-            area_total = geom_parcela.area
+            parcela = self.cargar_parcela(parcela_path)
+        except Exception as e:
+            print(f"Error en VectorAnalyzer.analizar: {e}")
+            return {"error": str(e), "afecciones": []}
+        return self.analizar_parcela_precargada(parcela, capa_input, campo_clasificacion, layer)
+
+    def cargar_parcela(self, parcela_path):
+        """
+        Lee la parcela una vez y la reproyecta al CRS objetivo.
+
+        parcela_path puede ser una ruta o el contenido del archivo en bytes
+        (KML/GeoJSON subido), que se lee desde memoria sin pasar por disco.
+        """
+        import warnings
+
+        # Suprimir advertencias de GeoPandas
+        warnings.filterwarnings('ignore', category=UserWarning)
+
+        if isinstance(parcela_path, (bytes, bytearray)):
+            parcela_gdf = gpd.read_file(BytesIO(parcela_path))
+        else:
+            parcela_gdf = gpd.read_file(Path(parcela_path))
+        if parcela_gdf.crs != self.crs_objetivo:
+            parcela_gdf = parcela_gdf.to_crs(self.crs_objetivo)
+
+        geom_parcela = parcela_gdf.union_all()
+        # Geometría preparada: el filtro intersects de cada capa la reutiliza sin reconstruir índices
+        shapely.prepare(geom_parcela)
+        # GEOS construye los índices internos de la geometría preparada en el primer
+        # predicado que la usa; se fuerza aquí, antes de compartirla entre los hilos
+        # de análisis (que sueltan el GIL), con un punto interior y una línea que
+        # cruza el borde (localizador de puntos e índice de segmentos)
+        if not geom_parcela.is_empty:
+            minx, miny, maxx, maxy = geom_parcela.bounds
+            punto = geom_parcela.representative_point()
+            linea = shapely.LineString([(minx - 1, punto.y), (maxx + 1, punto.y)])
+            shapely.intersects(geom_parcela, [punto, linea])
+        return ParcelaPrecargada(parcela_gdf, geom_parcela, geom_parcela.area)
+
+    def analizar_parcela_precargada(self, parcela, capa_input, campo_clasificacion="tipo", layer=None):
+        """
+        Igual que analizar() pero con la parcela ya cargada (ver cargar_parcela),
+        para no releer el GML en cada capa
+        """
+        try:
+            parcela_gdf, geom_parcela, area_total = parcela
 
             # Cargar la capa usando el servicio de urbanismo o directamente
             capa_gdf = None
             if self.urbanismo_service:
-                capa_gdf = self.urbanismo_service.obtener_o_descargar_capa(capa_input, layer=layer)
+                capa_gdf = self.urbanismo_service.obtener_o_descargar_capa(
+                    capa_input, layer=layer, bbox=parcela_gdf.geometry
+                )
                 if capa_gdf is None:
                     return {"error": f"Capa {capa_input} no encontrada o no pudo ser descargada", "afecciones": []}
             else:
@@ -72,10 +116,12 @@ class VectorAnalyzer:
                 
                 # Cargar capa directamente
                 os.environ['OGR_GEOJSON_MAX_OBJ_SIZE'] = '50'  # 50 MB
-                if layer and capa_path.suffix.lower() == '.gpkg':
-                    capa_gdf = gpd.read_file(capa_path, layer=layer)
-                else:
-                    capa_gdf = gpd.read_file(capa_path)
+                # Lectura filtrada por la extensión de la parcela (índice espacial si existe)
+                opciones = {"layer": layer} if layer and capa_path.suffix.lower() == '.gpkg' else {}
+                try:
+                    capa_gdf = gpd.read_file(capa_path, bbox=parcela_gdf.geometry, **opciones)
+                except Exception:
+                    capa_gdf = gpd.read_file(capa_path, **opciones)
             
             if capa_gdf.crs != self.crs_objetivo:
                 capa_gdf = capa_gdf.to_crs(self.crs_objetivo)
@@ -126,6 +172,110 @@ class VectorAnalyzer:
             print(f"Error en VectorAnalyzer.analizar: {e}")
             return {"error": str(e), "afecciones": []}
 
+    # ------------------------------------------------------------
+    # Overlay precalculado de todas las capas
+    # ------------------------------------------------------------
+    def construir_overlay(self, capas, destino, campo_clasificacion="tipo"):
+        """
+        Une todas las capas en un único FlatGeobuf con columnas _capa/_clase
+
+        Junto al .fgb se guarda un .json con las capas que contiene (ver
+        capas_de_overlay): las que no se pudieron leer no están y hay que
+        analizarlas aparte.
+
+        Args:
+            capas: Iterable de (nombre_capa, ruta_archivo)
+            destino: Ruta del .fgb a generar (con índice espacial)
+            campo_clasificacion: Campo que da la clase dentro de cada capa
+        """
+        destino = Path(destino)
+        partes = []
+        incluidas = []
+        for nombre, ruta in capas:
+            try:
+                gdf = gpd.read_file(ruta)
+            except Exception as e:
+                print(f"⚠️ Overlay: no se pudo leer {nombre}: {e}")
+                continue
+            incluidas.append(nombre)
+            if gdf.empty:
+                continue
+            if gdf.crs and gdf.crs != self.crs_objetivo:
+                gdf = gdf.to_crs(self.crs_objetivo)
+            if campo_clasificacion in gdf.columns:
+                clase = gdf[campo_clasificacion].astype(str).where(gdf[campo_clasificacion].notna(), None)
+            else:
+                clase = "General"
+            partes.append(gpd.GeoDataFrame(
+                {"_capa": nombre, "_clase": clase},
+                geometry=gdf.geometry.values,
+                crs=self.crs_objetivo,
+            ))
+
+        if not partes:
+            return None
+
+        overlay = gpd.GeoDataFrame(pd.concat(partes, ignore_index=True), crs=self.crs_objetivo)
+        tmp = destino.with_name(f"{destino.stem}.tmp{destino.suffix}")
+        overlay.to_file(tmp, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+        indice = destino.with_suffix(".json")
+        indice_tmp = indice.with_name(f"{indice.stem}.tmp{indice.suffix}")
+        indice_tmp.write_text(json.dumps(incluidas, ensure_ascii=False), encoding="utf-8")
+        os.replace(indice_tmp, indice)
+        os.replace(tmp, destino)
+        print(f"✅ Overlay de afecciones generado: {destino.name} ({len(partes)} capas, {len(overlay)} geometrías)")
+        return destino
+
+    def capas_de_overlay(self, overlay_path):
+        """Nombres de las capas incluidas en el overlay, o None si no se sabe"""
+        try:
+            return set(json.loads(Path(overlay_path).with_suffix(".json").read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            return None
+
+    def analizar_overlay(self, parcela_path, overlay_path):
+        """
+        Analiza la parcela contra el overlay precalculado en una sola consulta
+
+        Devuelve {nombre_capa: resultado} con el mismo formato que analizar();
+        las capas sin intersección no aparecen.
+        """
+        parcela_gdf, geom_parcela, area_total = self.cargar_parcela(parcela_path)
+
+        # Lectura filtrada por bbox usando el índice espacial del FlatGeobuf
+        candidatas = gpd.read_file(overlay_path, bbox=tuple(geom_parcela.bounds))
+        if candidatas.crs != self.crs_objetivo:
+            candidatas = candidatas.to_crs(self.crs_objetivo)
+        candidatas = candidatas[candidatas.intersects(geom_parcela)]
+        if candidatas.empty:
+            return {}
+
+        interseccion = gpd.overlay(parcela_gdf, candidatas, how="intersection")
+        if interseccion.empty:
+            return {}
+        interseccion["area_afectada"] = interseccion.geometry.area
+
+        resultados = {}
+        for capa, grupo in interseccion.groupby("_capa"):
+            total_afectado = grupo["area_afectada"].sum()
+            total_percent = (total_afectado / area_total) * 100
+            por_clase = grupo.groupby("_clase")["area_afectada"].sum()
+            resultados[capa] = {
+                "afecciones": [
+                    {
+                        "clase": str(clase),
+                        "area_m2": round(area, 2),
+                        "porcentaje": round((area / area_total) * 100, 2)
+                    }
+                    for clase, area in por_clase.items()
+                ],
+                "total_afectado_percent": round(total_percent, 2),
+                "total_afectado_m2": round(total_afectado, 2),
+                "area_parcela_m2": round(area_total, 2),
+                "afecciones_detectadas": True
+            }
+        return resultados
+
     # ------------------------------------------------------------
     # Configuración y Utilidades
     # ------------------------------------------------------------
@@ -4,7 +4,16 @@ catastro/__init__.py
 Módulo de descarga y procesamiento de datos catastrales
 """
 
-from .catastro_downloader import CatastroDownloader
-from .lote_manager import LoteManager
 
-__all__ = ['CatastroDownloader', 'LoteManager']
\ No newline at end of file
+def __getattr__(name):
+    # Importación diferida: evita cargar requests/shapely/geopandas al importar el paquete
+    if name == "CatastroDownloader":
+        from .catastro_downloader import CatastroDownloader
+        return CatastroDownloader
+    if name == "LoteManager":
+        from .lote_manager import LoteManager
+        return LoteManager
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['CatastroDownloader', 'LoteManager']
@@ -14,6 +14,11 @@ from shapely.geometry import shape, Polygon, MultiPolygon, Point
 from shapely.ops import transform
 from pyproj import Transformer
 
+from config.http_session import SESSION
+
+# Formatos que ya vienen comprimidos (se guardan en el ZIP sin deflate)
+EXT_YA_COMPRIMIDAS = {".png", ".jpg", ".jpeg", ".pdf", ".zip"}
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
@@ -34,15 +39,19 @@ except ImportError:
     GEOTOOLS_AVAILABLE = False
     PILLOW_AVAILABLE = False
 
-def safe_get(url, params=None, headers=None, timeout=30, max_retries=2, method='get', json_body=None):
-    """Wrapper con reintentos para requests"""
+def safe_get(url, params=None, headers=None, timeout=30, max_retries=0, method='get', json_body=None):
+    """
+    Wrapper con reintentos para requests. SESSION ya reintenta conexiones y
+    502/503/504 (config/http_session.py); max_retries añade vueltas completas
+    por encima de esos reintentos, por eso por defecto es 0.
+    """
     last_exc = None
     for attempt in range(max_retries + 1):
         try:
             if method.lower() == 'get':
-                r = requests.get(url, params=params, headers=headers, timeout=timeout)
+                r = SESSION.get(url, params=params, headers=headers, timeout=timeout)
             else:
-                r = requests.post(url, params=params, headers=headers, json=json_body, timeout=timeout)
+                r = SESSION.post(url, params=params, headers=headers, json=json_body, timeout=timeout)
             return r
         except requests.exceptions.RequestException as e:
             last_exc = e
@@ -86,7 +95,7 @@ class CatastroDownloader:
                 "http://ovc.catastro.meh.es/OVCServWeb/OVCWcfCallejero/"
                 f"COVCCallejero.svc/json/Geo_RCToWGS84/{ref}"
             )
-            response = requests.get(url_json, timeout=30)
+            response = SESSION.get(url_json, timeout=30)
 
             if response.status_code == 200:
                 data = response.json()
@@ -97,7 +106,7 @@ class CatastroDownloader:
                 ):
                     lon = float(data["geo"]["xcen"])
                     lat = float(data["geo"]["ycen"])
-                    print(f"  Coordenadas obtenidas (JSON): Lon={lon}, Lat={lat}")
+                    logger.info(f"  Coordenadas obtenidas (JSON): Lon={lon}, Lat={lat}")
                     return {"lon": lon, "lat": lat, "srs": "EPSG:4326"}
         except Exception as e:
             # print(f"  ⚠ Método JSON falló: {e}")
@@ -116,7 +125,7 @@ class CatastroDownloader:
                 "srsname": "EPSG:4326",
             }
 
-            response = requests.get(url_gml, params=params, timeout=30)
+            response = SESSION.get(url_gml, params=params, timeout=30)
             if response.status_code == 200:
                 root = ET.fromstring(response.content)
 
@@ -144,7 +153,7 @@ class CatastroDownloader:
                             else: # Por defecto (Lat, Lon)
                                 lat, lon = v1, v2
                                 
-                            print(f"  Coordenadas extraídas del GML: Lon={lon}, Lat={lat}")
+                            logger.info(f"  Coordenadas extraídas del GML: Lon={lon}, Lat={lat}")
                             return {"lon": lon, "lat": lat, "srs": "EPSG:4326"}
 
                     # Buscar posList (coordenadas de polígono)
@@ -163,7 +172,7 @@ class CatastroDownloader:
                             else:
                                 lat, lon = v1, v2
                                 
-                            print(f"  Coordenadas extraídas del GML (PosList): Lon={lon}, Lat={lat}")
+                            logger.info(f"  Coordenadas extraídas del GML (PosList): Lon={lon}, Lat={lat}")
                             return {"lon": lon, "lat": lat, "srs": "EPSG:4326"}
         except Exception as e:
             # print(f"  ⚠ Extracción de GML falló: {e}")
@@ -177,7 +186,7 @@ class CatastroDownloader:
             )
             params = {"SRS": "EPSG:4326", "RC": ref}
 
-            response = requests.get(url, params=params, timeout=30)
+            response = SESSION.get(url, params=params, timeout=30)
             if response.status_code == 200:
                 root = ET.fromstring(response.content)
                 coords_element = root.find(
@@ -198,13 +207,13 @@ class CatastroDownloader:
                         if xcen is not None and ycen is not None:
                             lon = float(xcen.text)
                             lat = float(ycen.text)
-                            print(f"  Coordenadas obtenidas (XML): Lon={lon}, Lat={lat}")
+                            logger.info(f"  Coordenadas obtenidas (XML): Lon={lon}, Lat={lat}")
                             return {"lon": lon, "lat": lat, "srs": "EPSG:4326"}
         except Exception as e:
             # print(f"  ⚠ Método XML falló: {e}")
             pass
 
-        print("  ✗ No se pudieron obtener coordenadas por ningún método")
+        logger.error("  ✗ No se pudieron obtener coordenadas por ningún método")
         return None
 
     def convertir_coordenadas_a_etrs89(self, lon, lat):
@@ -250,11 +259,11 @@ class CatastroDownloader:
         filename = self.output_dir / f"{ref}_consulta_oficial.pdf"
         
         if os.path.exists(filename):
-            print(f"  ↩ PDF oficial ya existe")
+            logger.info(f"  ↩ PDF oficial ya existe")
             return True
         
         try:
-            response = requests.get(url, timeout=30)
+            response = SESSION.get(url, timeout=30)
                 
             if response.status_code == 200:
                 # Verificar si hay contenido (incluso si no es PDF)
@@ -265,19 +274,19 @@ class CatastroDownloader:
                     # Verificar el tipo de contenido para informar
                     content_type = response.headers.get("Content-Type", "")
                     if content_type.startswith("application/pdf"):
-                        print(f"  ✓ PDF oficial descargado: {filename}")
+                        logger.info(f"  ✓ PDF oficial descargado: {filename}")
                     else:
-                        print(f"  ✓ Archivo oficial descargado (tipo: {content_type}): {filename}")
+                        logger.info(f"  ✓ Archivo oficial descargado (tipo: {content_type}): {filename}")
                     return True
                 else:
-                    print(f"  ✗ PDF oficial vacío (Status {response.status_code})")
+                    logger.error(f"  ✗ PDF oficial vacío (Status {response.status_code})")
                     return False
             else:
-                print(f"  ✗ PDF oficial falló (Status {response.status_code})")
+                logger.error(f"  ✗ PDF oficial falló (Status {response.status_code})")
                 return False
                     
         except Exception as e:
-            print(f"  ✗ Error descargando PDF: {e}")
+            logger.error(f"  ✗ Error descargando PDF: {e}")
             return False
 
     # --------- NUEVO: utilidades de geometría / contorno ---------
@@ -311,14 +320,14 @@ class CatastroDownloader:
                         coords.append((float(parts[0]), float(parts[1])))
 
             if coords:
-                print(f"  ✓ Extraídas {len(coords)} coordenadas del GML")
+                logger.info(f"  ✓ Extraídas {len(coords)} coordenadas del GML")
                 return coords
 
-            print("  ⚠ No se encontraron coordenadas en el GML")
+            logger.warning("  ⚠ No se encontraron coordenadas en el GML")
             return None
 
         except Exception as e:
-            print(f"  ⚠ Error extrayendo coordenadas del GML: {e}")
+            logger.warning(f"  ⚠ Error extrayendo coordenadas del GML: {e}")
             return None
 
     def convertir_coordenadas_a_pixel(self, coords, bbox, width, height):
@@ -369,7 +378,7 @@ class CatastroDownloader:
             return pixels
 
         except Exception as e:
-            print(f"  ⚠ Error convirtiendo coordenadas a píxeles: {e}")
+            logger.warning(f"  ⚠ Error convirtiendo coordenadas a píxeles: {e}")
             return None
 
     def dibujar_contorno_en_imagen(
@@ -377,7 +386,7 @@ class CatastroDownloader:
     ):
         """Dibuja el contorno de la parcela sobre una imagen existente."""
         if not PILLOW_AVAILABLE:
-            print("  ⚠ Pillow no disponible, no se puede dibujar contorno")
+            logger.warning("  ⚠ Pillow no disponible, no se puede dibujar contorno")
             return False
 
         try:
@@ -398,11 +407,11 @@ class CatastroDownloader:
             # Combina la imagen original con la capa de contorno
             result = Image.alpha_composite(img, overlay).convert("RGB")
             result.save(output_path)
-            print(f"  ✓ Contorno dibujado en {output_path}")
+            logger.info(f"  ✓ Contorno dibujado en {output_path}")
             return True
 
         except Exception as e:
-            print(f"  ⚠ Error dibujando contorno: {e}")
+            logger.warning(f"  ⚠ Error dibujando contorno: {e}")
             return False
 
     def superponer_contorno_parcela(self, ref, bbox_wgs84):
@@ -422,7 +431,7 @@ class CatastroDownloader:
                 break
         
         if not gml_file:
-            print("  ⚠ No existe GML de parcela, no se puede dibujar contorno")
+            logger.warning("  ⚠ No existe GML de parcela, no se puede dibujar contorno")
             return False
 
         coords = self.extraer_coordenadas_gml(gml_file)
@@ -459,7 +468,7 @@ class CatastroDownloader:
                     ):
                         exito = True
                 except Exception as e:
-                    print(f"  ⚠ Error procesando imagen {in_path}: {e}")
+                    logger.warning(f"  ⚠ Error procesando imagen {in_path}: {e}")
 
         return exito
     
@@ -469,11 +478,11 @@ class CatastroDownloader:
         """Descarga el plano con ortofoto usando servicios WMS y guarda geolocalización."""
         ref = self.limpiar_referencia(referencia)
 
-        print("  Obteniendo coordenadas...")
+        logger.info("  Obteniendo coordenadas...")
         coords = self.obtener_coordenadas(ref)
 
         if not coords:
-            print("  ✗ No se pudieron obtener coordenadas para generar el plano")
+            logger.error("  ✗ No se pudieron obtener coordenadas para generar el plano")
             return False
 
         lon = coords["lon"]
@@ -486,7 +495,7 @@ class CatastroDownloader:
             f"{coords_list[1]},{coords_list[0]},{coords_list[3]},{coords_list[2]}"
         )
 
-        print("  Generando mapa con ortofoto...")
+        logger.info("  Generando mapa con ortofoto...")
 
         wms_url = "http://ovc.catastro.meh.es/Cartografia/WMS/ServidorWMS.aspx"
 
@@ -506,7 +515,7 @@ class CatastroDownloader:
 
         try:
             # Plano catastral
-            response_catastro = requests.get(
+            response_catastro = SESSION.get(
                 wms_url, params=params, timeout=60
             )
 
@@ -519,9 +528,9 @@ class CatastroDownloader:
                 )
                 with open(filename_catastro, "wb") as f:
                     f.write(response_catastro.content)
-                print(f"  ✓ Plano catastral descargado: {filename_catastro}")
+                logger.info(f"  ✓ Plano catastral descargado: {filename_catastro}")
             else:
-                print("  ⚠ Error descargando plano catastral")
+                logger.warning("  ⚠ Error descargando plano catastral")
 
             ortofotos_descargadas = False
 
@@ -541,7 +550,7 @@ class CatastroDownloader:
                     "FORMAT": "image/jpeg",
                 }
 
-                response_pnoa = requests.get(
+                response_pnoa = SESSION.get(
                     wms_pnoa_url, params=params_pnoa, timeout=60
                 )
 
@@ -554,7 +563,7 @@ class CatastroDownloader:
                     )
                     with open(filename_ortofoto, "wb") as f:
                         f.write(response_pnoa.content)
-                    print(
+                    logger.info(
                         f"  ✓ Ortofoto PNOA descargada: {filename_ortofoto}"
                     )
                     ortofotos_descargadas = True
@@ -587,21 +596,21 @@ class CatastroDownloader:
                                 self.output_dir / f"{ref}_plano_con_ortofoto.png"
                             )
                             resultado.save(filename_composicion, "PNG")
-                            print(
+                            logger.info(
                                 f"  ✓ Composición creada: {filename_composicion}"
                             )
                         except Exception as e:
-                            print(
+                            logger.warning(
                                 f"  ⚠ No se pudo crear composición: {e}"
                             )
                     else:
                         if not PILLOW_AVAILABLE:
-                            print(
+                            logger.warning(
                                 "  ⚠ Composición omitida (Pillow no instalado)"
                             )
 
             except Exception as e:
-                print(f"  ⚠ PNOA no disponible: {e}")
+                logger.warning(f"  ⚠ PNOA no disponible: {e}")
 
             # Ortofoto Catastro como respaldo
             if not ortofotos_descargadas:
@@ -621,7 +630,7 @@ class CatastroDownloader:
                         "TRANSPARENT": "FALSE",
                     }
 
-                    response_orto = requests.get(
+                    response_orto = SESSION.get(
                         wms_catastro_orto, params=params_orto, timeout=60
                     )
 
@@ -634,16 +643,16 @@ class CatastroDownloader:
                         )
                         with open(filename_ortofoto, "wb") as f:
                             f.write(response_orto.content)
-                        print(
+                        logger.info(
                             f"  ✓ Ortofoto Catastro descargada: {filename_ortofoto}"
                         )
                         ortofotos_descargadas = True
                 except Exception as e:
-                    print(f"  ⚠ Ortofoto Catastro no disponible: {e}")
+                    logger.warning(f"  ⚠ Ortofoto Catastro no disponible: {e}")
 
             if not ortofotos_descargadas:
-                print("  ⚠ No se pudieron descargar ortofotos automáticamente")
-                print(
+                logger.warning("  ⚠ No se pudieron descargar ortofotos automáticamente")
+                logger.info(
                     f"  📍 Google Maps: https://www.google.com/maps/search/?api=1&query={lat},{lon}"
                 )
 
@@ -666,7 +675,7 @@ class CatastroDownloader:
             filename_geo = self.output_dir / f"{ref}_geolocalizacion.json"
             with open(filename_geo, "w", encoding="utf-8") as f:
                 json.dump(geo_info, f, indent=2, ensure_ascii=False)
-            print(f"  ✓ Información de geolocalización guardada: {filename_geo}")
+            logger.info(f"  ✓ Información de geolocalización guardada: {filename_geo}")
 
             # DIBUJAR CONTORNO
             self.superponer_contorno_parcela(ref, bbox_wgs84)
@@ -674,7 +683,7 @@ class CatastroDownloader:
             return True
 
         except Exception as e:
-            print(f"  ✗ Error descargando plano con ortofoto: {e}")
+            logger.error(f"  ✗ Error descargando plano con ortofoto: {e}")
             return False
 
     def descargar_consulta_pdf(self, referencia):
@@ -698,31 +707,31 @@ class CatastroDownloader:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=30)
+            response = SESSION.get(url, params=params, timeout=30)
             if response.status_code == 200:
                 # Guardar directamente en el directorio de salida (sin subcarpeta gml)
                 filename = self.output_dir / f"{ref}_parcela.gml"
                 
                 # Verificar si es un error XML (ExceptionReport)
                 if b'ExceptionReport' in response.content or b'Exception' in response.content:
-                    print(f"  ⚠ Parcela GML no disponible para {ref} (Exception Report en la respuesta)")
+                    logger.warning(f"  ⚠ Parcela GML no disponible para {ref} (Exception Report en la respuesta)")
                     return False
 
                 with open(filename, 'wb') as f:
                     f.write(response.content)
-                print(f"  ✓ Parcela GML descargada: {filename}")
+                logger.info(f"  ✓ Parcela GML descargada: {filename}")
                 return True
             else:
-                print(f"  ✗ Error descargando parcela GML para {ref}: Status {response.status_code}")
+                logger.error(f"  ✗ Error descargando parcela GML para {ref}: Status {response.status_code}")
                 return False
         except Exception as e:
-            print(f"  ✗ Error descargando parcela GML para {ref}: {e}")
+            logger.error(f"  ✗ Error descargando parcela GML para {ref}: {e}")
             return False
     
     def convertir_gml_a_kml(self, gml_path, kml_path=None):
         """Convierte un archivo GML a KML usando GeoPandas."""
         if not GEOTOOLS_AVAILABLE:
-            print("  ⚠ GeoPandas no disponible, no se puede convertir a KML")
+            logger.warning("  ⚠ GeoPandas no disponible, no se puede convertir a KML")
             return False
         
         try:
@@ -731,7 +740,7 @@ class CatastroDownloader:
             
             gml_file = Path(gml_path)
             if not gml_file.exists():
-                print(f"  ✗ Archivo GML no encontrado: {gml_path}")
+                logger.error(f"  ✗ Archivo GML no encontrado: {gml_path}")
                 return False
             
             # Si no se especifica ruta de salida, usar el mismo nombre con extensión .kml
@@ -771,11 +780,11 @@ class CatastroDownloader:
             
             # Guardar como KML
             gdf.to_file(kml_path, driver='KML')
-            print(f"  ✓ KML generado: {kml_path}")
+            logger.info(f"  ✓ KML generado: {kml_path}")
             return True
             
         except Exception as e:
-            print(f"  ✗ Error convirtiendo GML a KML: {e}")
+            logger.error(f"  ✗ Error convirtiendo GML a KML: {e}")
             return False
     
     def generar_kmls_desde_gmls(self, ref):
@@ -786,7 +795,7 @@ class CatastroDownloader:
         archivos_gml = list(self.output_dir.glob(f"{ref}*.gml"))
         
         if not archivos_gml:
-            print("  ⚠ No se encontraron archivos GML para convertir a KML")
+            logger.warning("  ⚠ No se encontraron archivos GML para convertir a KML")
             return False
         
         exito = False
@@ -812,32 +821,32 @@ class CatastroDownloader:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=30)
+            response = SESSION.get(url, params=params, timeout=30)
             if response.status_code == 200:
                 # Verificar que no sea un error XML
                 content = response.content
                 if b'ExceptionReport' in content or b'Exception' in content:
-                    print(f"  ⚠ Edificio GML no disponible para {ref} (puede ser solo parcela)")
+                    logger.warning(f"  ⚠ Edificio GML no disponible para {ref} (puede ser solo parcela)")
                     return False
                     
                 # Guardar directamente en el directorio de salida (sin subcarpeta gml)
                 filename = self.output_dir / f"{ref}_edificio.gml"
                 with open(filename, 'wb') as f:
                     f.write(content)
-                print(f"  ✓ Edificio GML descargado: {filename}")
+                logger.info(f"  ✓ Edificio GML descargado: {filename}")
                 return True
             else:
-                print(f"  ✗ Error descargando edificio GML para {ref}: Status {response.status_code}")
+                logger.error(f"  ✗ Error descargando edificio GML para {ref}: Status {response.status_code}")
                 return False
         except Exception as e:
-            print(f"  ✗ Error descargando edificio GML para {ref}: {e}")
+            logger.error(f"  ✗ Error descargando edificio GML para {ref}: {e}")
             return False
 
     def descargar_todo(self, referencia):
         """Descarga todos los documentos para una referencia catastral."""
-        print(f"\n{'='*60}")
-        print(f"Procesando referencia: {referencia}")
-        print(f"{'='*60}")
+        logger.info(f"\n{'='*60}")
+        logger.info(f"Procesando referencia: {referencia}")
+        logger.info(f"{'='*60}")
 
         ref = self.limpiar_referencia(referencia)
         # Se usa una subcarpeta por referencia para organizar las descargas
@@ -860,12 +869,12 @@ class CatastroDownloader:
         
         # Generar archivos KML a partir de los GML descargados
         if parcela_gml_descargado or resultados.get('edificio_gml'):
-            print("  🗺️ Generando archivos KML...")
+            logger.info("  🗺️ Generando archivos KML...")
             self.generar_kmls_desde_gmls(ref)
         
         # Generar Plano Perfecto (imagen con geometría sobre ortofoto)
         if parcela_gml_descargado and GEOTOOLS_AVAILABLE:
-            print("  🎨 Generando Plano Perfecto...")
+            logger.info("  🎨 Generando Plano Perfecto...")
             try:
                 gml_path = self.output_dir / f"{ref}_parcela.gml"
                 if gml_path.exists():
@@ -882,7 +891,7 @@ class CatastroDownloader:
                     )
                     resultados['plano_perfecto'] = True
             except Exception as e:
-                print(f"  ⚠ Error generando Plano Perfecto: {e}")
+                logger.warning(f"  ⚠ Error generando Plano Perfecto: {e}")
                 resultados['plano_perfecto'] = False
 
         self.output_dir = old_dir # Se restaura el directorio de salida
@@ -905,13 +914,18 @@ class CatastroDownloader:
             zip_path = self.output_dir / f"{referencia}_completo.zip"
             
             with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                def _escribir(file_path, arcname):
+                    # PNG/PDF/ZIP ya vienen comprimidos: deflate solo gastaría CPU
+                    compresion = zipfile.ZIP_STORED if file_path.suffix.lower() in EXT_YA_COMPRIMIDAS else None
+                    zipf.write(file_path, arcname, compress_type=compresion)
+
                 # 1. Archivos del directorio principal de la referencia
                 if ref_dir.exists():
                     for file_path in ref_dir.rglob('*'):
                         if file_path.is_file():
                             # Ruta relativa dentro del ZIP
                             zip_path_relative = file_path.relative_to(ref_dir)
-                            zipf.write(file_path, zip_path_relative)
+                            _escribir(file_path, zip_path_relative)
                 
                 # 2. Archivos del directorio urbanismo (con timestamp)
                 urbanismo_base = self.output_dir / "urbanismo"
@@ -922,12 +936,12 @@ class CatastroDownloader:
                                 if file_path.is_file():
                                     # Ruta relativa: urbanismo/timestamp/archivo
                                     zip_path_relative = Path("urbanismo") / urbanismo_dir.name / file_path.relative_to(urbanismo_dir)
-                                    zipf.write(file_path, zip_path_relative)
+                                    _escribir(file_path, zip_path_relative)
                 
                 # 3. Buscar y añadir archivos CSV técnicos si existen
                 csv_files = list(self.output_dir.glob(f"{referencia}_datos_tecnicos.csv"))
                 for csv_file in csv_files:
-                    zipf.write(csv_file, csv_file.name)
+                    _escribir(csv_file, csv_file.name)
                 
                 # 4. Crear un manifiesto de contenidos
                 manifest = {
@@ -936,32 +950,27 @@ class CatastroDownloader:
                     "archivos_incluidos": []
                 }
                 
-                # Guardar el ZIP temporalmente para poder leerlo y crear el manifiesto
-                zipf.close()
-                
-                # Contar archivos en el ZIP
-                with zipfile.ZipFile(zip_path, 'r') as zip_check:
-                    for file_info in zip_check.filelist:
-                        # Convertir date_time tuple a timestamp
-                        date_tuple = file_info.date_time
-                        timestamp = time.mktime(date_tuple + (0, 0, -1))  # Ajustar para mktime
-                        
-                        manifest["archivos_incluidos"].append({
-                            "ruta": file_info.filename,
-                            "tamaño": file_info.file_size,
-                            "fecha": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
-                        })
-                
-                # Reabrir el ZIP para añadir el manifiesto
-                with zipfile.ZipFile(zip_path, 'a', zipfile.ZIP_DEFLATED) as zipf_add:
-                    manifest_json = json.dumps(manifest, indent=2, ensure_ascii=False)
-                    zipf_add.writestr("manifesto.json", manifest_json)
+                # Las entradas ya escritas están en memoria: no hace falta cerrar,
+                # releer y reabrir el ZIP en modo 'a' para listar su contenido
+                for file_info in zipf.infolist():
+                    # Convertir date_time tuple a timestamp
+                    date_tuple = file_info.date_time
+                    timestamp = time.mktime(date_tuple + (0, 0, -1))  # Ajustar para mktime
+
+                    manifest["archivos_incluidos"].append({
+                        "ruta": file_info.filename,
+                        "tamaño": file_info.file_size,
+                        "fecha": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+                    })
+
+                manifest_json = json.dumps(manifest, indent=2, ensure_ascii=False)
+                zipf.writestr("manifesto.json", manifest_json)
                 
-            print(f"  📦 ZIP completo creado: {zip_path}")
+            logger.info(f"  📦 ZIP completo creado: {zip_path}")
             return True, zip_path
                 
         except Exception as e:
-            print(f"Error en descargar_todo_completo: {e}")
+            logger.error(f"Error en descargar_todo_completo: {e}")
             return False, None
 
     def generar_plano_perfecto(self, gml_path, output_path, ref, info_afecciones=None):
@@ -970,7 +979,7 @@ class CatastroDownloader:
         Este método es requerido por main.py para la generación de informes.
         """
         try:
-            print(f"  🎨 Generando Plano Perfecto para {ref}...")
+            logger.info(f"  🎨 Generando Plano Perfecto para {ref}...")
             
             # Si no tenemos tools gráficas, fallamos suavemente copiado la composición si existe
             if not GEOTOOLS_AVAILABLE:
@@ -979,84 +988,87 @@ class CatastroDownloader:
                 if composicion.exists():
                      import shutil
                      shutil.copy(composicion, output_path)
-                     print(f"  ✓ Plano Perfecto (copia simple) generado en: {output_path}")
+                     logger.info(f"  ✓ Plano Perfecto (copia simple) generado en: {output_path}")
                      return True
                 return False
 
             # Cargar GML
             gdf = gpd.read_file(gml_path).to_crs(epsg=3857)
             
-            # Configurar plot
+            # Configurar plot. Solo API de objetos (ax/fig): con referencias de un lote
+            # procesándose en varios hilos, plt.title/savefig/close() sin figura
+            # actuarían sobre la figura "actual" de otro hilo
             fig, ax = plt.subplots(figsize=(12, 12))
-            
-            # Calcular bounds con margen
-            minx, miny, maxx, maxy = gdf.total_bounds
-            margin_x = (maxx - minx) * 0.2
-            margin_y = (maxy - miny) * 0.2
-            
-            ax.set_xlim(minx - margin_x, maxx + margin_x)
-            ax.set_ylim(miny - margin_y, maxy + margin_y)
-            
-            # Añadir mapa base (PNOA)
             try:
-                cx.add_basemap(ax, crs=gdf.crs.to_string(), source=cx.providers.Ign.PNOA_M, attribution=False)
-            except:
-                # Fallback a OpenStreetMap si PNOA falla
-                cx.add_basemap(ax, crs=gdf.crs.to_string(), source=cx.providers.OpenStreetMap.Mapnik)
-            
-            # Dibujar Parcela
-            gdf.plot(ax=ax, facecolor="none", edgecolor="#FF0000", linewidth=2.5, zorder=10)
-            gdf.plot(ax=ax, facecolor="#FF0000", alpha=0.1, zorder=9) # Relleno sutil
-            
-            # Añadir título y etiquetas
-            plt.title(f"Referencia Catastral: {ref}", fontsize=16, pad=20)
-            
-            if info_afecciones and info_afecciones.get("total_afectado_percent", 0) > 0:
-                ax.text(0.02, 0.98, f"⚠️ AFECCIONES DETECTADAS\n{info_afecciones.get('total_afectado_percent')}% Afectado", 
-                        transform=ax.transAxes, fontsize=12, color='white', 
-                        bbox=dict(facecolor='red', alpha=0.7))
-            
-            # Quitar ejes
-            ax.axis("off")
-            
-            # Guardar
-            plt.savefig(output_path, dpi=150, bbox_inches='tight', pad_inches=0.1)
-            plt.close()
-            
-            print(f"  ✓ Plano Perfecto generado: {output_path}")
+                # Calcular bounds con margen
+                minx, miny, maxx, maxy = gdf.total_bounds
+                margin_x = (maxx - minx) * 0.2
+                margin_y = (maxy - miny) * 0.2
+
+                ax.set_xlim(minx - margin_x, maxx + margin_x)
+                ax.set_ylim(miny - margin_y, maxy + margin_y)
+
+                # Añadir mapa base (PNOA)
+                try:
+                    cx.add_basemap(ax, crs=gdf.crs.to_string(), source=cx.providers.Ign.PNOA_M, attribution=False)
+                except:
+                    # Fallback a OpenStreetMap si PNOA falla
+                    cx.add_basemap(ax, crs=gdf.crs.to_string(), source=cx.providers.OpenStreetMap.Mapnik)
+
+                # Dibujar Parcela
+                gdf.plot(ax=ax, facecolor="none", edgecolor="#FF0000", linewidth=2.5, zorder=10)
+                gdf.plot(ax=ax, facecolor="#FF0000", alpha=0.1, zorder=9) # Relleno sutil
+
+                # Añadir título y etiquetas
+                ax.set_title(f"Referencia Catastral: {ref}", fontsize=16, pad=20)
+
+                if info_afecciones and info_afecciones.get("total_afectado_percent", 0) > 0:
+                    ax.text(0.02, 0.98, f"⚠️ AFECCIONES DETECTADAS\n{info_afecciones.get('total_afectado_percent')}% Afectado", 
+                            transform=ax.transAxes, fontsize=12, color='white', 
+                            bbox=dict(facecolor='red', alpha=0.7))
+
+                # Quitar ejes
+                ax.axis("off")
+
+                # Guardar
+                fig.savefig(output_path, dpi=150, bbox_inches='tight', pad_inches=0.1)
+            finally:
+                plt.close(fig)
+
+            logger.info(f"  ✓ Plano Perfecto generado: {output_path}")
             return True
 
         except Exception as e:
-            print(f"  ⚠ Error generando Plano Perfecto: {e}")
+            logger.warning(f"  ⚠ Error generando Plano Perfecto: {e}")
             return False
 
     def procesar_lista(self, lista_referencias):
         """Procesa una lista de referencias catastrales"""
-        print(f"\\nIniciando descarga de {len(lista_referencias)} referencias...")
-        print(f"Directorio de salida: {self.output_dir}\\n")
+        logger.info(f"\\nIniciando descarga de {len(lista_referencias)} referencias...")
+        logger.info(f"Directorio de salida: {self.output_dir}\\n")
         
         resultados_totales = []
         
         for i, ref in enumerate(lista_referencias, 1):
-            print(f"\\n[{i}/{len(lista_referencias)}]")
+            logger.info(f"\\n[{i}/{len(lista_referencias)}]")
             resultados = self.descargar_todo(ref)
             resultados_totales.append({
                 'referencia': ref,
                 'resultados': resultados
             })
 
-        print(f"\\n{'='*60}")
-        print("RESUMEN DE DESCARGAS")
-        print(f"{'='*60}")
+        logger.info(f"\\n{'='*60}")
+        logger.info("RESUMEN DE DESCARGAS")
+        logger.info(f"{'='*60}")
         
         for item in resultados_totales:
             ref = item['referencia']
             res = item['resultados']
             exitos = sum(1 for v in res.values() if v)
-            print(f"\\n{ref}: {exitos}/{len(res)} categorías completadas")
+            logger.info(f"\\n{ref}: {exitos}/{len(res)} categorías completadas")
             for doc, exitoso in res.items():
                 estado = "✓" if exitoso else "✗"
-                print(f"  {estado} {doc}")
+                logger.info(f"  {estado} {doc}")
 
 
 # Ejemplo de uso
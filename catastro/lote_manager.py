@@ -4,17 +4,274 @@ catastro/lote_manager.py
 Gestor de procesamiento de lotes de referencias catastrales
 """
 
+import io
 import json
+import os
+import queue
 import time
 import csv
+import copy
+import itertools
 import zipfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Tuple, NamedTuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Serializador JSON rápido si está instalado; stdlib como respaldo
+try:
+    import orjson
+
+    def _json_loads(data: bytes):
+        return orjson.loads(data)
+
+    def _json_dumps_bytes(obj, pretty: bool = False) -> bytes:
+        opciones = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, default=str, option=opciones)
+
+    def _json_linea(obj) -> bytes:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    def _json_loads(data: bytes):
+        return json.loads(data)
+
+    def _json_dumps_bytes(obj, pretty: bool = False) -> bytes:
+        if pretty:
+            return json.dumps(obj, indent=2, ensure_ascii=False, default=str).encode("utf-8")
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode("utf-8")
+
+    def _json_linea(obj) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+# Archivos de cada referencia que entran en el ZIP del lote, por carpeta destino.
+# Imágenes: SOLO con contorno o plano perfecto (se ignoran las originales)
+PATRONES_ZIP_LOTE = [
+    ("GML", ("*.gml", "*.kml", "gml/*.gml", "gml/*.kml")),
+    ("PDF", ("*.pdf", "pdf/*.pdf")),
+    ("Imagenes", tuple(
+        f"{sub}*{clave}*.{ext}"
+        for sub in ("", "images/")
+        for clave in ("contorno", "plano_perfecto")
+        for ext in ("png", "jpg", "jpeg")
+    )),
+]
+
+# Formatos ya comprimidos: se guardan sin DEFLATE en el ZIP del lote
+EXT_YA_COMPRIMIDAS = {".png", ".jpg", ".jpeg", ".pdf", ".zip"}
+
+
+def _compresion_zip(path: Path) -> int:
+    """ZIP_STORED para formatos ya comprimidos, ZIP_DEFLATED para texto"""
+    return zipfile.ZIP_STORED if path.suffix.lower() in EXT_YA_COMPRIMIDAS else zipfile.ZIP_DEFLATED
+
+
+_FIN_ZIP = object()
+
+
+class _SalidaZip(io.RawIOBase):
+    """
+    Destino no posicionable para un ZipFile que se escribe en otro hilo: agrupa
+    lo escrito en bloques de tam_bloque y los entrega por una cola acotada, así
+    la memoria no depende del tamaño del lote
+    """
+
+    def __init__(self, tam_bloque: int, max_pendientes: int = 4):
+        super().__init__()
+        self._tam_bloque = tam_bloque
+        self._buffer = bytearray()
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self.cancelada = threading.Event()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer += b
+        if len(self._buffer) >= self._tam_bloque:
+            self._entregar(bytes(self._buffer))
+            self._buffer.clear()
+        return len(b)
+
+    def _entregar(self, item):
+        # Espera a que el consumidor avance; si ha abandonado, corta la escritura
+        while not self.cancelada.is_set():
+            try:
+                self._cola.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise OSError("Descarga del ZIP cancelada")
+
+    def terminar(self, error: BaseException = None):
+        """Entrega lo pendiente y la marca de fin (o el error del productor)"""
+        if error is None and self._buffer:
+            self._entregar(bytes(self._buffer))
+            self._buffer.clear()
+        self._entregar(_FIN_ZIP if error is None else error)
+
+    def bloques(self) -> Iterator[bytes]:
+        while True:
+            item = self._cola.get()
+            if item is _FIN_ZIP:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+class _PlotStack(NamedTuple):
+    gpd: object
+    pd: object
+    plt: object
+    cx: object
+
+
+_PLOT: Optional[_PlotStack] = None
+
+
+def _get_plot_stack() -> _PlotStack:
+    """Importa geopandas/pandas/matplotlib/contextily la primera vez que se pinta un mapa"""
+    global _PLOT
+    if _PLOT is None:
+        # Importaciones diferidas: quien no genera mapas no carga esta pila
+        import geopandas as gpd
+        import pandas as pd
+        import matplotlib
+        matplotlib.use('Agg') # Usar backend no interactivo
+        import matplotlib.pyplot as plt
+        import contextily as cx
+        _PLOT = _PlotStack(gpd, pd, plt, cx)
+    return _PLOT
+
+def _listar_por_sufijo(directorio: Path, sufijo: str) -> List[Tuple[str, str]]:
+    """(nombre, ruta) de los archivos de un directorio con ese sufijo, en una sola pasada de scandir"""
+    if not os.path.isdir(directorio):
+        return []
+    with os.scandir(directorio) as it:
+        return [(e.name, e.path) for e in it if e.name.endswith(sufijo) and e.is_file()]
+
+def _num_archivos(datos: Dict) -> int:
+    """Número de archivos generados por una referencia (precalculado en _procesar_una)"""
+    if "num_archivos" in datos:
+        return datos["num_archivos"]
+    archivos = datos.get("archivos") or {}
+    return (
+        (1 if archivos.get("gml_parcela") else 0)
+        + (1 if archivos.get("ficha_catastral") else 0)
+        + len(archivos.get("imagenes", []))
+        + len(archivos.get("json", []))
+    )
+
+# Estados de lote que obtener_estado mantiene en memoria
+ESTADOS_EN_CACHE = 8
+
+# Filas de la tabla HTML mientras el lote sigue en curso (la completa se genera al final)
+FILAS_HTML_PARCIAL = 50
+
+
+# Plantillas del resumen HTML (str.format)
+HTML_RESUMEN_CABECERA = """<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Resumen Lote {lote_id}</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; margin: 20px; background: #f5f5f5; }}
+        .container {{ max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; }}
+        .header {{ display: flex; justify-content: space-between; align-items: center; border-bottom: 3px solid #4CAF50; padding-bottom: 10px; margin-bottom: 20px; }}
+        h1 {{ color: #333; margin: 0; }}
+        .btn-download {{ 
+            background-color: #2196F3; color: white; padding: 10px 20px; 
+            text-decoration: none; border-radius: 5px; font-weight: bold; 
+            transition: background 0.3s;
+            display: inline-block; cursor: pointer;
+        }}
+        .btn-download:hover {{ background-color: #1976D2; }}
+        .stats {{ display: flex; gap: 20px; margin: 20px 0; }}
+        .stat-card {{ flex: 1; padding: 20px; border-radius: 8px; text-align: center; }}
+        .stat-card.success {{ background: #4CAF50; color: white; }}
+        .stat-card.error {{ background: #f44336; color: white; }}
+        .stat-card.total {{ background: #2196F3; color: white; }}
+        .stat-number {{ font-size: 48px; font-weight: bold; }}
+        .stat-label {{ font-size: 14px; margin-top: 5px; }}
+        table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
+        th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
+        th {{ background: #f0f0f0; font-weight: bold; }}
+        .exitoso {{ color: #4CAF50; }}
+        .error {{ color: #f44336; }}
+        .badge {{ padding: 4px 8px; border-radius: 4px; font-size: 12px; }}
+        .badge.success {{ background: #4CAF50; color: white; }}
+        .badge.fail {{ background: #f44336; color: white; }}
+        .badge.processing {{ background: #FF9800; color: white; }}
+    </style>
+    {script_reload}
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>📦 Resumen Lote: {lote_id}</h1>
+            <a href="/api/v1/lote/{lote_id}/zip" class="btn-download" target="_blank">⬇️ Descargar ZIP Completo</a>
+        </div>
+        
+        <!-- Mapa Global -->
+        <div style="margin: 20px 0; text-align: center; background: #fff; padding: 15px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1);">
+            <h2 style="margin-top: 0;">🗺️ Vista Global del Lote</h2>
+            <p style="color: #666; font-size: 0.9em;">Visualización conjunta de todas las parcelas procesadas sobre ortofoto PNOA</p>
+            <img src="/outputs/_lotes/{lote_id}_mapa_global.png" style="max-width: 100%; height: auto; border-radius: 4px; border: 1px solid #ddd;" onerror="this.style.display='none'">
+        </div>
+
+        <div class="stats">
+            <div class="stat-card total">
+                <div class="stat-number">{total_referencias}</div>
+                <div class="stat-label">Total Referencias</div>
+            </div>
+            <div class="stat-card success">
+                <div class="stat-number">{exitosas}</div>
+                <div class="stat-label">Exitosas</div>
+            </div>
+            <div class="stat-card error">
+                <div class="stat-number">{fallidas}</div>
+                <div class="stat-label">Fallidas</div>
+            </div>
+        </div>
+        
+        <h2>Detalle de Referencias</h2>
+        <table>
+            <thead>
+                <tr>
+                    <th>Referencia</th>
+                    <th>Estado</th>
+                    <th>Archivos Generados</th>
+                </tr>
+            </thead>
+            <tbody>
+"""
+
+HTML_RESUMEN_FILA = """
+                <tr>
+                    <td><strong>{ref}</strong></td>
+                    <td><span class="badge {badge}">{texto}</span></td>
+                    <td>{num_archivos} archivos</td>
+                </tr>
+"""
+
+HTML_RESUMEN_PIE = """
+            </tbody>
+        </table>
+        
+        <p style="text-align: center; color: #666; margin-top: 40px;">
+            Generado automáticamente por Suite Tasación dnogares
+        </p>
+    </div>
+</body>
+</html>
+"""
+
 
 class LoteManager:
     """
@@ -22,7 +279,7 @@ class LoteManager:
     Mantiene estado y genera reportes de progreso
     """
     
-    def __init__(self, output_dir: str = "outputs"):
+    def __init__(self, output_dir: str = "outputs", min_interval: float = 0.2, max_concurrentes: int = 4, flush_every: int = 5):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
@@ -32,28 +289,121 @@ class LoteManager:
         
         self.lote_id = None
         self.estado_actual = {}
+        self._seq = itertools.count()
+        
+        # Últimos estados leídos: lote_id -> (firma de archivos, estado)
+        self._estado_cache: "OrderedDict[str, Tuple[tuple, dict]]" = OrderedDict()
+        self._estado_cache_lock = threading.Lock()
+        
+        # Huellas de la última generación de cada resumen (se omite si no cambia)
+        self._last_html_hash = None
+        self._last_csv_hash = None
+        self._last_mapa_hash = None
+        
+        # Escrituras de estado en segundo plano (un solo hilo: conserva el orden)
+        self._escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lote-escritor")
+        
+        # Limitador de peticiones a Catastro (sustituye a la pausa fija de 1 s)
+        self._min_interval = min_interval
+        self._last_call = 0.0
+        self._limiter_lock = threading.Lock()
+        self._semaforo_descargas = threading.Semaphore(max_concurrentes)
+        
+        # Cada cuántas referencias terminadas se vuelca el estado y los resúmenes
+        self._flush_every = max(1, flush_every)
+        self._dirty_count = 0
+    
+    def _esperar_turno(self):
+        """Espera solo si la última descarga empezó hace menos de min_interval"""
+        with self._limiter_lock:
+            elapsed = time.monotonic() - self._last_call
+            if elapsed < self._min_interval:
+                time.sleep(self._min_interval - elapsed)
+            self._last_call = time.monotonic()
     
     def generar_lote_id(self) -> str:
-        """Genera ID único para el lote"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        return f"lote_{timestamp}"
+        """Genera ID único para el lote (el contador evita colisiones en el mismo segundo)"""
+        return f"lote_{time.strftime('%Y%m%d_%H%M%S')}_{next(self._seq):03d}"
+    
+    def _refs_path(self, lote_id: str) -> Path:
+        """Ruta del JSONL con un resultado por referencia terminada"""
+        return self.lotes_dir / f"{lote_id}_refs.jsonl"
+    
+    def _drenar_escrituras(self):
+        """Espera a que el hilo escritor termine todo lo encolado"""
+        self._escritor.submit(lambda: None).result()
     
-    def guardar_estado(self, lote_id: str, estado: dict):
-        """Guarda estado del lote en archivo JSON"""
+    def _anotar_referencia(self, lote_id: str, resultado_ref: dict):
+        """Añade el resultado de una referencia al JSONL del lote (O(1) por referencia)"""
+        try:
+            with open(self._refs_path(lote_id), 'ab') as f:
+                f.write(_json_linea(resultado_ref))
+        except Exception as e:
+            logger.error(f"Error anotando referencia: {e}")
+    
+    def _reescribir_referencias(self, lote_id: str, referencias: dict):
+        """Reescribe el JSONL del lote en el orden de `referencias` (sustitución atómica)"""
+        try:
+            refs_path = self._refs_path(lote_id)
+            tmp_path = refs_path.with_suffix('.jsonl.tmp')
+            with open(tmp_path, 'wb') as f:
+                for resultado_ref in referencias.values():
+                    f.write(_json_linea(resultado_ref))
+            os.replace(tmp_path, refs_path)
+        except Exception as e:
+            logger.error(f"Error reescribiendo referencias: {e}")
+    
+    def guardar_estado(self, lote_id: str, estado: dict, pretty: bool = False):
+        """Guarda la cabecera del lote (contadores) en archivo JSON
+        
+        El detalle por referencia vive en {lote_id}_refs.jsonl. Durante el
+        proceso se escribe compacto; pretty=True solo para la instantánea final.
+        """
         try:
             estado_path = self.lotes_dir / f"{lote_id}_estado.json"
-            with open(estado_path, 'w', encoding='utf-8') as f:
-                json.dump(estado, f, indent=2, ensure_ascii=False)
+            tmp_path = estado_path.with_suffix('.json.tmp')
+            cabecera = {k: v for k, v in estado.items() if k != "referencias"}
+            tmp_path.write_bytes(_json_dumps_bytes(cabecera, pretty))
+            # Sustitución atómica: un lector nunca ve el JSON a medio escribir
+            os.replace(tmp_path, estado_path)
         except Exception as e:
             logger.error(f"Error guardando estado: {e}")
     
     def obtener_estado(self, lote_id: str) -> Optional[dict]:
-        """Recupera estado de un lote"""
+        """Recupera estado de un lote (memoizado mientras no cambien sus archivos)"""
         try:
             estado_path = self.lotes_dir / f"{lote_id}_estado.json"
             if estado_path.exists():
-                with open(estado_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                refs_path = self._refs_path(lote_id)
+                st = estado_path.stat()
+                st_refs = refs_path.stat() if refs_path.exists() else None
+                firma = (
+                    st.st_mtime_ns, st.st_size,
+                    st_refs.st_mtime_ns if st_refs else None,
+                    st_refs.st_size if st_refs else None,
+                )
+                with self._estado_cache_lock:
+                    cacheado = self._estado_cache.get(lote_id)
+                    if cacheado and cacheado[0] == firma:
+                        self._estado_cache.move_to_end(lote_id)
+                        return cacheado[1]
+                
+                estado = _json_loads(estado_path.read_bytes())
+                # Lotes antiguos guardaban las referencias dentro del propio JSON
+                referencias = estado.setdefault("referencias", {})
+                if st_refs:
+                    with open(refs_path, 'rb') as f:
+                        for linea in f:
+                            if linea.strip():
+                                ref = _json_loads(linea)
+                                referencias[ref["referencia"]] = ref
+                
+                with self._estado_cache_lock:
+                    self._estado_cache[lote_id] = (firma, estado)
+                    self._estado_cache.move_to_end(lote_id)
+                    while len(self._estado_cache) > ESTADOS_EN_CACHE:
+                        self._estado_cache.popitem(last=False)
+                return estado
         except Exception as e:
             logger.error(f"Error leyendo estado: {e}")
         return None
@@ -64,7 +414,8 @@ class LoteManager:
         downloader, 
         analyzer=None, 
         pdf_gen=None,
-        lote_id: str = None
+        lote_id: str = None,
+        workers: int = 8
     ) -> Dict:
         """
         Procesa una lista de referencias catastrales
@@ -75,6 +426,7 @@ class LoteManager:
             analyzer: Instancia de VectorAnalyzer (opcional)
             pdf_gen: Instancia de AfeccionesPDF (opcional)
             lote_id: ID del lote pre-generado (opcional)
+            workers: Número máximo de referencias procesadas en paralelo
         
         Returns:
             dict: Resumen del procesamiento
@@ -86,10 +438,13 @@ class LoteManager:
             
         logger.info(f"📦 Iniciando lote: {self.lote_id}")
         
-        total = len(referencias)
+        # Normalizar una sola vez y descartar duplicados (conservando el orden)
+        refs_norm = list(dict.fromkeys(r.replace(' ', '').strip().upper() for r in referencias))
+        total = len(refs_norm)
+        ultima_fin = datetime.now().isoformat()
         resultados = {
             "lote_id": self.lote_id,
-            "fecha_inicio": datetime.now().isoformat(),
+            "fecha_inicio": ultima_fin,
             "total_referencias": total,
             "procesadas": 0,
             "exitosas": 0,
@@ -98,127 +453,60 @@ class LoteManager:
         }
         
         # Guardar estado inicial
+        self._refs_path(self.lote_id).unlink(missing_ok=True)
         self.guardar_estado(self.lote_id, resultados)
         
-        for idx, ref in enumerate(referencias, 1):
-            ref_limpia = ref.replace(' ', '').strip().upper()
-            logger.info(f"\n[{idx}/{total}] Procesando: {ref_limpia}")
-            
-            resultado_ref = {
-                "referencia": ref_limpia,
-                "estado": "procesando",
-                "inicio": datetime.now().isoformat(),
-                "archivos": {}
+        lock = threading.Lock()
+        max_workers = max(1, min(workers, total))
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            futuros = {
+                ex.submit(self._procesar_una, ref_limpia, downloader, analyzer, pdf_gen): ref_limpia
+                for ref_limpia in refs_norm
             }
-            
-            try:
-                # 1. Descargar datos catastrales
-                logger.info("  📥 Descargando datos...")
-                exito, zip_path = downloader.descargar_todo_completo(ref_limpia)
+            for futuro in as_completed(futuros):
+                resultado_ref = futuro.result()
+                ref_limpia = resultado_ref["referencia"]
                 
-                if exito:
-                    resultado_ref["estado"] = "exitoso"
-                    resultado_ref["zip"] = str(zip_path) if zip_path else None
-                    
-                    # Recopilar archivos generados
-                    ref_dir = self.output_dir / ref_limpia
-                    resultado_ref["archivos"] = self._recopilar_archivos(ref_dir)
-                    
-                    # 2. Análisis de afecciones (DEACTIVADO por defecto)
-                    # Desactivado para mejorar rendimiento en lotes grandes
-                    # Para activar, cambiar ANALISIS_AFECCIONES_ACTIVO = True
-                    ANALISIS_AFECCIONES_ACTIVO = False
-                    
-                    if ANALISIS_AFECCIONES_ACTIVO and analyzer:
-                        logger.info("  🔍 Analizando afecciones...")
-                        try:
-                            gml_path = ref_dir / "gml" / f"{ref_limpia}_parcela.gml"
-                            if gml_path.exists():
-                                afecciones = analyzer.analizar(
-                                    gml_path,
-                                    "afecciones_totales.gpkg",
-                                    "tipo"
-                                )
-                                resultado_ref["afecciones"] = afecciones
-                                logger.info("    ✅ Afecciones analizadas")
-                        except Exception as e:
-                            logger.warning(f"    ⚠️ Error analizando afecciones: {e}")
+                with lock:
+                    resultados["referencias"][ref_limpia] = resultado_ref
+                    self._escritor.submit(self._anotar_referencia, self.lote_id, resultado_ref)
+                    resultados["procesadas"] += 1
+                    if resultado_ref["estado"] == "exitoso":
+                        resultados["exitosas"] += 1
                     else:
-                        logger.info(f"  📋 Análisis de afecciones desactivado para {ref_limpia}")
-                        resultado_ref["afecciones"] = {
-                            "detalle": {},
-                            "total": 0.0,
-                            "area_total_m2": 0.0,
-                            "afecciones_detectadas": False,
-                            "mensaje": "Análisis de afecciones desactivado. Use el panel 'Análisis Afecciones' para análisis manual."
-                        }
-                    
-                    # 3. Generar PDF (si está disponible)
-                    if pdf_gen and analyzer:
-                        logger.info("  📄 Generando PDF...")
-                        try:
-                            mapas = []
-                            images_dir = ref_dir / "images"
-                            if images_dir.exists():
-                                for img in images_dir.glob(f"{ref_limpia}*zoom4*.png"):
-                                    mapas.append(str(img))
-                                    break
-                            
-                            afecciones = resultado_ref.get("afecciones", {})
-                            
-                            pdf_path = pdf_gen.generar(
-                                referencia=ref_limpia,
-                                resultados=afecciones,
-                                mapas=mapas,
-                                incluir_tabla=bool(afecciones)
-                            )
-                            
-                            if pdf_path:
-                                resultado_ref["archivos"]["pdf_informe"] = str(pdf_path)
-                                logger.info("    ✅ PDF generado")
-                        except Exception as e:
-                            logger.warning(f"    ⚠️ Error generando PDF: {e}")
+                        resultados["fallidas"] += 1
+                    procesadas = resultados["procesadas"]
+                    ultima_fin = resultado_ref["fin"]
+                    logger.info(f"[{procesadas}/{total}] Terminada: {ref_limpia}")
                     
-                    resultados["exitosas"] += 1
-                    logger.info(f"  ✅ {ref_limpia} completado")
-                    
-                else:
-                    resultado_ref["estado"] = "error"
-                    resultado_ref["error"] = "No se pudieron descargar los datos"
-                    resultados["fallidas"] += 1
-                    logger.error(f"  ❌ {ref_limpia} falló")
-                
-            except Exception as e:
-                resultado_ref["estado"] = "error"
-                resultado_ref["error"] = str(e)
-                resultados["fallidas"] += 1
-                logger.error(f"  ❌ Error en {ref_limpia}: {e}")
-            
-            finally:
-                resultado_ref["fin"] = datetime.now().isoformat()
-                resultados["referencias"][ref_limpia] = resultado_ref
-                resultados["procesadas"] += 1
-                
-                # Actualizar estado
-                self.guardar_estado(self.lote_id, resultados)
-                
-                # Generar resumen HTML actualizado en tiempo real
-                self._generar_resumen_html(resultados)
-                self._generar_resumen_csv(resultados)
-                
-                # Pausa entre referencias
-                if idx < total:
-                    time.sleep(1)
+                    # Actualizar contadores y vista parcial (cada pocas referencias);
+                    # CSV y HTML completos solo al terminar
+                    self._dirty_count += 1
+                    if self._dirty_count >= self._flush_every and procesadas < total:
+                        # Instantánea: el hilo escritor no ve las mutaciones posteriores
+                        recientes = list(resultados["referencias"].items())[-FILAS_HTML_PARCIAL:]
+                        snapshot = {**resultados, "referencias": dict(recientes)}
+                        self._escritor.submit(self.guardar_estado, self.lote_id, snapshot)
+                        self._escritor.submit(self._generar_resumen_html, snapshot, FILAS_HTML_PARCIAL)
+                        self._dirty_count = 0
         
-        # Estado final
-        resultados["fecha_fin"] = datetime.now().isoformat()
+        # Estado final (siempre se escribe, tras vaciar las escrituras pendientes)
+        self._drenar_escrituras()
+        self._dirty_count = 0
+        # Las referencias terminan en cualquier orden; el resultado final (JSONL,
+        # CSV, HTML) sigue el orden de la lista subida
+        resultados["referencias"] = {ref: resultados["referencias"][ref] for ref in refs_norm}
+        self._reescribir_referencias(self.lote_id, resultados["referencias"])
+        # El lote termina cuando termina su última referencia
+        resultados["fecha_fin"] = ultima_fin
         resultados["estado"] = "completado"
-        self.guardar_estado(self.lote_id, resultados)
+        self.guardar_estado(self.lote_id, resultados, pretty=True)
         
         # Generar resumen
         self._generar_resumen_html(resultados)
         self._generar_resumen_csv(resultados)
-        self._generar_mapa_global(resultados)
+        self._generar_mapa_global(resultados, final=True)
         
         logger.info(f"\n{'='*70}")
         logger.info(f"📊 LOTE COMPLETADO: {self.lote_id}")
@@ -229,80 +517,118 @@ class LoteManager:
         
         return resultados
     
-    def empaquetar_lote(self, lote_id: str) -> Optional[Path]:
-        """Empaqueta todos los resultados de un lote en un único ZIP"""
+    def _procesar_una(self, ref_limpia: str, downloader, analyzer=None, pdf_gen=None) -> Dict:
+        """Descarga, analiza y genera el PDF de una referencia ya normalizada; nunca lanza excepción"""
+        logger.info(f"Procesando: {ref_limpia}")
+        
+        resultado_ref = {
+            "referencia": ref_limpia,
+            "estado": "procesando",
+            "inicio": datetime.now().isoformat(),
+            "archivos": {}
+        }
+        
+        # Copia por hilo: descargar_todo() cambia output_dir temporalmente
+        downloader_local = copy.copy(downloader)
+        
         try:
-            estado = self.obtener_estado(lote_id)
-            if not estado:
-                return None
-            
-            # Asegurar que existen los resúmenes actualizados
-            self._generar_resumen_html(estado)
-            self._generar_resumen_csv(estado)
-            self._generar_mapa_global(estado)
+            # 1. Descargar datos catastrales
+            logger.info("  📥 Descargando datos...")
+            with self._semaforo_descargas:
+                self._esperar_turno()
+                exito, zip_path = downloader_local.descargar_todo_completo(ref_limpia)
             
-            zip_filename = self.lotes_dir / f"{lote_id}_full.zip"
-            
-            with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # 1. Incluir resumen HTML
-                resumen_html = self.lotes_dir / f"{lote_id}_resumen.html"
-                if resumen_html.exists():
-                    zipf.write(resumen_html, arcname=f"Resumen_{lote_id}.html")
+            if exito:
+                resultado_ref["estado"] = "exitoso"
+                resultado_ref["zip"] = str(zip_path) if zip_path else None
                 
-                # 2. Incluir resumen CSV
-                resumen_csv = self.lotes_dir / f"{lote_id}_resumen.csv"
-                if resumen_csv.exists():
-                    zipf.write(resumen_csv, arcname=f"Resumen_{lote_id}.csv")
+                # Recopilar archivos generados
+                ref_dir = self.output_dir / ref_limpia
+                resultado_ref["archivos"] = self._recopilar_archivos(ref_dir)
                 
-                # 3. Incluir Mapa Global
-                mapa_global = self.lotes_dir / f"{lote_id}_mapa_global.png"
-                if mapa_global.exists():
-                    zipf.write(mapa_global, arcname=f"Mapa_Global_{lote_id}.png")
+                # 2. Análisis de afecciones (DEACTIVADO por defecto)
+                # Desactivado para mejorar rendimiento en lotes grandes
+                # Para activar, cambiar ANALISIS_AFECCIONES_ACTIVO = True
+                ANALISIS_AFECCIONES_ACTIVO = False
                 
-                # 3b. Incluir GML Global
-                gml_global = self.lotes_dir / f"{lote_id}_global.gml"
-                if gml_global.exists():
-                    zipf.write(gml_global, arcname=f"GML_Global_{lote_id}.gml")
+                if ANALISIS_AFECCIONES_ACTIVO and analyzer:
+                    logger.info("  🔍 Analizando afecciones...")
+                    try:
+                        gml_path = ref_dir / "gml" / f"{ref_limpia}_parcela.gml"
+                        if gml_path.exists():
+                            afecciones = analyzer.analizar(
+                                gml_path,
+                                "afecciones_totales.gpkg",
+                                "tipo"
+                            )
+                            resultado_ref["afecciones"] = afecciones
+                            logger.info("    ✅ Afecciones analizadas")
+                    except Exception as e:
+                        logger.warning(f"    ⚠️ Error analizando afecciones: {e}")
+                else:
+                    logger.info(f"  📋 Análisis de afecciones desactivado para {ref_limpia}")
+                    resultado_ref["afecciones"] = {
+                        "detalle": {},
+                        "total": 0.0,
+                        "area_total_m2": 0.0,
+                        "afecciones_detectadas": False,
+                        "mensaje": "Análisis de afecciones desactivado. Use el panel 'Análisis Afecciones' para análisis manual."
+                    }
                 
-                # 4. Organizar archivos por carpetas de tipo (GML, PDF, Imagenes)
-                referencias = estado.get("referencias", {})
-                for ref, info in referencias.items():
-                    if info.get("estado") != "exitoso":
-                        continue
-                        
-                    ref_limpia = info.get("referencia", ref)
-                    ref_dir = self.output_dir / ref_limpia
-                    
-                    if not ref_dir.exists():
-                        continue
+                # 3. Generar PDF (si está disponible)
+                if pdf_gen and analyzer:
+                    logger.info("  📄 Generando PDF...")
+                    try:
+                        mapas = []
+                        images_dir = ref_dir / "images"
+                        if images_dir.exists():
+                            for img in images_dir.glob(f"{ref_limpia}*zoom4*.png"):
+                                mapas.append(str(img))
+                                break
                         
-                    # Recorrer todos los archivos de la referencia
-                    for file_path in ref_dir.rglob("*"):
-                        if not file_path.is_file():
-                            continue
-                            
-                        filename = file_path.name
-                        filename_lower = filename.lower()
-                        arcname = None
+                        afecciones = resultado_ref.get("afecciones", {})
                         
-                        # GML / KML
-                        if filename_lower.endswith((".gml", ".kml")):
-                            arcname = f"GML/{filename}"
-                            
-                        # PDF
-                        elif filename_lower.endswith(".pdf"):
-                            arcname = f"PDF/{filename}"
-                            
-                        # Imágenes: SOLO con contorno o plano perfecto
-                        elif filename_lower.endswith((".jpg", ".jpeg", ".png")):
-                            # Filtro estricto: solo contorno o plano perfecto
-                            if "contorno" in filename_lower or "plano_perfecto" in filename_lower:
-                                arcname = f"Imagenes/{filename}"
-                            # Ignorar el resto de imágenes (originales sin contorno)
+                        pdf_path = pdf_gen.generar(
+                            referencia=ref_limpia,
+                            resultados=afecciones,
+                            mapas=mapas,
+                            incluir_tabla=bool(afecciones)
+                        )
                         
-                        # Agregar al ZIP si corresponde
-                        if arcname:
-                            zipf.write(file_path, arcname=arcname)
+                        if pdf_path:
+                            resultado_ref["archivos"]["pdf_informe"] = str(pdf_path)
+                            logger.info("    ✅ PDF generado")
+                    except Exception as e:
+                        logger.warning(f"    ⚠️ Error generando PDF: {e}")
+                
+                logger.info(f"  ✅ {ref_limpia} completado")
+                
+            else:
+                resultado_ref["estado"] = "error"
+                resultado_ref["error"] = "No se pudieron descargar los datos"
+                logger.error(f"  ❌ {ref_limpia} falló")
+            
+        except Exception as e:
+            resultado_ref["estado"] = "error"
+            resultado_ref["error"] = str(e)
+            logger.error(f"  ❌ Error en {ref_limpia}: {e}")
+        
+        resultado_ref["num_archivos"] = _num_archivos(resultado_ref)
+        resultado_ref["fin"] = datetime.now().isoformat()
+        return resultado_ref
+    
+    def empaquetar_lote(self, lote_id: str) -> Optional[Path]:
+        """Empaqueta todos los resultados de un lote en un único ZIP"""
+        try:
+            estado = self.obtener_estado(lote_id)
+            if not estado:
+                return None
+            
+            zip_filename = self.lotes_dir / f"{lote_id}_full.zip"
+            
+            with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+                for file_path, arcname, compress_type in self._entradas_zip_lote(lote_id, estado):
+                    zipf.write(file_path, arcname=arcname, compress_type=compress_type)
             
             logger.info(f"📦 ZIP de lote generado: {zip_filename}")
             return zip_filename
@@ -311,13 +637,121 @@ class LoteManager:
             logger.error(f"Error empaquetando lote {lote_id}: {e}")
             return None
 
+    def iterar_zip_lote(self, lote_id: str, tam_bloque: int = 1 << 20) -> Optional[Iterator[bytes]]:
+        """
+        Genera el ZIP del lote al vuelo, en bloques de bytes, sin escribirlo a disco.
+        Devuelve None si el lote no existe.
+        """
+        estado = self.obtener_estado(lote_id)
+        if not estado:
+            return None
+
+        def _bloques():
+            salida = _SalidaZip(tam_bloque)
+
+            # El ZIP se escribe en otro hilo con ZipFile.write (API pública,
+            # lee cada archivo por bloques); aquí solo se reenvían los bloques
+            # según llegan
+            def _producir():
+                try:
+                    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+                        for file_path, arcname, compress_type in self._entradas_zip_lote(lote_id, estado):
+                            zipf.write(file_path, arcname=arcname, compress_type=compress_type)
+                    salida.terminar()
+                except BaseException as e:
+                    try:
+                        salida.terminar(e)
+                    except OSError:
+                        pass  # Consumidor ya desconectado
+
+            threading.Thread(target=_producir, name=f"zip-{lote_id}", daemon=True).start()
+            try:
+                yield from salida.bloques()
+            finally:
+                salida.cancelada.set()
+
+        return _bloques()
+
+    def _entradas_zip_lote(self, lote_id: str, estado: Dict) -> Iterator[Tuple[Path, str, Optional[int]]]:
+        """(ruta, nombre en el ZIP, compresión) de todo lo que va en el ZIP del lote"""
+        # Asegurar que existen los resúmenes actualizados
+        self._generar_resumen_html(estado)
+        self._generar_resumen_csv(estado)
+        self._generar_mapa_global(estado, final=True)
+
+        # 1. Resumen HTML, 2. resumen CSV, 3. mapa global, 3b. GML global
+        for nombre, arcname, compress_type in (
+            (f"{lote_id}_resumen.html", f"Resumen_{lote_id}.html", None),
+            (f"{lote_id}_resumen.csv", f"Resumen_{lote_id}.csv", None),
+            (f"{lote_id}_mapa_global.png", f"Mapa_Global_{lote_id}.png", zipfile.ZIP_STORED),
+            (f"{lote_id}_global.gml", f"GML_Global_{lote_id}.gml", None),
+        ):
+            ruta = self.lotes_dir / nombre
+            if ruta.exists():
+                yield ruta, arcname, compress_type
+
+        # 4. Organizar archivos por carpetas de tipo (GML, PDF, Imagenes)
+        referencias = estado.get("referencias", {})
+        for ref, info in referencias.items():
+            if info.get("estado") != "exitoso":
+                continue
+
+            ref_limpia = info.get("referencia", ref)
+            ref_dir = self.output_dir / ref_limpia
+
+            if not ref_dir.exists():
+                continue
+
+            # Buscar solo los archivos que van al ZIP (raíz y subcarpetas legacy)
+            vistos = set()
+            for carpeta, patrones in PATRONES_ZIP_LOTE:
+                for patron in patrones:
+                    for file_path in ref_dir.glob(patron):
+                        arcname = f"{carpeta}/{file_path.name}"
+                        if arcname not in vistos:
+                            vistos.add(arcname)
+                            yield file_path, arcname, _compresion_zip(file_path)
+
+    def asegurar_resumen(self, lote_id: str) -> Optional[str]:
+        """
+        Regenera el resumen solo si alguna de sus entradas (estado, JSONL de
+        referencias o el propio código que lo pinta) es más reciente que el HTML.
+        Devuelve un ETag de esas entradas, o None si el lote no existe.
+        """
+        estado_path = self.lotes_dir / f"{lote_id}_estado.json"
+        try:
+            mtimes = [estado_path.stat().st_mtime_ns, os.stat(__file__).st_mtime_ns]
+        except OSError:
+            return None
+        try:
+            mtimes.append(self._refs_path(lote_id).stat().st_mtime_ns)
+        except OSError:
+            pass
+        entradas = max(mtimes)
+
+        html_path = self.lotes_dir / f"{lote_id}_resumen.html"
+        try:
+            vigente = html_path.stat().st_mtime_ns >= entradas
+        except OSError:
+            vigente = False
+        if not vigente:
+            if not self.regenerar_resumen(lote_id):
+                return None
+            # Si el contenido no cambió no se reescribe: marcarlo como al día
+            try:
+                if html_path.stat().st_mtime_ns < entradas:
+                    os.utime(html_path)
+            except OSError:
+                pass
+        return f'"{lote_id}-{entradas:x}"'
+
     def regenerar_resumen(self, lote_id: str):
         """Regenera los archivos de resumen (HTML y CSV) desde el estado guardado"""
         estado = self.obtener_estado(lote_id)
         if estado:
             self._generar_resumen_html(estado)
             self._generar_resumen_csv(estado)
-            self._generar_mapa_global(estado)
+            self._generar_mapa_global(estado, final=estado.get("estado") == "completado")
             return True
         return False
 
@@ -337,52 +771,99 @@ class LoteManager:
         
         # GML: Buscar en raíz (nuevo formato) y luego en subcarpeta (legacy)
         # 1. Buscar en raíz
-        for gml in ref_dir.glob("*.gml"):
-            if "parcela" in gml.name:
-                archivos["gml_parcela"] = str(gml)
-            elif "edificio" in gml.name:
-                archivos["gml_edificio"] = str(gml)
+        for nombre, ruta in _listar_por_sufijo(ref_dir, ".gml"):
+            if "parcela" in nombre:
+                archivos["gml_parcela"] = ruta
+            elif "edificio" in nombre:
+                archivos["gml_edificio"] = ruta
         
         # 2. Si no se encontró, buscar en subcarpeta gml
         if not archivos["gml_parcela"] or not archivos["gml_edificio"]:
-            gml_dir = ref_dir / "gml"
-            if gml_dir.exists():
-                for gml in gml_dir.glob("*.gml"):
-                    if "parcela" in gml.name and not archivos["gml_parcela"]:
-                        archivos["gml_parcela"] = str(gml)
-                    elif "edificio" in gml.name and not archivos["gml_edificio"]:
-                        archivos["gml_edificio"] = str(gml)
+            for nombre, ruta in _listar_por_sufijo(ref_dir / "gml", ".gml"):
+                if "parcela" in nombre and not archivos["gml_parcela"]:
+                    archivos["gml_parcela"] = ruta
+                elif "edificio" in nombre and not archivos["gml_edificio"]:
+                    archivos["gml_edificio"] = ruta
         
         # PDFs
-        pdf_dir = ref_dir / "pdf"
-        if pdf_dir.exists():
-            for pdf in pdf_dir.glob("*.pdf"):
-                if "ficha_catastral" in pdf.name:
-                    archivos["ficha_catastral"] = str(pdf)
-        
-        # Imágenes
-        images_dir = ref_dir / "images"
-        if images_dir.exists():
-            archivos["imagenes"] = [str(img) for img in images_dir.glob("*.png")]
-        
-        # JSON
-        json_dir = ref_dir / "json"
-        if json_dir.exists():
-            archivos["json"] = [str(j) for j in json_dir.glob("*.json")]
-        
-        # HTML
-        html_dir = ref_dir / "html"
-        if html_dir.exists():
-            archivos["html"] = [str(h) for h in html_dir.glob("*.html")]
+        for nombre, ruta in _listar_por_sufijo(ref_dir / "pdf", ".pdf"):
+            if "ficha_catastral" in nombre:
+                archivos["ficha_catastral"] = ruta
+        
+        # Imágenes, JSON y HTML
+        archivos["imagenes"] = [ruta for _, ruta in _listar_por_sufijo(ref_dir / "images", ".png")]
+        archivos["json"] = [ruta for _, ruta in _listar_por_sufijo(ref_dir / "json", ".json")]
+        archivos["html"] = [ruta for _, ruta in _listar_por_sufijo(ref_dir / "html", ".html")]
         
         return archivos
     
+    @staticmethod
+    def _huella_resumen(resultados: Dict, *extra) -> int:
+        """Huella barata del estado de un lote para saber si hay que regenerar resúmenes"""
+        return hash((
+            resultados.get("lote_id"),
+            resultados.get("estado"),
+            resultados.get("procesadas"),
+            resultados.get("exitosas"),
+            resultados.get("fallidas"),
+            len(resultados.get("referencias", {})),
+        ) + extra)
+
+    @staticmethod
+    def _row_from_ref(ref: str, datos: Dict) -> Dict:
+        """Fila del CSV de resumen para una referencia"""
+        num_archivos = _num_archivos(datos)
+        
+        # Datos de afecciones (si existen)
+        afecciones = datos.get("afecciones", {})
+        if not isinstance(afecciones, dict): afecciones = {}
+
+        # Extraer datos urbanísticos (Suelo Urbano y Edificabilidad)
+        detalle = afecciones.get("detalle", {})
+        porcentajes = {}
+        for k, v in detalle.items():
+            try:
+                porcentajes[k] = float(v)
+            except (ValueError, TypeError):
+                continue
+        # Sumar porcentaje si es Urbano (excluyendo No Urbano)
+        suelo_urbano_pct = sum((
+            v for k, v in porcentajes.items()
+            if "urbano" in k.lower() and "no" not in k.lower()
+        ), 0.0)
+        # Detectar clasificación mayoritaria
+        clasificacion_principal = max(porcentajes, key=porcentajes.get) if porcentajes else ""
+
+        # Extraer Edificabilidad de parámetros urbanísticos
+        avanzado = afecciones.get("analisis_avanzado", {})
+        params = avanzado.get("parametros_urbanisticos", {})
+        edificabilidad = params.get("edificabilidad", {}).get("valor", "") if params else ""
+
+        return {
+            "referencia": ref,
+            "estado": datos.get("estado", "desconocido"),
+            "fecha_inicio": datos.get("inicio", ""),
+            "fecha_fin": datos.get("fin", ""),
+            "error": datos.get("error", ""),
+            "num_archivos": num_archivos,
+            "afecciones_detectadas": "Sí" if afecciones.get("afecciones_detectadas") else "No",
+            "area_parcela_m2": afecciones.get("area_total_m2", 0.0),
+            "porcentaje_afeccion": afecciones.get("total", 0.0),
+            "suelo_urbano_pct": round(suelo_urbano_pct, 2),
+            "edificabilidad": edificabilidad,
+            "clasificacion_principal": clasificacion_principal
+        }
+
     def _generar_resumen_csv(self, resultados: Dict):
         """Genera resumen CSV del lote con datos clave de todas las parcelas"""
         try:
             lote_id = resultados.get("lote_id", "unknown")
             csv_path = self.lotes_dir / f"{lote_id}_resumen.csv"
             
+            h = self._huella_resumen(resultados)
+            if h == self._last_csv_hash and csv_path.exists():
+                return
+            
             # Definir columnas del CSV
             fieldnames = [
                 "referencia", "estado", "fecha_inicio", "fecha_fin", 
@@ -391,88 +872,49 @@ class LoteManager:
                 "suelo_urbano_pct", "edificabilidad", "clasificacion_principal"
             ]
             
-            with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            tmp_path = csv_path.with_suffix('.csv.tmp')
+            referencias = resultados.get("referencias", {})
+            rows = [self._row_from_ref(ref, datos) for ref, datos in referencias.items()]
+            
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.DictWriter(f, fieldnames=fieldnames)
                 writer.writeheader()
-                
-                referencias = resultados.get("referencias", {})
-                for ref, datos in referencias.items():
-                    # Calcular número de archivos generados
-                    archivos = datos.get("archivos", {})
-                    num_archivos = 0
-                    if archivos:
-                        num_archivos = sum([
-                            1 if archivos.get("gml_parcela") else 0,
-                            1 if archivos.get("ficha_catastral") else 0,
-                            len(archivos.get("imagenes", [])),
-                            len(archivos.get("json", []))
-                        ])
-                    
-                    # Datos de afecciones (si existen)
-                    afecciones = datos.get("afecciones", {})
-                    if not isinstance(afecciones, dict): afecciones = {}
-
-                    # Extraer datos urbanísticos (Suelo Urbano y Edificabilidad)
-                    detalle = afecciones.get("detalle", {})
-                    suelo_urbano_pct = 0.0
-                    clasificacion_principal = ""
-                    max_pct = -1.0
-
-                    for k, v in detalle.items():
-                        try:
-                            val = float(v)
-                            # Sumar porcentaje si es Urbano (excluyendo No Urbano)
-                            if "urbano" in k.lower() and "no" not in k.lower():
-                                suelo_urbano_pct += val
-                            # Detectar clasificación mayoritaria
-                            if val > max_pct:
-                                max_pct = val
-                                clasificacion_principal = k
-                        except (ValueError, TypeError):
-                            continue
-
-                    # Extraer Edificabilidad de parámetros urbanísticos
-                    avanzado = afecciones.get("analisis_avanzado", {})
-                    params = avanzado.get("parametros_urbanisticos", {})
-                    edificabilidad = params.get("edificabilidad", {}).get("valor", "") if params else ""
-
-                    row = {
-                        "referencia": ref,
-                        "estado": datos.get("estado", "desconocido"),
-                        "fecha_inicio": datos.get("inicio", ""),
-                        "fecha_fin": datos.get("fin", ""),
-                        "error": datos.get("error", ""),
-                        "num_archivos": num_archivos,
-                        "afecciones_detectadas": "Sí" if afecciones.get("afecciones_detectadas") else "No",
-                        "area_parcela_m2": afecciones.get("area_total_m2", 0.0),
-                        "porcentaje_afeccion": afecciones.get("total", 0.0),
-                        "suelo_urbano_pct": round(suelo_urbano_pct, 2),
-                        "edificabilidad": edificabilidad,
-                        "clasificacion_principal": clasificacion_principal
-                    }
-                    writer.writerow(row)
+                writer.writerows(rows)
+            os.replace(tmp_path, csv_path)
+            self._last_csv_hash = h
             
             logger.info(f"📄 Resumen CSV generado: {csv_path}")
             
         except Exception as e:
             logger.error(f"Error generando resumen CSV: {e}")
 
-    def _generar_mapa_global(self, resultados: Dict):
-        """Genera un mapa global visualizando todas las parcelas juntas sobre PNOA"""
+    def _generar_mapa_global(self, resultados: Dict, final: bool = False):
+        """Genera un mapa global visualizando todas las parcelas juntas sobre PNOA
+        
+        Las vistas intermedias (final=False) se pintan a 72 dpi con geometrías
+        simplificadas; solo el mapa final va a 150 dpi.
+        """
         try:
-            # Importaciones locales para evitar dependencias circulares si no se usan
-            import geopandas as gpd
-            import pandas as pd
-            import matplotlib
-            matplotlib.use('Agg') # Usar backend no interactivo
-            import matplotlib.pyplot as plt
-            import contextily as cx
-            
             lote_id = resultados.get("lote_id")
             if not lote_id: return None
             
             referencias = resultados.get("referencias", {})
-            gdfs = []
+            
+            # Si el PNG es posterior a la última referencia terminada, no hay nada nuevo que pintar
+            mapa_path = self.lotes_dir / f"{lote_id}_mapa_global.png"
+            # Marca de que el PNG actual es el de resolución final
+            marca_final = mapa_path.with_suffix(".final")
+            if self._mapa_global_vigente(mapa_path, referencias) and (not final or marca_final.exists()):
+                return mapa_path
+            
+            gpd, pd, plt, cx = _get_plot_stack()
+            
+            # Caché persistente de teselas del mapa base (PNOA/OSM)
+            tile_cache = self.output_dir / "_tile_cache"
+            tile_cache.mkdir(exist_ok=True)
+            cx.set_cache_dir(str(tile_cache))
+            
+            tareas = []
             
             # Recopilar GMLs de parcelas exitosas
             for ref, datos in referencias.items():
@@ -493,13 +935,28 @@ class LoteManager:
                                 break
 
                     if gml and Path(gml).exists():
-                        try:
-                            df = gpd.read_file(gml)
-                            if df.crs is None: df.set_crs(epsg=4326, inplace=True)
-                            # Añadir referencia para etiquetado
-                            df['ref_label'] = ref
-                            gdfs.append(df)
-                        except: continue
+                        tareas.append((ref, gml))
+            
+            h = hash((lote_id, final, tuple(sorted((ref, os.path.getmtime(gml)) for ref, gml in tareas))))
+            if h == self._last_mapa_hash and mapa_path.exists():
+                return mapa_path
+            
+            def _safe_read(gml):
+                try:
+                    df = gpd.read_file(gml)
+                    if df.crs is None: df.set_crs(epsg=4326, inplace=True)
+                    return df
+                except Exception:
+                    return None
+            
+            # Lectura concurrente: GDAL libera el GIL durante la E/S
+            gdfs = []
+            with ThreadPoolExecutor(max_workers=8) as ex:
+                for ref, df in zip((t[0] for t in tareas), ex.map(_safe_read, (t[1] for t in tareas))):
+                    if df is not None:
+                        # Añadir referencia para etiquetado
+                        df['ref_label'] = ref
+                        gdfs.append(df)
             
             if not gdfs: return None
                 
@@ -518,8 +975,8 @@ class LoteManager:
             # Reproyectar a Web Mercator para mapa base
             gdf_total = gdf_total.to_crs(epsg=3857)
             
-            # Configurar figura
-            fig, ax = plt.subplots(figsize=(20, 20))
+            # Configurar figura (API de objetos: los planos se pintan a la vez en otros hilos)
+            fig, ax = plt.subplots(figsize=(20, 20) if final else (10, 10))
             
             # Calcular bounds con margen del 10%
             minx, miny, maxx, maxy = gdf_total.total_bounds
@@ -543,6 +1000,9 @@ class LoteManager:
                 "linewidth": 2           # Grosor de la línea del borde
             }
             
+            if not final:
+                gdf_total['geometry'] = gdf_total.geometry.simplify(tolerance=1.0, preserve_topology=True)
+            
             # Dibujar parcelas con el estilo configurado
             gdf_total.plot(ax=ax, **estilo_mapa)
             
@@ -558,13 +1018,17 @@ class LoteManager:
                     bbox=dict(boxstyle="round,pad=0.3", fc="black", alpha=0.6, ec="none")
                 )
             
-            plt.title(f"Vista Global del Lote: {lote_id} ({len(gdfs)} parcelas)", fontsize=20)
+            ax.set_title(f"Vista Global del Lote: {lote_id} ({len(gdfs)} parcelas)", fontsize=20)
             ax.axis("off")
             
             # Guardar
-            mapa_path = self.lotes_dir / f"{lote_id}_mapa_global.png"
-            plt.savefig(mapa_path, dpi=150, bbox_inches='tight')
-            plt.close()
+            fig.savefig(mapa_path, dpi=150 if final else 72, bbox_inches='tight')
+            plt.close(fig)
+            self._last_mapa_hash = h
+            if final:
+                marca_final.touch()
+            else:
+                marca_final.unlink(missing_ok=True)
             
             logger.info(f"🗺️ Mapa global generado: {mapa_path}")
             return mapa_path
@@ -573,12 +1037,27 @@ class LoteManager:
             logger.error(f"Error generando mapa global: {e}")
             return None
 
-    def _generar_resumen_html(self, resultados: Dict):
-        """Genera resumen HTML del lote"""
+    @staticmethod
+    def _mapa_global_vigente(mapa_path: Path, referencias: Dict) -> bool:
+        """True si el mapa existe y es más reciente que el fin de todas las referencias"""
+        if not mapa_path.exists() or not referencias:
+            return False
+        try:
+            ultima = max(datetime.fromisoformat(d["fin"]) for d in referencias.values() if d.get("fin"))
+        except ValueError:
+            return False
+        return datetime.fromtimestamp(mapa_path.stat().st_mtime) > ultima
+
+    def _generar_resumen_html(self, resultados: Dict, ultimas: Optional[int] = None):
+        """Genera resumen HTML del lote (solo las últimas N referencias si se indica)"""
         try:
             lote_id = resultados["lote_id"]
             html_path = self.lotes_dir / f"{lote_id}_resumen.html"
             
+            h = self._huella_resumen(resultados, ultimas)
+            if h == self._last_html_hash and html_path.exists():
+                return
+            
             # Script para auto-recargar la página si el lote sigue procesando
             script_reload = ""
             if resultados.get("estado") != "completado":
@@ -587,85 +1066,19 @@ class LoteManager:
         setTimeout(function() { window.location.reload(); }, 2000);
     </script>"""
             
-            html = f"""<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Resumen Lote {lote_id}</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; background: #f5f5f5; }}
-        .container {{ max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; }}
-        .header {{ display: flex; justify-content: space-between; align-items: center; border-bottom: 3px solid #4CAF50; padding-bottom: 10px; margin-bottom: 20px; }}
-        h1 {{ color: #333; margin: 0; }}
-        .btn-download {{ 
-            background-color: #2196F3; color: white; padding: 10px 20px; 
-            text-decoration: none; border-radius: 5px; font-weight: bold; 
-            transition: background 0.3s;
-            display: inline-block; cursor: pointer;
-        }}
-        .btn-download:hover {{ background-color: #1976D2; }}
-        .stats {{ display: flex; gap: 20px; margin: 20px 0; }}
-        .stat-card {{ flex: 1; padding: 20px; border-radius: 8px; text-align: center; }}
-        .stat-card.success {{ background: #4CAF50; color: white; }}
-        .stat-card.error {{ background: #f44336; color: white; }}
-        .stat-card.total {{ background: #2196F3; color: white; }}
-        .stat-number {{ font-size: 48px; font-weight: bold; }}
-        .stat-label {{ font-size: 14px; margin-top: 5px; }}
-        table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-        th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
-        th {{ background: #f0f0f0; font-weight: bold; }}
-        .exitoso {{ color: #4CAF50; }}
-        .error {{ color: #f44336; }}
-        .badge {{ padding: 4px 8px; border-radius: 4px; font-size: 12px; }}
-        .badge.success {{ background: #4CAF50; color: white; }}
-        .badge.fail {{ background: #f44336; color: white; }}
-        .badge.processing {{ background: #FF9800; color: white; }}
-    </style>
-    {script_reload}
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>📦 Resumen Lote: {lote_id}</h1>
-            <a href="/api/v1/lote/{lote_id}/zip" class="btn-download" target="_blank">⬇️ Descargar ZIP Completo</a>
-        </div>
-        
-        <!-- Mapa Global -->
-        <div style="margin: 20px 0; text-align: center; background: #fff; padding: 15px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1);">
-            <h2 style="margin-top: 0;">🗺️ Vista Global del Lote</h2>
-            <p style="color: #666; font-size: 0.9em;">Visualización conjunta de todas las parcelas procesadas sobre ortofoto PNOA</p>
-            <img src="/outputs/_lotes/{lote_id}_mapa_global.png" style="max-width: 100%; height: auto; border-radius: 4px; border: 1px solid #ddd;" onerror="this.style.display='none'">
-        </div>
-
-        <div class="stats">
-            <div class="stat-card total">
-                <div class="stat-number">{resultados['total_referencias']}</div>
-                <div class="stat-label">Total Referencias</div>
-            </div>
-            <div class="stat-card success">
-                <div class="stat-number">{resultados['exitosas']}</div>
-                <div class="stat-label">Exitosas</div>
-            </div>
-            <div class="stat-card error">
-                <div class="stat-number">{resultados['fallidas']}</div>
-                <div class="stat-label">Fallidas</div>
-            </div>
-        </div>
-        
-        <h2>Detalle de Referencias</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>Referencia</th>
-                    <th>Estado</th>
-                    <th>Archivos Generados</th>
-                </tr>
-            </thead>
-            <tbody>
-"""
+            parts = [HTML_RESUMEN_CABECERA.format(
+                lote_id=lote_id,
+                script_reload=script_reload,
+                total_referencias=resultados['total_referencias'],
+                exitosas=resultados['exitosas'],
+                fallidas=resultados['fallidas'],
+            )]
+            
+            filas = list(resultados["referencias"].items())
+            if ultimas:
+                filas = filas[-ultimas:]
             
-            for ref, datos in resultados["referencias"].items():
+            for ref, datos in filas:
                 if datos["estado"] == "exitoso":
                     estado_badge, estado_texto = "success", "✅ Exitoso"
                 elif datos["estado"] == "procesando":
@@ -673,36 +1086,20 @@ class LoteManager:
                 else:
                     estado_badge, estado_texto = "fail", "❌ Error"
                 
-                archivos = datos.get("archivos", {})
-                num_archivos = sum([
-                    1 if archivos.get("gml_parcela") else 0,
-                    1 if archivos.get("ficha_catastral") else 0,
-                    len(archivos.get("imagenes", [])),
-                    len(archivos.get("json", []))
-                ])
+                num_archivos = _num_archivos(datos)
                 
-                html += f"""
-                <tr>
-                    <td><strong>{ref}</strong></td>
-                    <td><span class="badge {estado_badge}">{estado_texto}</span></td>
-                    <td>{num_archivos} archivos</td>
-                </tr>
-"""
+                parts.append(HTML_RESUMEN_FILA.format(
+                    ref=ref, badge=estado_badge, texto=estado_texto, num_archivos=num_archivos
+                ))
             
-            html += """
-            </tbody>
-        </table>
-        
-        <p style="text-align: center; color: #666; margin-top: 40px;">
-            Generado automáticamente por Suite Tasación dnogares
-        </p>
-    </div>
-</body>
-</html>
-"""
+            parts.append(HTML_RESUMEN_PIE)
+            html = "".join(parts)
             
-            with open(html_path, 'w', encoding='utf-8') as f:
+            tmp_path = html_path.with_suffix('.html.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 f.write(html)
+            os.replace(tmp_path, html_path)
+            self._last_html_hash = h
             
             logger.info(f"📄 Resumen HTML generado: {html_path}")
             
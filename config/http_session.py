@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+config/http_session.py
+Sesión HTTP compartida (pool de conexiones keep-alive) para Catastro, WFS y WMS
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from urllib.parse import urlencode, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pocos reintentos: algunos llamantes (safe_get) tienen su propio bucle y los
+# dos niveles se multiplican
+_RETRY = Retry(
+    total=2,
+    backoff_factor=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD"]),
+)
+
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=_RETRY)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# Caché en disco de metadatos (GetCapabilities / DescribeFeatureType)
+CACHE_DIR = Path(os.getenv("TASACION_HTTP_CACHE_DIR", Path.home() / ".cache" / "febrero" / "wfs"))
+
+
+def cached_get(url: str, params: dict = None, session: requests.Session = SESSION, timeout: int = 60) -> bytes:
+    """GET con caché en disco validada por ETag / Last-Modified.
+
+    Devuelve el cuerpo de la respuesta; si el servidor responde 304 se usa
+    la copia local. Si la red falla y hay copia, también se usa la copia.
+    """
+    full_url = f"{url}{'&' if '?' in url else '?'}{urlencode(params)}" if params else url
+    key = hashlib.blake2b(full_url.encode("utf-8"), digest_size=16).hexdigest()
+    cache_dir = CACHE_DIR / (urlparse(url).hostname or "local")
+    body_path = cache_dir / f"{key}.body"
+    meta_path = cache_dir / f"{key}.json"
+
+    headers = {}
+    meta = {}
+    if body_path.exists() and meta_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        except Exception:
+            meta = {}
+
+    try:
+        r = session.get(full_url, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException:
+        if body_path.exists():
+            return body_path.read_bytes()
+        raise
+
+    if r.status_code == 304 and body_path.exists():
+        return body_path.read_bytes()
+
+    r.raise_for_status()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        body_path.write_bytes(r.content)
+        meta_path.write_text(json.dumps({
+            "url": full_url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }), encoding="utf-8")
+    except OSError:
+        pass
+    return r.content
+
+
+def cerrar_sesion():
+    """Cierra las conexiones del pool (llamar al apagar el servidor)"""
+    SESSION.close()
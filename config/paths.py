@@ -6,43 +6,97 @@ Compatible con Docker / Easypanel
 """
 
 from pathlib import Path
+import asyncio
+import functools
+import logging
 import os
-import sys
+
+_log = logging.getLogger(__name__)
 
 # Proyecto / repo root (dos niveles arriba desde este archivo)
 REPO_ROOT = Path(__file__).resolve().parents[1]
 
-# Raíz de datos: variable de entorno con fallback a <repo>/data
-DATA_ROOT = Path(os.getenv("TASACION_DATA_ROOT", REPO_ROOT / "data")).resolve()
+# Nombres públicos de directorios; se resuelven (y crean) en el primer acceso
+_NOMBRES_RUTAS = (
+    "DATA_ROOT", "OUTPUTS_DIR", "CAPAS_DIR", "STATIC_DIR", "TEMP_DIR",
+    "CAPAS_AMBIENTAL_DIR", "CAPAS_RIESGOS_DIR", "CAPAS_INFRAESTRUCTURAS_DIR",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _resolved(ruta: str) -> Path:
+    """Path.resolve() memoizado (realpath hace un lstat por componente)"""
+    return Path(ruta).resolve()
+
+
+def _ruta_env(variable: str, por_defecto: Path) -> Path:
+    """Ruta de una variable de entorno (resuelta) o `por_defecto`, ya canónica"""
+    valor = os.getenv(variable)
+    return _resolved(valor) if valor else por_defecto
+
 
-# Detección automática de volumen montado en Easypanel (/app/capasymas)
-_EASYPANEL_CAPAS = Path("/app/capasymas")
-_DEFAULT_CAPAS = _EASYPANEL_CAPAS if _EASYPANEL_CAPAS.exists() else (DATA_ROOT / "capas")
+def _rutas_configuradas() -> dict:
+    """Rutas según variables de entorno, sin crear nada en disco"""
+    # Raíz de datos: variable de entorno con fallback a <repo>/data.
+    # Se resuelve una vez; sus hijos por defecto ya son canónicos
+    data_root = _resolved(os.getenv("TASACION_DATA_ROOT", str(REPO_ROOT / "data")))
 
-# Directorios configurables mediante variables de entorno (más flexibles)
-OUTPUTS_DIR = Path(os.getenv("TASACION_OUTPUTS_DIR", DATA_ROOT / "outputs")).resolve()
-CAPAS_DIR = Path(os.getenv("TASACION_CAPAS_DIR", _DEFAULT_CAPAS)).resolve()
-STATIC_DIR = Path(os.getenv("TASACION_STATIC_DIR", REPO_ROOT / "static")).resolve()
-TEMP_DIR = Path(os.getenv("TASACION_TEMP_DIR", DATA_ROOT / "temp")).resolve()
+    # Detección automática de volumen montado en Easypanel (/app/capasymas)
+    easypanel_capas = Path("/app/capasymas")
+    default_capas = _resolved(str(easypanel_capas)) if easypanel_capas.exists() else (data_root / "capas")
+
+    # Directorios configurables mediante variables de entorno (más flexibles)
+    return {
+        "DATA_ROOT": data_root,
+        "OUTPUTS_DIR": _ruta_env("TASACION_OUTPUTS_DIR", data_root / "outputs"),
+        "CAPAS_DIR": _ruta_env("TASACION_CAPAS_DIR", default_capas),
+        "STATIC_DIR": _ruta_env("TASACION_STATIC_DIR", REPO_ROOT / "static"),
+        "TEMP_DIR": _ruta_env("TASACION_TEMP_DIR", data_root / "temp"),
+    }
+
+
+def rutas_configuradas() -> dict:
+    """Rutas según variables de entorno, sin crear ni comprobar nada en disco.
+
+    Para módulos que se importan al arrancar el servidor: la creación y la
+    sonda de escritura las hace después inicializar_directorios_async().
+    """
+    return _rutas_configuradas()
 
-# Subdirectorios de capas (mantener consistencia)
-CAPAS_AMBIENTAL_DIR = CAPAS_DIR / "ambiental"
-CAPAS_RIESGOS_DIR = CAPAS_DIR / "riesgos"
-CAPAS_INFRAESTRUCTURAS_DIR = CAPAS_DIR / "infraestructuras"
+
+# Directorios ya comprobados como escribibles (evita repetir la sonda)
+_verified: set = set()
+
+@functools.lru_cache(maxsize=None)
+def _home_fallback_base() -> Path:
+    """Base del fallback cuando un directorio no es escribible (calculada una vez).
+
+    Diferida: Path.home() lanza RuntimeError en contenedores con un UID sin
+    HOME ni entrada en passwd, y solo hace falta si falla un directorio.
+    """
+    return (Path.home() / ".tasacion_data").resolve()
 
 
 def _ensure_writable_dir(path: Path) -> Path:
     """Asegura que `path` exista y sea escribible; si no, intenta fallback al home."""
+    if path in _verified:
+        return path
     try:
         path.mkdir(parents=True, exist_ok=True)
+        if os.access(str(path), os.W_OK):
+            _verified.add(path)
+            return path
+        # os.access puede mentir (ACLs, montajes de solo lectura): sonda real
         test_file = path / ".write_test"
         with open(test_file, "w") as f:
             f.write("ok")
         test_file.unlink()
+        _verified.add(path)
         return path
     except Exception:
-        home_fallback = Path.home() / ".tasacion_data" / path.name
+        home_fallback = _home_fallback_base() / path.name
         home_fallback.mkdir(parents=True, exist_ok=True)
+        _verified.add(home_fallback)
         return home_fallback
 
 
@@ -53,32 +107,61 @@ def inicializar_directorios():
     a herramientas que usan el directorio temporal (pip/meson durante builds).
     """
     global DATA_ROOT, OUTPUTS_DIR, CAPAS_DIR, STATIC_DIR, TEMP_DIR
-
-    # Asegurar root de datos
-    DATA_ROOT = _ensure_writable_dir(DATA_ROOT)
-
-    # Asegurar directorios principales
-    OUTPUTS_DIR = _ensure_writable_dir(OUTPUTS_DIR)
-    CAPAS_DIR = _ensure_writable_dir(CAPAS_DIR)
-    STATIC_DIR = _ensure_writable_dir(STATIC_DIR)
-    TEMP_DIR = _ensure_writable_dir(TEMP_DIR)
-
-    # Subdirectorios de capas
-    _ensure_writable_dir(CAPAS_DIR / "ambiental")
-    _ensure_writable_dir(CAPAS_DIR / "riesgos")
-    _ensure_writable_dir(CAPAS_DIR / "infraestructuras")
+    global CAPAS_AMBIENTAL_DIR, CAPAS_RIESGOS_DIR, CAPAS_INFRAESTRUCTURAS_DIR
+
+    rutas = _rutas_configuradas()
+
+    # Root de datos y directorios principales (llamadas repetidas no tocan disco)
+    DATA_ROOT, OUTPUTS_DIR, CAPAS_DIR, STATIC_DIR, TEMP_DIR = (
+        _ensure_writable_dir(rutas[n]) for n in ("DATA_ROOT", "OUTPUTS_DIR", "CAPAS_DIR", "STATIC_DIR", "TEMP_DIR")
+    )
+
+    # Subdirectorios de capas (mantener consistencia). CAPAS_DIR ya es escribible:
+    # basta un mkdir por hijo, sin sonda de escritura
+    subdirs = []
+    for sub in ("ambiental", "riesgos", "infraestructuras"):
+        destino = CAPAS_DIR / sub
+        if destino not in _verified:
+            try:
+                destino.mkdir(exist_ok=True)
+                _verified.add(destino)
+            except OSError:
+                destino = _ensure_writable_dir(destino)
+        subdirs.append(destino)
+    CAPAS_AMBIENTAL_DIR, CAPAS_RIESGOS_DIR, CAPAS_INFRAESTRUCTURAS_DIR = subdirs
 
     # Forzar variables de entorno temporales para procesos de build
     os.environ.setdefault("TMPDIR", str(TEMP_DIR))
     os.environ.setdefault("TEMP", str(TEMP_DIR))
     os.environ.setdefault("TMP", str(TEMP_DIR))
 
-    print(f"✅ Directorios inicializados. DATA_ROOT={DATA_ROOT}")
+    _log.debug("Directorios inicializados. DATA_ROOT=%s", DATA_ROOT)
 
 
-# Inicializar por defecto al importar el módulo para compatibilidad simple
-try:
-    inicializar_directorios()
-except Exception:
-    # Si por alguna razón falla la inicialización automática, no crashar la importación
-    print("⚠️ Inicialización de directorios fallida al importar config.paths", file=sys.stderr)
+async def inicializar_directorios_async():
+    """Variante para contextos async (startup/lifespan de FastAPI).
+
+    Ejecuta los mkdir y sondas de escritura en un hilo para no bloquear el
+    event loop; si ya estaban verificados no toca disco.
+    """
+    await asyncio.to_thread(inicializar_directorios)
+
+
+def __getattr__(name):
+    """Inicialización diferida: los directorios se crean en el primer acceso a una ruta"""
+    if name in _NOMBRES_RUTAS:
+        try:
+            inicializar_directorios()
+        except Exception:
+            # Si falla la inicialización, usar las rutas configuradas sin crashar
+            _log.warning("Inicialización de directorios fallida en config.paths", exc_info=True)
+            rutas = _rutas_configuradas()
+            capas = rutas["CAPAS_DIR"]
+            rutas.update(
+                CAPAS_AMBIENTAL_DIR=capas / "ambiental",
+                CAPAS_RIESGOS_DIR=capas / "riesgos",
+                CAPAS_INFRAESTRUCTURAS_DIR=capas / "infraestructuras",
+            )
+            globals().update(rutas)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -11,84 +11,129 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 os.chdir(Path(__file__).parent)
 
-try:
-    import geopandas as gpd
-    import fiona
-    
-    # Habilitar el driver KML
-    fiona.drvsupport.supported_drivers['KML'] = 'rw'
-    
-    print("=" * 70)
-    print("CONVERSIÓN DE ARCHIVOS GML A KML")
-    print("=" * 70)
-    
-    # Buscar archivos GML en outputs
-    outputs_dir = Path("outputs")
-    
-    if not outputs_dir.exists():
-        print(f"\n❌ El directorio 'outputs' no existe")
-        sys.exit(1)
-    
-    # Buscar todos los archivos GML
-    archivos_gml = list(outputs_dir.rglob("*.gml"))
-    
-    print(f"\n📁 Encontrados {len(archivos_gml)} archivos GML")
-    
-    if not archivos_gml:
-        print("\n⚠️  No hay archivos GML para convertir")
-        sys.exit(0)
-    
-    # Convertir cada archivo
-    convertidos = 0
-    errores = 0
-    ya_existentes = 0
-    
-    for gml_file in archivos_gml:
-        kml_file = gml_file.with_suffix('.kml')
+
+def iter_gml(root):
+    """Recorre `root` con os.scandir (sin stats extra de pathlib) y devuelve los .gml
+
+    Cada GML va acompañado del conjunto de nombres de su directorio, para
+    comprobar si ya existe el .kml hermano sin otro stat.
+    """
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        nombres = set()
+        gmls = []
+        with os.scandir(d) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                else:
+                    nombres.add(e.name)
+                    if e.name.endswith('.gml'):
+                        gmls.append(Path(e.path))
+        for gml_path in gmls:
+            yield nombres, gml_path
+
+
+def convert_one(gml_file):
+    """Convierte un GML a KML en un proceso hijo. Devuelve (estado, gml_file, detalle)"""
+    kml_file = gml_file.with_suffix('.kml')
+    # Se escribe a un nombre temporal: un KML a medias no debe contar como "Ya existe"
+    tmp_file = gml_file.with_suffix('.kml.tmp')
+    try:
+        from osgeo import gdal
+        gdal.UseExceptions()
+        
+        src = gdal.OpenEx(str(gml_file), gdal.OF_VECTOR)
+        # Reproyectar solo si el GML declara SRS; sin él se escribe tal cual
+        # (el driver KML ya asume WGS84)
+        con_srs = any(
+            src.GetLayer(i).GetSpatialRef() is not None
+            for i in range(src.GetLayerCount())
+        )
+        opciones = {"dstSRS": "EPSG:4326", "reproject": True} if con_srs else {}
+        
+        # Conversión directa con OGR, entidad a entidad
+        ds = gdal.VectorTranslate(str(tmp_file), src, format='KML', **opciones)
+        src = None
+        if ds is None:
+            tmp_file.unlink(missing_ok=True)
+            return "err", gml_file, "VectorTranslate no generó salida"
+        ds = None  # Cerrar y volcar a disco
+        os.replace(tmp_file, kml_file)
+        return "ok", gml_file, ""
+        
+    except Exception as e:
+        tmp_file.unlink(missing_ok=True)
+        return "err", gml_file, str(e)
+
+
+if __name__ == "__main__":
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        from osgeo import gdal  # noqa: F401  (comprobar dependencias antes de lanzar procesos)
+        
+        print("=" * 70)
+        print("CONVERSIÓN DE ARCHIVOS GML A KML")
+        print("=" * 70)
         
-        # Verificar si ya existe
-        if kml_file.exists():
-            ya_existentes += 1
-            print(f"\n↩️  Ya existe: {kml_file.name}")
-            continue
+        # Buscar archivos GML en outputs
+        outputs_dir = Path("outputs")
         
-        try:
-            print(f"\n🔄 Convirtiendo: {gml_file.relative_to(outputs_dir)}")
-            
-            # Leer GML
-            gdf = gpd.read_file(gml_file)
-            
-            # Asegurar WGS84
-            if gdf.crs and str(gdf.crs) != "EPSG:4326":
-                print(f"   Reproyectando de {gdf.crs} a EPSG:4326")
-                gdf = gdf.to_crs("EPSG:4326")
-            
-            # Guardar como KML
-            gdf.to_file(kml_file, driver='KML')
-            
-            print(f"   ✅ KML creado: {kml_file.name}")
-            convertidos += 1
-            
-        except Exception as e:
-            print(f"   ❌ Error: {str(e)}")
-            errores += 1
-    
-    # Resumen
-    print("\n" + "=" * 70)
-    print("RESUMEN DE CONVERSIÓN")
-    print("=" * 70)
-    print(f"✅ Archivos convertidos: {convertidos}")
-    print(f"↩️  Ya existían: {ya_existentes}")
-    print(f"❌ Errores: {errores}")
-    print(f"📊 Total procesados: {len(archivos_gml)}")
-    print("=" * 70)
-    
-except ImportError as e:
-    print(f"\n❌ Error de importación: {e}")
-    print("   Asegúrate de tener instalados: geopandas, fiona")
-    sys.exit(1)
-except Exception as e:
-    print(f"\n❌ Error inesperado: {e}")
-    import traceback
-    traceback.print_exc()
-    sys.exit(1)
+        if not outputs_dir.exists():
+            print(f"\n❌ El directorio 'outputs' no existe")
+            sys.exit(1)
+        
+        # Buscar todos los archivos GML
+        archivos_gml = list(iter_gml(outputs_dir))
+        
+        print(f"\n📁 Encontrados {len(archivos_gml)} archivos GML")
+        
+        if not archivos_gml:
+            print("\n⚠️  No hay archivos GML para convertir")
+            sys.exit(0)
+        
+        convertidos = 0
+        errores = 0
+        ya_existentes = 0
+        
+        # Verificar si ya existen (con el listado del directorio ya leído)
+        pendientes = []
+        for nombres_dir, gml_file in archivos_gml:
+            kml_file = gml_file.with_suffix('.kml')
+            if kml_file.name in nombres_dir:
+                ya_existentes += 1
+                print(f"\n↩️  Ya existe: {kml_file.name}")
+            else:
+                pendientes.append(gml_file)
+        
+        # Convertir en paralelo: cada archivo es independiente
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            for estado, gml_file, detalle in ex.map(convert_one, pendientes, chunksize=4):
+                print(f"\n🔄 Convirtiendo: {gml_file.relative_to(outputs_dir)}")
+                if estado == "ok":
+                    print(f"   ✅ KML creado: {gml_file.with_suffix('.kml').name}")
+                    convertidos += 1
+                else:
+                    print(f"   ❌ Error: {detalle}")
+                    errores += 1
+        
+        # Resumen
+        print("\n" + "=" * 70)
+        print("RESUMEN DE CONVERSIÓN")
+        print("=" * 70)
+        print(f"✅ Archivos convertidos: {convertidos}")
+        print(f"↩️  Ya existían: {ya_existentes}")
+        print(f"❌ Errores: {errores}")
+        print(f"📊 Total procesados: {len(archivos_gml)}")
+        print("=" * 70)
+        
+    except ImportError as e:
+        print(f"\n❌ Error de importación: {e}")
+        print("   Asegúrate de tener instalado GDAL (osgeo)")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n❌ Error inesperado: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -4,13 +4,17 @@ Script standalone para importar las 50 ciudades más grandes de España
 No requiere estructura de paquetes
 """
 
+import functools
+from collections import defaultdict
 import logging
 import json
 import csv
+import os
+import sys
 from pathlib import Path
 from typing import Dict, List
 from datetime import datetime
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,8 +22,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Serializador JSON en C si está instalado; stdlib como respaldo
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+
+@dataclass(slots=True)
 class NormaUrbanistica:
     """Representa una norma urbanística individual"""
     id_norma: str
@@ -41,8 +51,8 @@ class NormaUrbanistica:
     observaciones: str = ""
     
     def to_dict(self) -> Dict:
-        """Convierte a diccionario"""
-        return asdict(self)
+        """Convierte a diccionario (campos planos: sin la copia recursiva de asdict)"""
+        return {nombre: getattr(self, nombre) for nombre in _CAMPOS_NORMA}
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'NormaUrbanistica':
@@ -50,16 +60,110 @@ class NormaUrbanistica:
         return cls(**data)
 
 
-def importar_desde_csv(csv_path: str) -> Dict[str, NormaUrbanistica]:
+# Nombres de campo calculados una sola vez
+_CAMPOS_NORMA = tuple(f.name for f in fields(NormaUrbanistica))
+
+
+# Columnas del catálogo, en el orden de config/cities.py y del CSV
+CAMPOS = (
+    "municipio", "codigo_ine", "provincia", "ccaa", "ambito", "tipo_norma",
+    "numero_modificacion", "plan_base", "articulo", "apartado", "titulo",
+    "descripcion", "url_oficial", "vigente",
+)
+
+
+def _n(v):
+    """Vacío -> None"""
+    return v or None
+
+
+@functools.cache
+def make_id(plan_base: str, municipio: str, numero_modificacion, articulo) -> str:
+    """ID de norma (PLAN_MUNICIPIO[_MOD_n][_ART_x]); memoizado, el catálogo es estático"""
+    partes = [plan_base]
+    
+    if municipio:
+        partes.append(municipio.upper().replace(' ', '_'))
+    
+    if numero_modificacion:
+        partes.append(f"MOD_{numero_modificacion}")
+    
+    if articulo:
+        partes.append(f"ART_{articulo.replace('.', '_')}")
+    
+    return "_".join(partes)
+
+
+def _crear_norma(municipio, codigo_ine, provincia, ccaa, ambito, tipo_norma,
+                 numero_modificacion, plan_base, articulo, apartado, titulo,
+                 descripcion, url_oficial, vigente) -> NormaUrbanistica:
+    """Construye una norma a partir de los campos de una fila (en orden de CAMPOS)"""
+    plan_base = plan_base or 'PGOU'
+    id_norma = make_id(plan_base, municipio, numero_modificacion, articulo)
+    
+    if not isinstance(vigente, bool):
+        vigente = str(vigente).lower() in ['true', '1', 'si']
+    
+    return NormaUrbanistica(
+        id_norma=id_norma,
+        municipio=municipio,
+        codigo_ine=codigo_ine,
+        provincia=provincia,
+        ccaa=ccaa,
+        ambito=ambito,
+        tipo_norma=tipo_norma,
+        numero_modificacion=int(nm) if (nm := _n(numero_modificacion)) and str(nm).strip() else None,
+        plan_base=plan_base,
+        articulo=_n(articulo),
+        apartado=_n(apartado),
+        titulo=titulo,
+        descripcion=descripcion or '',
+        url_oficial=_n(url_oficial),
+        vigente=vigente
+    )
+
+
+def importar_desde_filas(filas) -> Dict[str, NormaUrbanistica]:
+    """
+    Importa normas desde tuplas en el orden de CAMPOS (sin pasar por CSV)
+    
+    Args:
+        filas: Iterable de tuplas, p.ej. config.cities.ROWS
+        
+    Returns:
+        Diccionario de normas {id_norma: NormaUrbanistica}
+    """
+    normas = {}
+    
+    for fila in filas:
+        try:
+            norma = _crear_norma(*fila)
+            normas[norma.id_norma] = norma
+        except Exception as e:
+            logger.warning(f"Error procesando fila: {e}")
+            logger.debug(f"Datos de la fila: {fila}")
+    
+    logger.info(f"✓ {len(normas)} normas importadas del catálogo en memoria")
+    return normas
+
+
+def importar_desde_csv(csv_path: str = None) -> Dict[str, NormaUrbanistica]:
     """
     Importa normas desde CSV
     
+    Sin `csv_path` se usa directamente el catálogo de config/cities.py,
+    sin escribir ni volver a parsear el CSV intermedio.
+    
     Args:
-        csv_path: Ruta al archivo CSV
+        csv_path: Ruta al archivo CSV (opcional)
         
     Returns:
         Diccionario de normas {id_norma: NormaUrbanistica}
     """
+    if csv_path is None:
+        from config.cities import ROWS
+        return importar_desde_filas(ROWS)
+    
     csv_path = Path(csv_path)
     
     if not csv_path.exists():
@@ -68,45 +172,24 @@ def importar_desde_csv(csv_path: str) -> Dict[str, NormaUrbanistica]:
     normas = {}
     normas_agregadas = 0
     
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+    # Valores por defecto si la columna no existe en el CSV
+    defectos = {"ambito": "municipal", "vigente": "True"}
+    
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        idx = {nombre: i for i, nombre in enumerate(header)}
+        posiciones = [(idx.get(campo), defectos.get(campo, "")) for campo in CAMPOS]
         
         for row in reader:
             try:
-                # Construir ID
-                partes = [row.get('plan_base', 'PGOU') or 'PGOU']
-                
-                if row['municipio']:
-                    partes.append(row['municipio'].upper().replace(' ', '_'))
-                
-                if row.get('numero_modificacion'):
-                    partes.append(f"MOD_{row['numero_modificacion']}")
+                fila = [
+                    row[i] if i is not None and i < len(row) else defecto
+                    for i, defecto in posiciones
+                ]
+                norma = _crear_norma(*fila)
                 
-                if row.get('articulo'):
-                    partes.append(f"ART_{row['articulo'].replace('.', '_')}")
-                
-                id_norma = "_".join(partes)
-                
-                # Crear norma
-                norma = NormaUrbanistica(
-                    id_norma=id_norma,
-                    municipio=row['municipio'],
-                    codigo_ine=row['codigo_ine'],
-                    provincia=row['provincia'],
-                    ccaa=row['ccaa'],
-                    ambito=row.get('ambito', 'municipal'),
-                    tipo_norma=row['tipo_norma'],
-                    numero_modificacion=int(row['numero_modificacion']) if row.get('numero_modificacion') and row['numero_modificacion'].strip() else None,
-                    plan_base=row.get('plan_base', 'PGOU') or 'PGOU',
-                    articulo=row.get('articulo') if row.get('articulo') else None,
-                    apartado=row.get('apartado') if row.get('apartado') else None,
-                    titulo=row['titulo'],
-                    descripcion=row.get('descripcion', ''),
-                    url_oficial=row.get('url_oficial') if row.get('url_oficial') else None,
-                    vigente=row.get('vigente', 'True').lower() in ['true', '1', 'si']
-                )
-                
-                normas[id_norma] = norma
+                normas[norma.id_norma] = norma
                 normas_agregadas += 1
                 
             except Exception as e:
@@ -122,10 +205,27 @@ def guardar_catalogo_json(normas: Dict[str, NormaUrbanistica], output_path: str)
     output_path = Path(output_path)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
-    data = [norma.to_dict() for norma in normas.values()]
+    # CATALOG_COMPACT=1 para salida compacta
+    compacto = bool(os.getenv("CATALOG_COMPACT"))
+    
+    if orjson is not None:
+        opciones = orjson.OPT_NON_STR_KEYS | (0 if compacto else orjson.OPT_INDENT_2)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps([norma.to_dict() for norma in normas.values()], option=opciones))
+        logger.info(f"✓ Catálogo JSON guardado: {output_path}")
+        return
     
+    # Sin orjson: escritura en streaming (sin lista intermedia)
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write("[")
+        for i, norma in enumerate(normas.values()):
+            if compacto:
+                item = json.dumps(norma.to_dict(), ensure_ascii=False, separators=(",", ":"))
+                f.write("," + item if i else item)
+            else:
+                item = json.dumps(norma.to_dict(), indent=2, ensure_ascii=False).replace("\n", "\n  ")
+                f.write(",\n  " + item if i else "\n  " + item)
+        f.write("]" if compacto or not normas else "\n]")
     
     logger.info(f"✓ Catálogo JSON guardado: {output_path}")
 
@@ -139,13 +239,12 @@ def guardar_catalogo_csv(normas: Dict[str, NormaUrbanistica], output_path: str):
         logger.warning("No hay normas para guardar")
         return
     
-    fieldnames = list(asdict(list(normas.values())[0]).keys())
+    fieldnames = list(_CAMPOS_NORMA)
     
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+    with open(output_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        for norma in normas.values():
-            writer.writerow(norma.to_dict())
+        writer.writerows(norma.to_dict() for norma in normas.values())
     
     logger.info(f"✓ Catálogo CSV guardado: {output_path}")
 
@@ -156,21 +255,21 @@ def generar_resumen(normas: Dict[str, NormaUrbanistica]):
     print("RESUMEN DEL CATÁLOGO DE NORMATIVA")
     print("="*70)
     
-    # Por CCAA
-    ccaas = {}
+    # Por CCAA (normas y municipios en una sola pasada)
+    counts = defaultdict(int)
+    muni = defaultdict(set)
     for norma in normas.values():
-        if norma.ccaa not in ccaas:
-            ccaas[norma.ccaa] = []
-        ccaas[norma.ccaa].append(norma)
+        counts[norma.ccaa] += 1
+        if norma.municipio:
+            muni[norma.ccaa].add(norma.municipio)
     
     print(f"\nTotal normas: {len(normas)}")
-    print(f"Comunidades Autónomas: {len(ccaas)}\n")
+    print(f"Comunidades Autónomas: {len(counts)}\n")
     
-    for ccaa, normas_ccaa in sorted(ccaas.items()):
-        municipios = set(n.municipio for n in normas_ccaa if n.municipio)
+    for ccaa, n_normas in sorted(counts.items()):
         print(f"  {ccaa}:")
-        print(f"    - {len(normas_ccaa)} normas")
-        print(f"    - {len(municipios)} municipios")
+        print(f"    - {n_normas} normas")
+        print(f"    - {len(muni[ccaa])} municipios")
     
     print("\n" + "="*70)
 
@@ -180,21 +279,21 @@ def main():
     print("IMPORTACIÓN DE LAS 50 CIUDADES MÁS GRANDES DE ESPAÑA")
     print("="*70 + "\n")
     
-    # Rutas
-    csv_input = "catalogo_50_ciudades_espana.csv"
+    # Rutas (un CSV externo opcional como primer argumento)
+    csv_input = sys.argv[1] if len(sys.argv) > 1 else None
     json_output = "catalogo_espana_50_ciudades.json"
     csv_output = "catalogo_espana_50_ciudades_export.csv"
     
     # Verificar que existe el CSV
-    if not Path(csv_input).exists():
+    if csv_input and not Path(csv_input).exists():
         print(f"❌ Error: No se encuentra el archivo {csv_input}")
         print(f"   Ruta esperada: {Path(csv_input).absolute()}")
         print("\n💡 Asegúrate de que el archivo CSV está en el mismo directorio")
         return
     
     try:
-        # Importar desde CSV
-        print(f"📥 Importando desde: {csv_input}")
+        # Importar desde CSV o directamente desde el catálogo en memoria
+        print(f"📥 Importando desde: {csv_input or 'config/cities.py'}")
         normas = importar_desde_csv(csv_input)
         
         # Guardar en JSON
@@ -1,28 +1,62 @@
 import afecciones.vector_analyzer
+import asyncio
+import codecs
 import json
 import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Optional
-from fastapi import FastAPI, Form, HTTPException, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Form, HTTPException, UploadFile, File, BackgroundTasks, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+# Respuestas JSON con orjson si está instalado (serializa también tipos numpy)
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as JSONResponse
+except ImportError:
+    orjson = None
+    from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 from pydantic import BaseModel
+import anyio
 
 # --- IMPORTS CORREGIDOS ---
-from config.paths import CAPAS_DIR, OUTPUTS_DIR
+import config.paths
+from config.http_session import cerrar_sesion
+from config.paths import inicializar_directorios_async, rutas_configuradas
 from catastro.catastro_downloader import CatastroDownloader
 from catastro.lote_manager import LoteManager
 from afecciones.vector_analyzer import VectorAnalyzer
-from afecciones.pdf_generator import AfeccionesPDF
+from afecciones.pdf_generator import AfeccionesPDF, generar_pdf_en_proceso
 from urbanismo import UrbanismoService
 
-app = FastAPI(title="Suite Tasación ", version="3.1")
+# Tareas de arranque adicionales registradas por módulos opcionales
+_TAREAS_INICIO = []
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranque y parada del servidor"""
+    await startup_event(app)
+    for tarea in _TAREAS_INICIO:
+        await tarea()
+    yield
+    await shutdown_event()
+
+app = FastAPI(title="Suite Tasación ", version="3.1", lifespan=lifespan, default_response_class=JSONResponse)
 
-# Crear directorios base SIEMPRE
-OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
-CAPAS_DIR.mkdir(parents=True, exist_ok=True)
+# Rutas leídas sin tocar disco: importar config.paths.OUTPUTS_DIR aquí crearía
+# los directorios de forma síncrona al importar. Se crean (en un hilo) en el
+# arranque, con inicializar_directorios_async()
+_RUTAS = rutas_configuradas()
+OUTPUTS_DIR: Path = _RUTAS["OUTPUTS_DIR"]
+CAPAS_DIR: Path = _RUTAS["CAPAS_DIR"]
 
 # CORS
 app.add_middleware(
@@ -33,8 +67,46 @@ app.add_middleware(
 )
 
 # Static files
+class CachedStatic(StaticFiles):
+    """
+    StaticFiles con Cache-Control para los resultados. Starlette ya envía
+    ETag/Last-Modified y responde 304; aquí se permite a navegador y proxies
+    reutilizar la copia durante max_age segundos antes de revalidar.
+    """
+
+    def __init__(self, *args, max_age: int = 300, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = f"public, max-age={max_age}, must-revalidate"
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = self.cache_control
+        return response
+
+class DescargaArchivo(FileResponse):
+    """
+    FileResponse para descargas grandes (ZIP/KML): bloques de 1 MiB en lugar de
+    64 KiB, menos vueltas al bucle de eventos por fichero. Si el servidor ASGI
+    anuncia la extensión "http.response.pathsend", Starlette le cede el envío
+    del fichero (sendfile) y el tamaño de bloque no interviene.
+    """
+
+    chunk_size = 1 << 20
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/outputs", StaticFiles(directory=str(OUTPUTS_DIR)), name="outputs")
+# Los resultados se regeneran con el mismo nombre al reprocesar una referencia,
+# por eso no se marcan como immutable
+app.mount(
+    "/outputs",
+    # check_dir=False: el directorio se crea en el arranque, no al importar
+    CachedStatic(
+        directory=str(OUTPUTS_DIR),
+        check_dir=False,
+        max_age=int(os.getenv("OUTPUTS_CACHE_MAX_AGE", 300)),
+    ),
+    name="outputs",
+)
 # Inicialización de Clases
 downloader = CatastroDownloader(output_dir=str(OUTPUTS_DIR))
 urbanismo_service = UrbanismoService(output_base_dir=str(OUTPUTS_DIR))
@@ -62,9 +134,16 @@ class ProcesarCompletoRequest(BaseModel):
     referencia: str
     buffer_metros: int = 50
 
-@app.on_event("startup")
-async def startup_event():
+async def startup_event(app: FastAPI):
     """Ejecuta logs y validaciones al iniciar el servidor"""
+    await inicializar_directorios_async()
+    # Si un directorio no era escribible, config.paths pasa a un fallback en el home;
+    # los servicios ya se crearon con la ruta configurada
+    for nombre, ruta in (("OUTPUTS_DIR", OUTPUTS_DIR), ("CAPAS_DIR", CAPAS_DIR)):
+        verificada = getattr(config.paths, nombre)
+        if verificada != ruta:
+            print(f"⚠️ {nombre} no es escribible ({ruta}); config.paths usa {verificada}. "
+                  f"Define TASACION_{nombre} con una ruta escribible si hay que guardar ahí.")
     print("\n" + "="*50)
     print("🚀 Iniciando servidor Suite Tasación...")
     print(f"📁 Root Dir: {Path('.').absolute()}")
@@ -73,7 +152,7 @@ async def startup_event():
     
     # Verificar conexión a Base de Datos
     try:
-        db_status = urbanismo_service.check_db_connection()
+        db_status = await anyio.to_thread.run_sync(urbanismo_service.check_db_connection)
         if db_status.get("connected"):
             print(f"✅ Base de Datos: CONECTADA")
         else:
@@ -81,18 +160,33 @@ async def startup_event():
     except Exception as e:
         print(f"⚠️ Error verificando DB: {e}")
 
-    # Listar contenido de capas para depuración
+    # Listar contenido de capas para depuración (fuera del event loop)
+    app.state.capas = []
     if CAPAS_DIR.exists():
-        capas_encontradas = list(CAPAS_DIR.rglob("*.geojson")) + list(CAPAS_DIR.rglob("*.shp")) + list(CAPAS_DIR.rglob("*.gml"))
+        capas_encontradas = await anyio.to_thread.run_sync(get_all_vector_layers, CAPAS_DIR)
+        app.state.capas = capas_encontradas
         print(f"📂 Capas detectadas: {len(capas_encontradas)}")
         for c in capas_encontradas[:5]:
             print(f"  - {c.relative_to(CAPAS_DIR)}")
+        if CREAR_INDICES_ESPACIALES:
+            indices = await anyio.to_thread.run_sync(crear_indices_espaciales, capas_encontradas)
+            if indices:
+                print(f"🗂️ Índices espaciales creados: {indices}")
+        # Precalentar la caché de listar_capas() que usan los endpoints
+        await anyio.to_thread.run_sync(nombres_capas_disponibles)
     else:
         print("⚠️ ADVERTENCIA: La carpeta de capas no existe o no es accesible")
     
     print("="*50 + "\n")
     print(f"🌐 Accede a: http://localhost:80")
 
+async def shutdown_event():
+    """Libera el pool de conexiones HTTP compartido"""
+    cerrar_sesion()
+    _EXECUTOR_AFECCIONES.shutdown(wait=False, cancel_futures=True)
+    if _PDF_POOL is not None:
+        _PDF_POOL.shutdown(wait=False, cancel_futures=True)
+
 # --- RUTA PRINCIPAL ---
 @app.get("/")
 async def read_index():
@@ -106,21 +200,215 @@ async def read_index():
 # --- ENDPOINTS ---
 
 
+EXTENSIONES_CAPAS = (".geojson", ".shp", ".gml")  # Excluyendo .gpkg
+
+def _scan_capas(ruta, extensiones):
+    """Recorre ruta con os.scandir (usa el tipo cacheado de cada DirEntry)."""
+    with os.scandir(ruta) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_capas(entry.path, extensiones)
+            elif entry.is_file(follow_symlinks=False):
+                nombre = entry.name.lower()
+                # Excluir archivos de configuración o auxiliares
+                if nombre.endswith(extensiones) and "leyenda" not in nombre and "titulo" not in nombre:
+                    yield Path(entry.path)
+
 def get_all_vector_layers(base_dir: Path) -> List[Path]:
     """Busca recursivamente capas vectoriales en el directorio."""
-    layers = []
-    extensions = {".geojson", ".shp", ".gml"}  # Excluyendo .gpkg
-    
     if not base_dir.exists():
-        return layers
-        
-    for item in base_dir.rglob("*"):
-        if item.is_file() and item.suffix.lower() in extensions:
-            # Excluir archivos de configuración o auxiliares
-            if "leyenda" in item.name.lower() or "titulo" in item.name.lower() or "cpg" in item.suffix.lower():
+        return []
+    return list(_scan_capas(base_dir, EXTENSIONES_CAPAS))
+
+def nombres_capas_disponibles() -> tuple:
+    """
+    Nombres de las capas del sistema. La caché es la de listar_capas() (mtime
+    de CAPAS_DIR + TTL), que también ve las tablas nuevas de PostGIS.
+    """
+    return tuple(c["nombre"] for c in urbanismo_service.listar_capas())
+
+# Escribir .qix junto a los shapefiles modifica la carpeta de capas del usuario
+# (puede estar montada en solo lectura): solo con CREAR_INDICES_ESPACIALES=1.
+# La lectura por bbox funciona igual sin ellos, solo que recorre el archivo.
+CREAR_INDICES_ESPACIALES = os.getenv("CREAR_INDICES_ESPACIALES", "0") == "1"
+
+def crear_indices_espaciales(capas: List[Path]) -> int:
+    """Crea el índice .qix de los shapefiles que no lo tienen (acelera las lecturas por bbox)."""
+    try:
+        from osgeo import ogr
+    except ImportError:
+        return 0
+
+    creados = 0
+    for capa in capas:
+        if capa.suffix.lower() != ".shp" or capa.with_suffix(".qix").exists():
+            continue
+        try:
+            ds = ogr.Open(str(capa), 1)
+            if ds is None:
                 continue
-            layers.append(item)
-    return layers
+            ds.ExecuteSQL(f'CREATE SPATIAL INDEX ON "{capa.stem}"')
+            ds = None
+            creados += 1
+        except Exception as e:
+            print(f"⚠️ No se pudo indexar {capa.name}: {e}")
+    return creados
+
+# Pool compartido para el análisis de afecciones por capa (GEOS libera el GIL)
+_EXECUTOR_AFECCIONES = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+# Con pocas capas el coste del pool no compensa
+UMBRAL_CAPAS_PARALELO = 4
+
+# Porcentaje a partir del cual la parcela está totalmente afectada
+AFECCION_COMPLETA_PCT = 100.0
+
+async def _analizar_capas(parcela_path, nombres_capas, campo_clasificacion="tipo", exhaustivo=True):
+    """
+    Analiza la parcela contra cada capa, en paralelo si hay más de
+    UMBRAL_CAPAS_PARALELO. Devuelve [(nombre, resultado o excepción)]
+    en el mismo orden que nombres_capas.
+
+    Con exhaustivo=False se corta en la primera capa, en el orden de
+    nombres_capas, que cubre toda la parcela: las capas siguientes no
+    aparecen aunque ya se hubieran analizado, así el resultado no depende
+    de qué hilo termine antes. Las que aún no habían empezado se cancelan.
+    """
+    # La parcela se lee y reproyecta una sola vez para todas las capas
+    loop = asyncio.get_running_loop()
+    try:
+        parcela = await loop.run_in_executor(_EXECUTOR_AFECCIONES, analyzer.cargar_parcela, parcela_path)
+    except Exception as e:
+        return [(capa_name, e) for capa_name in nombres_capas]
+
+    def _analizar_una(capa_name):
+        return analyzer.analizar_parcela_precargada(parcela, capa_name, campo_clasificacion)
+
+    def _cubre_parcela(res):
+        return (
+            not exhaustivo
+            and not isinstance(res, Exception)
+            and res.get("total_afectado_percent", 0) >= AFECCION_COMPLETA_PCT
+        )
+
+    resultados = []
+    if len(nombres_capas) <= UMBRAL_CAPAS_PARALELO:
+        for capa_name in nombres_capas:
+            try:
+                res = await loop.run_in_executor(_EXECUTOR_AFECCIONES, _analizar_una, capa_name)
+            except Exception as e:
+                res = e
+            resultados.append((capa_name, res))
+            if _cubre_parcela(res):
+                break
+        return resultados
+
+    futuros = [_EXECUTOR_AFECCIONES.submit(_analizar_una, capa_name) for capa_name in nombres_capas]
+    try:
+        # Se recogen en el orden de entrada, no en el de finalización
+        for capa_name, futuro in zip(nombres_capas, futuros):
+            try:
+                res = await asyncio.wrap_future(futuro)
+            except Exception as e:
+                res = e
+            resultados.append((capa_name, res))
+            if _cubre_parcela(res):
+                break
+    finally:
+        # cancel() solo afecta a las que no han empezado; las que están en curso terminan
+        for futuro in futuros:
+            futuro.cancel()
+    return resultados
+
+# Pool de procesos para generar PDFs (CPU) sin bloquear el event loop
+_PDF_POOL: Optional[ProcessPoolExecutor] = None
+
+def _pool_pdf() -> ProcessPoolExecutor:
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        _PDF_POOL = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1))
+    return _PDF_POOL
+
+async def _generar_pdf(output_dir, referencia, resultados, mapas, incluir_tabla=True):
+    """
+    Genera el PDF en el pool de procesos. Solo si el pool no se puede usar
+    (no se crea, se rompe o no puede serializar los datos) se genera en un
+    hilo; los errores del propio generador se propagan tal cual.
+    """
+    global _PDF_POOL
+    args = (str(output_dir), referencia, resultados, mapas, incluir_tabla)
+    loop = asyncio.get_running_loop()
+    try:
+        pool = _pool_pdf()
+    except (OSError, NotImplementedError) as e:
+        print(f"⚠️ Pool de PDFs no disponible ({e}), generando en un hilo")
+        return await asyncio.to_thread(generar_pdf_en_proceso, *args)
+    try:
+        return await loop.run_in_executor(pool, generar_pdf_en_proceso, *args)
+    except (BrokenProcessPool, pickle.PicklingError) as e:
+        if isinstance(e, BrokenProcessPool):
+            # Un pool roto no se recupera: se creará otro en la siguiente petición
+            _PDF_POOL = None
+        print(f"⚠️ Pool de PDFs no disponible ({e}), generando en un hilo")
+        return await asyncio.to_thread(generar_pdf_en_proceso, *args)
+
+# Overlay precalculado de todas las capas (AFECCIONES_OVERLAY=1).
+# Por defecto se mantiene el análisis capa a capa.
+USAR_OVERLAY_AFECCIONES = os.getenv("AFECCIONES_OVERLAY", "0") == "1"
+_OVERLAY_PATH = CAPAS_DIR / "_overlay.fgb"
+_overlay_lock = threading.Lock()
+_SIN_AFECCION = {"afecciones": [], "total_afectado_percent": 0.0, "afecciones_detectadas": False}
+
+def _overlay_vigente():
+    """
+    (overlay, capas que contiene), regenerándolo si alguna capa es más
+    reciente; (None, set()) si no hay overlay. Solo entran capas de archivo:
+    las de PostGIS (postgis://) se analizan capa a capa.
+    """
+    capas = [
+        (c["nombre"], c["ruta_completa"]) for c in urbanismo_service.listar_capas()
+        if c.get("tipo") != "postgis" and not str(c["ruta_completa"]).startswith("postgis://")
+    ]
+    with _overlay_lock:
+        try:
+            mtime_capas = max((os.stat(ruta).st_mtime_ns for _, ruta in capas), default=0)
+            incluidas = analyzer.capas_de_overlay(_OVERLAY_PATH)
+            if incluidas is not None and _OVERLAY_PATH.stat().st_mtime_ns >= mtime_capas:
+                return _OVERLAY_PATH, incluidas
+        except OSError:
+            pass
+        overlay = analyzer.construir_overlay(capas, _OVERLAY_PATH)
+        if not overlay:
+            return None, set()
+        return overlay, analyzer.capas_de_overlay(overlay) or set()
+
+async def _resultados_afecciones(parcela_path, nombres_capas, exhaustivo=True):
+    """
+    Resultados por capa [(nombre, resultado)]: con el overlay activado una
+    sola consulta espacial para las capas que contiene y análisis capa a capa
+    para el resto (PostGIS o ilegibles al construirlo); sin overlay, todas
+    capa a capa.
+    """
+    if USAR_OVERLAY_AFECCIONES and nombres_capas:
+        loop = asyncio.get_running_loop()
+        try:
+            overlay, en_overlay = await loop.run_in_executor(_EXECUTOR_AFECCIONES, _overlay_vigente)
+            if overlay:
+                por_capa = await loop.run_in_executor(
+                    _EXECUTOR_AFECCIONES, analyzer.analizar_overlay, parcela_path, overlay
+                )
+                resto = [capa_name for capa_name in nombres_capas if capa_name not in en_overlay]
+                otras = dict(await _analizar_capas(parcela_path, resto, exhaustivo=exhaustivo)) if resto else {}
+                resultados = []
+                for capa_name in nombres_capas:
+                    if capa_name in en_overlay:
+                        # Sin intersección en el overlay = capa sin afección
+                        resultados.append((capa_name, por_capa.get(capa_name, _SIN_AFECCION)))
+                    elif capa_name in otras:
+                        resultados.append((capa_name, otras[capa_name]))
+                return resultados
+        except Exception as e:
+            print(f"⚠️ Overlay de afecciones no disponible, se analiza capa a capa: {e}")
+    return await _analizar_capas(parcela_path, nombres_capas, exhaustivo=exhaustivo)
 
 # --- ENDPOINTS ---
 @app.get("/api/health")
@@ -137,6 +425,90 @@ import zipfile
 import csv
 from datetime import datetime
 
+# Tabla para eliminar espacios y saltos de línea de una referencia catastral
+_STRIP_WS = str.maketrans('', '', ' \t\r\n')
+
+def normalizar_referencia(referencia: str) -> str:
+    """Referencia catastral sin espacios y en mayúsculas."""
+    return referencia.translate(_STRIP_WS).upper()
+
+def _nombres_en(directorio) -> set:
+    """Nombres de las entradas de un directorio (una sola lectura con scandir)."""
+    try:
+        with os.scandir(directorio) as it:
+            return {entry.name for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+def _archivos_en(directorio, sufijo: str) -> List[str]:
+    """Nombres de ficheros con ese sufijo (equivale a glob("*" + sufijo), sin fnmatch)."""
+    try:
+        with os.scandir(directorio) as it:
+            return [
+                entry.name for entry in it
+                if entry.name.endswith(sufijo) and not entry.name.startswith(".") and entry.is_file()
+            ]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+def _gml_parcela(ref_dir: Path, ref_limpia: str) -> Optional[Path]:
+    """GML de la parcela en la raíz de la referencia o en gml/ (estructura antigua)."""
+    nombre = f"{ref_limpia}_parcela.gml"
+    if nombre in _nombres_en(ref_dir):
+        return ref_dir / nombre
+    if nombre in _nombres_en(ref_dir / "gml"):
+        return ref_dir / "gml" / nombre
+    return None
+
+@dataclass(slots=True, frozen=True)
+class _PeticionReferencia:
+    """Datos comunes de una petición por referencia, calculados una sola vez"""
+    ref: str
+    ref_dir: Path
+    existe: bool
+    gml: Optional[Path]
+    nombres_raiz: frozenset
+    nombres_gml: frozenset
+
+def _preparar_peticion(referencia: str) -> _PeticionReferencia:
+    """Normaliza la referencia y localiza su carpeta y su GML con una lectura por directorio."""
+    ref = normalizar_referencia(referencia)
+    ref_dir = OUTPUTS_DIR / ref
+    nombres_raiz = frozenset(_nombres_en(ref_dir))
+    nombres_gml = frozenset(_nombres_en(ref_dir / "gml"))
+
+    nombre = f"{ref}_parcela.gml"
+    if nombre in nombres_raiz:
+        gml = ref_dir / nombre
+    elif nombre in nombres_gml:
+        gml = ref_dir / "gml" / nombre
+    else:
+        gml = None
+
+    existe = bool(nombres_raiz) or ref_dir.is_dir()
+    return _PeticionReferencia(ref, ref_dir, existe, gml, nombres_raiz, nombres_gml)
+
+# Normalización de claves "Capa - Clase" a nombres de columna
+_TRANS_CLAVE = str.maketrans({" ": "_", "-": "_"})
+
+# A partir de este número de claves compensa vectorizar con NumPy
+UMBRAL_DETALLE_NUMPY = 64
+
+def _escalar_redondeado(valores, divisor: float, multiplicador: float) -> list:
+    """
+    [round((v / divisor) * multiplicador, 2)] para cada valor.
+
+    Con muchos valores la aritmética se hace con NumPy (mismas operaciones en el
+    mismo orden, mismo resultado en float64); el redondeo es siempre el round()
+    de Python para que el CSV no dependa del número de claves.
+    """
+    valores = list(valores)
+    if len(valores) < UMBRAL_DETALLE_NUMPY:
+        return [round((v / divisor) * multiplicador, 2) for v in valores]
+    import numpy as np
+    escalados = (np.fromiter(valores, dtype=np.float64, count=len(valores)) / divisor) * multiplicador
+    return [round(x, 2) for x in escalados.tolist()]
+
 def generar_csv_tecnico(referencia, urban_data, aff_data, output_dir):
     """Genera un CSV con todos los datos técnicos del análisis."""
     filepath = output_dir / f"{referencia}_datos_tecnicos.csv"
@@ -207,14 +579,14 @@ def generar_csv_tecnico(referencia, urban_data, aff_data, output_dir):
                 data["URB_Recomendaciones"] = " | ".join(recomendaciones[:3])  # Primeras 3
         
         # Detalles urbanísticos (compatibilidad con sistema anterior)
-        if urban_data.get("detalle"):
-            for k, v in urban_data.get("detalle", {}).items():
-                key_name = f"URB_{k.replace(' ', '_')}_pct"
-                data[key_name] = v
-                # Calcular área aprox
-                area = data["Area_Parcela_m2"]
-                if area > 0:
-                    data[f"URB_{k.replace(' ', '_')}_m2"] = round((v / 100) * area, 2)
+        detalle_urb = urban_data.get("detalle")
+        if detalle_urb:
+            claves = {k: f"URB_{k.replace(' ', '_')}" for k in detalle_urb}
+            data |= {f"{claves[k]}_pct": v for k, v in detalle_urb.items()}
+            # Calcular área aprox
+            area = data["Area_Parcela_m2"]
+            if area > 0:
+                data |= zip((f"{claves[k]}_m2" for k in detalle_urb), _escalar_redondeado(detalle_urb.values(), 100, area))
     else:
         data["Analisis_Urbanistico"] = "No"
         data["Area_Parcela_m2"] = 0.0
@@ -231,17 +603,18 @@ def generar_csv_tecnico(referencia, urban_data, aff_data, output_dir):
         data["Area_Total_Parcela_m2"] = aff_data.get("area_total_m2", 0.0)
         
         # Detalles de afecciones
-        if aff_data.get("detalle"):
-            for k, v in aff_data.get("detalle", {}).items():
-                # k es "Capa - Clase"
-                clean_key = f"AF_{k}".replace(" ", "_").replace("-", "_").replace("__", "_")
-                data[f"{clean_key}_m2"] = v
-                # Calcular porcentaje
-                area = data["Area_Total_Parcela_m2"]
-                if area > 0:
-                    data[f"{clean_key}_pct"] = round((v / area) * 100, 2)
-                else:
-                    data[f"{clean_key}_pct"] = 0.0
+        detalle_af = aff_data.get("detalle")
+        if detalle_af:
+            # k es "Capa - Clase"
+            claves = {k: f"AF_{k}".translate(_TRANS_CLAVE).replace("__", "_") for k in detalle_af}
+            area = data["Area_Total_Parcela_m2"]
+            data |= {f"{claves[k]}_m2": v for k, v in detalle_af.items()}
+            # Calcular porcentaje
+            if area > 0:
+                pcts = _escalar_redondeado(detalle_af.values(), area, 100)
+            else:
+                pcts = [0.0] * len(detalle_af)
+            data |= zip((f"{claves[k]}_pct" for k in detalle_af), pcts)
     else:
         data["Analisis_Afecciones"] = "No"
         data["Afecciones_Detectadas"] = False
@@ -251,11 +624,14 @@ def generar_csv_tecnico(referencia, urban_data, aff_data, output_dir):
     
     # 5. Archivos generados (verificar existencia)
     ref_dir = output_dir
-    data["PDF_Ficha"] = "Sí" if (ref_dir / "pdf" / f"{referencia}_ficha_catastral.pdf").exists() else "No"
-    data["PDF_Urbanistico"] = "Sí" if (ref_dir / f"Informe_{referencia}.pdf").exists() else "No"  # Cambiado: misma carpeta
-    data["GML_Parcela"] = "Sí" if (ref_dir / f"{referencia}_parcela.gml").exists() or (ref_dir / "gml" / f"{referencia}_parcela.gml").exists() else "No"
-    data["KML_Parcela"] = "Sí" if (ref_dir / f"{referencia}_parcela.kml").exists() or (ref_dir / "gml" / f"{referencia}_parcela.kml").exists() else "No"
-    data["Certificado_Urb"] = "Sí" if (ref_dir / f"certificado_{referencia}.txt").exists() else "No"  # Nuevo: certificado
+    en_raiz = _nombres_en(ref_dir)
+    en_gml = _nombres_en(ref_dir / "gml")
+    en_pdf = _nombres_en(ref_dir / "pdf")
+    data["PDF_Ficha"] = "Sí" if f"{referencia}_ficha_catastral.pdf" in en_pdf else "No"
+    data["PDF_Urbanistico"] = "Sí" if f"Informe_{referencia}.pdf" in en_raiz else "No"  # Cambiado: misma carpeta
+    data["GML_Parcela"] = "Sí" if f"{referencia}_parcela.gml" in en_raiz or f"{referencia}_parcela.gml" in en_gml else "No"
+    data["KML_Parcela"] = "Sí" if f"{referencia}_parcela.kml" in en_raiz or f"{referencia}_parcela.kml" in en_gml else "No"
+    data["Certificado_Urb"] = "Sí" if f"certificado_{referencia}.txt" in en_raiz else "No"  # Nuevo: certificado
     
     # 6. Metadatos del sistema
     data["Servidor"] = "Suite Tasación v3.1"
@@ -285,9 +661,9 @@ def generar_csv_tecnico(referencia, urban_data, aff_data, output_dir):
         final_columns = [col for col in column_order if col in data]
         
         with open(filepath, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=final_columns)
-            writer.writeheader()
-            writer.writerow(data)
+            writer = csv.writer(f)
+            writer.writerow(final_columns)
+            writer.writerow([data[col] for col in final_columns])
             
         print(f"✅ CSV técnico generado: {filepath}")
         print(f"   📊 Columnas: {len(final_columns)}")
@@ -308,7 +684,7 @@ async def paso1_analizar_catastro(referencia: str = Form(...)):
     """
     try:
         # Limpiar referencia
-        ref_limpia = referencia.replace(' ', '').strip().upper()
+        ref_limpia = normalizar_referencia(referencia)
         
         if len(ref_limpia) < 14:
             raise HTTPException(
@@ -326,23 +702,14 @@ async def paso1_analizar_catastro(referencia: str = Form(...)):
             )
         
         # 2. Generar mapa básico
-        ref_dir = OUTPUTS_DIR / ref_limpia
-        gml_path = None
-        posibles_gml = [
-            ref_dir / f"{ref_limpia}_parcela.gml",
-            ref_dir / "gml" / f"{ref_limpia}_parcela.gml",
-        ]
-        
-        for gml_candidate in posibles_gml:
-            if gml_candidate.exists():
-                gml_path = gml_candidate
-                break
-        
-        # 3. Generar "Plano Perfecto" básico
-        plano_path = ref_dir / "images" / f"{ref_limpia}_plano_perfecto.jpg"
-        if gml_path and gml_path.exists():
-            images_dir = ref_dir / "images"
-            images_dir.mkdir(parents=True, exist_ok=True)
+        peticion = _preparar_peticion(ref_limpia)
+        ref_dir, gml_path = peticion.ref_dir, peticion.gml
+        
+        # 3. "Plano Perfecto" básico: descargar_todo() ya lo pinta en images/;
+        # aquí solo se genera si esa descarga no lo dejó
+        plano_path = ref_dir / "images" / f"{ref_limpia}_plano_perfecto.png"
+        if gml_path and not plano_path.exists():
+            plano_path.parent.mkdir(parents=True, exist_ok=True)
             downloader.generar_plano_perfecto(
                 gml_path=gml_path,
                 output_path=plano_path,
@@ -389,27 +756,15 @@ async def analizar_urbanismo_endpoint(referencia: str = Form(...)):
     Análisis urbanístico separado para una referencia catastral
     """
     try:
-        ref_limpia = referencia.replace(' ', '').strip().upper()
-        ref_dir = OUTPUTS_DIR / ref_limpia
+        peticion = _preparar_peticion(referencia)
+        ref_limpia, ref_dir, gml_path = peticion.ref, peticion.ref_dir, peticion.gml
         
-        if not ref_dir.exists():
+        if not peticion.existe:
             raise HTTPException(
                 status_code=404,
                 detail=f"No se encontraron datos catastrales para {ref_limpia}"
             )
         
-        # Buscar GML
-        gml_path = None
-        posibles_gml = [
-            ref_dir / f"{ref_limpia}_parcela.gml",
-            ref_dir / "gml" / f"{ref_limpia}_parcela.gml",
-        ]
-        
-        for gml_candidate in posibles_gml:
-            if gml_candidate.exists():
-                gml_path = gml_candidate
-                break
-        
         if not gml_path:
             raise HTTPException(
                 status_code=404,
@@ -427,13 +782,8 @@ async def analizar_urbanismo_endpoint(referencia: str = Form(...)):
                 mapas_urbanismo = urbanismo_service.obtener_mapas(ref_limpia)
                 
                 if mapas_urbanismo:
-                    from afecciones.pdf_generator import AfeccionesPDF
-                    pdf_gen_temp = AfeccionesPDF(output_dir=str(ref_dir))
-                    urbanismo_pdf_path = pdf_gen_temp.generar(
-                        referencia=ref_limpia,
-                        resultados=result_urban,
-                        mapas=mapas_urbanismo,
-                        incluir_tabla=True
+                    urbanismo_pdf_path = await _generar_pdf(
+                        ref_dir, ref_limpia, result_urban, mapas_urbanismo, incluir_tabla=True
                     )
             except Exception as e:
                 print(f"❌ Error generando PDF urbanístico: {e}")
@@ -454,32 +804,24 @@ async def analizar_urbanismo_endpoint(referencia: str = Form(...)):
         )
 
 @app.post("/api/v1/analizar-afecciones")
-async def analizar_afecciones_endpoint(referencia: str = Form(...)):
+async def analizar_afecciones_endpoint(referencia: str = Form(...), exhaustive: bool = False):
     """
     Análisis de afecciones separado para una referencia catastral
+
+    Por defecto se deja de analizar en la primera capa (en el orden del
+    listado de capas) que afecta al 100% de la parcela: las capas posteriores
+    no aparecen en el detalle. ?exhaustive=true analiza todas las capas.
     """
     try:
-        ref_limpia = referencia.replace(' ', '').strip().upper()
-        ref_dir = OUTPUTS_DIR / ref_limpia
+        peticion = _preparar_peticion(referencia)
+        ref_limpia, ref_dir, gml_path = peticion.ref, peticion.ref_dir, peticion.gml
         
-        if not ref_dir.exists():
+        if not peticion.existe:
             raise HTTPException(
                 status_code=404,
                 detail=f"No se encontraron datos catastrales para {ref_limpia}"
             )
         
-        # Buscar GML
-        gml_path = None
-        posibles_gml = [
-            ref_dir / f"{ref_limpia}_parcela.gml",
-            ref_dir / "gml" / f"{ref_limpia}_parcela.gml",
-        ]
-        
-        for gml_candidate in posibles_gml:
-            if gml_candidate.exists():
-                gml_path = gml_candidate
-                break
-        
         if not gml_path:
             raise HTTPException(
                 status_code=404,
@@ -487,8 +829,7 @@ async def analizar_afecciones_endpoint(referencia: str = Form(...)):
             )
         
         # Obtener capas disponibles
-        todas_capas_info = urbanismo_service.listar_capas()
-        todas_capas_for_analyzer = [c["nombre"] for c in todas_capas_info]
+        todas_capas_for_analyzer = nombres_capas_disponibles()
         print(f"🔍 Analizando afecciones contra {len(todas_capas_for_analyzer)} capas")
         
         # Análisis de afecciones
@@ -501,26 +842,25 @@ async def analizar_afecciones_endpoint(referencia: str = Form(...)):
         
         max_afeccion = 0.0
         
-        for capa_name in todas_capas_for_analyzer:
+        detalle = res_afecciones["detalle"]
+        area_total = 0.0
+        
+        for capa_name, res_capa in await _resultados_afecciones(gml_path, todas_capas_for_analyzer, exhaustive):
             try:
-                res_capa = analyzer.analizar(
-                    parcela_path=gml_path,
-                    capa_input=capa_name,
-                    campo_clasificacion="tipo"
-                )
+                if isinstance(res_capa, Exception):
+                    raise res_capa
                 
                 if "error" in res_capa or not res_capa.get("afecciones_detectadas"):
                     continue
                 
-                if res_afecciones["area_total_m2"] == 0:
-                    res_afecciones["area_total_m2"] = res_capa.get("area_parcela_m2", 0)
+                if area_total == 0:
+                    area_total = res_capa.get("area_parcela_m2", 0)
                 
-                nombre_capa = capa_name
-                if res_capa.get("afecciones"):
+                afecciones = res_capa.get("afecciones")
+                if afecciones:
                     res_afecciones["afecciones_detectadas"] = True
-                    for af in res_capa["afecciones"]:
-                        clave = f"{nombre_capa} - {af.get('clase', 'General')}"
-                        res_afecciones["detalle"][clave] = af.get("area_m2", 0)
+                    for af in afecciones:
+                        detalle[f"{capa_name} - {af.get('clase', 'General')}"] = af.get("area_m2", 0)
                         
                     total_capa = res_capa.get("total_afectado_percent", 0)
                     if total_capa > max_afeccion:
@@ -528,7 +868,12 @@ async def analizar_afecciones_endpoint(referencia: str = Form(...)):
                         
             except Exception as e:
                 print(f"⚠️ Error analizando capa {capa_name}: {e}")
+            
+            # Parcela totalmente afectada: el resto de capas no cambia el total
+            if not exhaustive and max_afeccion >= AFECCION_COMPLETA_PCT:
+                break
         
+        res_afecciones["area_total_m2"] = area_total
         res_afecciones["total"] = max_afeccion
         if not res_afecciones["detalle"]:
             res_afecciones["mensaje"] = "No se detectaron intersecciones con las capas disponibles."
@@ -548,15 +893,20 @@ async def analizar_afecciones_endpoint(referencia: str = Form(...)):
         )
 
 @app.post("/api/v1/generar-pdf")
-async def paso2_generar_pdf(req: PdfRequest):
+async def paso2_generar_pdf(req: PdfRequest, exhaustive: bool = False):
     """
     Paso 2: Genera PDF con mapas y afecciones
+
+    Por defecto el análisis se corta en la primera capa (en el orden del
+    listado de capas) que afecta al 100% de la parcela, y las capas
+    posteriores no aparecen en el PDF ni en el CSV. ?exhaustive=true las
+    analiza todas.
     """
     try:
-        ref_limpia = req.referencia.replace(' ', '').strip().upper()
-        ref_dir = OUTPUTS_DIR / ref_limpia
+        peticion = _preparar_peticion(req.referencia)
+        ref_limpia, ref_dir = peticion.ref, peticion.ref_dir
         
-        if not ref_dir.exists():
+        if not peticion.existe:
             raise HTTPException(
                 status_code=404,
                 detail=f"No se encontraron datos para la referencia {ref_limpia}"
@@ -566,7 +916,7 @@ async def paso2_generar_pdf(req: PdfRequest):
         mapas_a_incluir = []
         if req.incluir_mapa:
             images_dir = ref_dir / "images"
-            if images_dir.exists():
+            if "images" in peticion.nombres_raiz:
                 # Buscar mapas de parcela (zoom 4)
                 for mapa_file in images_dir.glob(f"{ref_limpia}*zoom4*.png"):
                     mapas_a_incluir.append(str(mapa_file))
@@ -580,12 +930,11 @@ async def paso2_generar_pdf(req: PdfRequest):
         # Análisis de afecciones MULTI-CAPA
         resultados_afecciones = {}
         if req.incluir_afecciones:
-            gml_path = ref_dir / "gml" / f"{ref_limpia}_parcela.gml"
-            if gml_path.exists():
+            gml_path = peticion.gml
+            if gml_path:
                 try:
                     # Obtener todas las capas disponibles a través del servicio de urbanismo
-                    todas_capas_info = urbanismo_service.listar_capas()
-                    todas_capas_for_analyzer = [c["nombre"] for c in todas_capas_info] # Extraer solo los nombres
+                    todas_capas_for_analyzer = nombres_capas_disponibles()
                     print(f"📄 PDF Afecciones: analizando contra {len(todas_capas_for_analyzer)} capas disponibles en el sistema")
                     
                     resultados_afecciones = {
@@ -597,41 +946,40 @@ async def paso2_generar_pdf(req: PdfRequest):
                     max_afeccion_pct = 0.0
                     max_afeccion_area = 0.0
 
-                    for capa_name in todas_capas_for_analyzer: # Iterate over names
+                    # Analizar todas las capas (overlay o en paralelo si son muchas)
+                    detalle = resultados_afecciones["detalle"]
+                    area_total = 0.0
+
+                    for capa_name, res_capa in await _resultados_afecciones(gml_path, todas_capas_for_analyzer, exhaustive):
                         try:
-                            # Analizar capa
-                            res_capa = analyzer.analizar(
-                                gml_path, 
-                                capa_name, # Pass name
-                                "tipo"
-                            )
+                            if isinstance(res_capa, Exception):
+                                raise res_capa
                             
                             if "error" in res_capa or not res_capa.get("afecciones_detectadas"):
                                 continue
 
                             # Setear área total de parcela una sola vez
-                            if resultados_afecciones["area_total_m2"] == 0:
-                                resultados_afecciones["area_total_m2"] = res_capa.get("area_parcela_m2", 0)
+                            if area_total == 0:
+                                area_total = res_capa.get("area_parcela_m2", 0)
 
-                            # Agregar detalles
-                            nombre_capa = capa_name # nombre_capa ya es el nombre
-                            for af in res_capa.get("afecciones", []):
-                                clave = f"{nombre_capa} - {af.get('clase', 'General')}"
-                                # PDF Generator espera porcentajes en 'detalle'
-                                resultados_afecciones["detalle"][clave] = af.get("porcentaje", 0)
+                            # Agregar detalles (PDF Generator espera porcentajes en 'detalle')
+                            for af in res_capa.get("afecciones", ()):
+                                detalle[f"{capa_name} - {af.get('clase', 'General')}"] = af.get("porcentaje", 0)
 
                             # Calcular máximos para resumen
                             total_capa_pct = res_capa.get("total_afectado_percent", 0)
-                            total_capa_area = res_capa.get("total_afectado_m2", 0)
-                            
                             if total_capa_pct > max_afeccion_pct:
                                 max_afeccion_pct = total_capa_pct
-                                max_afeccion_area = total_capa_area
+                                max_afeccion_area = res_capa.get("total_afectado_m2", 0)
 
                         except Exception as e:
-                            print(f"⚠️ Error capa PDF {capa_name}: {e}") # Use capa_name
+                            print(f"⚠️ Error capa PDF {capa_name}: {e}")
+
+                        if not exhaustive and max_afeccion_pct >= AFECCION_COMPLETA_PCT:
+                            break
                     
                     # Asignar máximos (Peor caso)
+                    resultados_afecciones["area_total_m2"] = area_total
                     resultados_afecciones["total"] = max_afeccion_pct
                     resultados_afecciones["area_afectada_m2"] = max_afeccion_area
 
@@ -641,10 +989,8 @@ async def paso2_generar_pdf(req: PdfRequest):
 
         # Generar PDF
         print(f"📄 Generando PDF para: {ref_limpia}")
-        pdf_path = pdf_gen.generar(
-            referencia=ref_limpia,
-            resultados=resultados_afecciones,
-            mapas=mapas_a_incluir,
+        pdf_path = await _generar_pdf(
+            pdf_gen.output_dir, ref_limpia, resultados_afecciones, mapas_a_incluir,
             incluir_tabla=req.incluir_afecciones
         )
 
@@ -675,6 +1021,30 @@ async def paso2_generar_pdf(req: PdfRequest):
             }
         )
 
+TAM_BLOQUE_SUBIDA = 64 * 1024
+
+async def _leer_referencias_subida(file: UploadFile) -> List[str]:
+    """Lee las referencias (una por línea) por bloques, sin cargar el archivo entero."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    referencias = {}
+    pendiente = ""
+
+    def _anotar(lineas):
+        for line in lineas:
+            ref = normalizar_referencia(line)
+            if len(ref) >= 14:
+                referencias[ref] = None
+
+    while chunk := await file.read(TAM_BLOQUE_SUBIDA):
+        pendiente += decoder.decode(chunk)
+        *lineas, pendiente = pendiente.split("\n")
+        _anotar(lineas)
+    pendiente += decoder.decode(b"", final=True)
+    _anotar(pendiente.splitlines())
+
+    # dict conserva el orden de aparición y elimina duplicados
+    return list(referencias)
+
 @app.post("/api/v1/lote")
 async def procesar_lote_endpoint(
     file: UploadFile = File(...), 
@@ -685,16 +1055,8 @@ async def procesar_lote_endpoint(
     Formato: una referencia por línea
     """
     try:
-        # Leer archivo
-        content = await file.read()
-        decoded = content.decode("utf-8", errors="ignore")
-        
-        # Extraer referencias (una por línea)
-        referencias = [
-            line.strip().replace(' ', '').upper() 
-            for line in decoded.splitlines() 
-            if line.strip() and len(line.strip()) >= 14
-        ]
+        # Leer archivo y extraer referencias (una por línea)
+        referencias = await _leer_referencias_subida(file)
         
         if not referencias:
             raise HTTPException(
@@ -770,20 +1132,22 @@ async def obtener_estado_lote(lote_id: str):
 async def descargar_zip_lote(lote_id: str):
     """
     Descarga un ZIP con todos los resultados del lote (Resumen + ZIPs individuales)
+
+    El ZIP se genera al vuelo y se envía por bloques según se va comprimiendo.
     """
     try:
-        zip_path = lote_manager.empaquetar_lote(lote_id)
+        bloques = lote_manager.iterar_zip_lote(lote_id)
         
-        if not zip_path or not zip_path.exists():
+        if bloques is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"No se pudo generar el ZIP para el lote {lote_id}"
             )
             
-        return FileResponse(
-            zip_path,
+        return StreamingResponse(
+            bloques,
             media_type="application/zip",
-            filename=f"{lote_id}_resultados.zip"
+            headers={"Content-Disposition": f'attachment; filename="{lote_id}_resultados.zip"'}
         )
     except HTTPException:
         raise
@@ -794,25 +1158,28 @@ async def descargar_zip_lote(lote_id: str):
         )
 
 @app.get("/api/v1/lote/{lote_id}/resumen")
-async def obtener_resumen_lote(lote_id: str):
+async def obtener_resumen_lote(lote_id: str, request: Request):
     """
     Obtiene el resumen HTML de un lote procesado
     """
     try:
-        # Forzar regeneración del resumen para asegurar que el botón aparezca
-        # incluso si el lote se procesó con una versión anterior del código
-        lote_manager.regenerar_resumen(lote_id)
+        # Regenerar solo si el lote (o el código que pinta el resumen) es más
+        # reciente que el HTML, para que lotes antiguos sigan mostrando el botón
+        etag = await anyio.to_thread.run_sync(lote_manager.asegurar_resumen, lote_id)
         
         lotes_dir = OUTPUTS_DIR / "_lotes"
         resumen_path = lotes_dir / f"{lote_id}_resumen.html"
         
-        if not resumen_path.exists():
+        if etag is None or not resumen_path.exists():
             raise HTTPException(
                 status_code=404,
                 detail=f"Resumen del lote {lote_id} no encontrado"
             )
         
-        return FileResponse(resumen_path)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        return FileResponse(resumen_path, headers={"ETag": etag})
         
     except HTTPException:
         raise
@@ -829,7 +1196,7 @@ async def procesar_referencia_simple(referencia: str = Form(...)):
     Más rápido para obtener solo información catastral
     """
     try:
-        ref_limpia = referencia.replace(' ', '').strip().upper()
+        ref_limpia = normalizar_referencia(referencia)
         
         if len(ref_limpia) < 14:
             raise HTTPException(
@@ -887,10 +1254,11 @@ async def obtener_info_referencia(referencia: str):
     Obtiene información de una referencia ya procesada
     """
     try:
-        ref_limpia = referencia.replace(' ', '').strip().upper()
-        ref_dir = OUTPUTS_DIR / ref_limpia
-        
-        if not ref_dir.exists():
+        ref_limpia = normalizar_referencia(referencia)
+        # Rutas como texto: en esta consulta no hace falta construir objetos Path
+        ref_root = os.path.join(OUTPUTS_DIR, ref_limpia)
+
+        if not os.path.isdir(ref_root):
             raise HTTPException(
                 status_code=404,
                 detail=f"No se encontraron datos para {ref_limpia}"
@@ -909,44 +1277,42 @@ async def obtener_info_referencia(referencia: str):
             }
         }
 
+        # Una sola lectura (scandir) por subdirectorio; las URLs se montan como texto
+        base_url = f"/outputs/{ref_limpia}"
+
         # GML
-        gml_dir = ref_dir / "gml"
-        if gml_dir.exists():
-            for gml_file in gml_dir.glob("*.gml"):
-                if "parcela" in gml_file.name:
-                    info["archivos"]["gml_parcela"] = f"/outputs/{ref_limpia}/gml/{gml_file.name}"
-                elif "edificio" in gml_file.name:
-                    info["archivos"]["gml_edificio"] = f"/outputs/{ref_limpia}/gml/{gml_file.name}"
+        for nombre in _archivos_en(os.path.join(ref_root, "gml"), ".gml"):
+            if "parcela" in nombre:
+                info["archivos"]["gml_parcela"] = f"{base_url}/gml/{nombre}"
+            elif "edificio" in nombre:
+                info["archivos"]["gml_edificio"] = f"{base_url}/gml/{nombre}"
 
         # PDFs
-        pdf_dir = ref_dir / "pdf"
-        if pdf_dir.exists():
-            for pdf_file in pdf_dir.glob("*.pdf"):
-                info["archivos"]["pdfs"].append(f"/outputs/{ref_limpia}/pdf/{pdf_file.name}")
-                if "ficha_catastral" in pdf_file.name:
-                    info["archivos"]["ficha_catastral"] = f"/outputs/{ref_limpia}/pdf/{pdf_file.name}"
+        for nombre in _archivos_en(os.path.join(ref_root, "pdf"), ".pdf"):
+            info["archivos"]["pdfs"].append(f"{base_url}/pdf/{nombre}")
+            if "ficha_catastral" in nombre:
+                info["archivos"]["ficha_catastral"] = f"{base_url}/pdf/{nombre}"
 
         # Imágenes y Metadata
-        images_dir = ref_dir / "images"
-        if images_dir.exists():
-            for img_file in images_dir.glob("*.png"):
-                info["archivos"]["imagenes"].append(f"/outputs/{ref_limpia}/images/{img_file.name}")
-            
-            # Cargar metadata.json si existe
-            metadata_path = images_dir / "metadata.json"
-            if metadata_path.exists():
-                try:
-                    with open(metadata_path, 'r', encoding='utf-8') as f:
-                        info["metadata_imagenes"] = json.load(f)
-                except Exception as e:
-                    print(f"⚠️ Error cargando metadata: {e}")
-                    info["metadata_imagenes"] = {}
+        images_dir = os.path.join(ref_root, "images")
+        info["archivos"]["imagenes"] = [
+            f"{base_url}/images/{nombre}" for nombre in _archivos_en(images_dir, ".png")
+        ]
+
+        # Cargar metadata.json si existe
+        metadata_path = os.path.join(images_dir, "metadata.json")
+        if os.path.isfile(metadata_path):
+            try:
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    info["metadata_imagenes"] = json.load(f)
+            except Exception as e:
+                print(f"⚠️ Error cargando metadata: {e}")
+                info["metadata_imagenes"] = {}
 
         # JSON
-        json_dir = ref_dir / "json"
-        if json_dir.exists():
-            for json_file in json_dir.glob("*.json"):
-                info["archivos"]["json"].append(f"/outputs/{ref_limpia}/json/{json_file.name}")
+        info["archivos"]["json"] = [
+            f"{base_url}/json/{nombre}" for nombre in _archivos_en(os.path.join(ref_root, "json"), ".json")
+        ]
 
         return info
 
@@ -958,17 +1324,84 @@ async def obtener_info_referencia(referencia: str):
             content={"status": "error", "error": str(e)}
         )
 
+@lru_cache(maxsize=64)
+def _transformer_a_wgs84(crs_origen: str):
+    """Transformer de pyproj por CRS de origen (construirlo es lo caro)."""
+    from pyproj import Transformer
+    return Transformer.from_crs(crs_origen, "EPSG:4326", always_xy=True)
+
+def _a_wgs84(gdf):
+    """Equivale a gdf.to_crs("EPSG:4326") reutilizando el Transformer cacheado."""
+    if not gdf.crs or gdf.crs == "EPSG:4326":
+        return gdf
+    if gdf.empty:
+        return gdf.to_crs("EPSG:4326")
+    import numpy as np
+    import shapely
+
+    geometrias = gdf.geometry.to_numpy()
+    if shapely.has_z(geometrias).any():
+        return gdf.to_crs("EPSG:4326")
+
+    coords = shapely.get_coordinates(geometrias)
+    x, y = _transformer_a_wgs84(gdf.crs.to_wkt()).transform(coords[:, 0], coords[:, 1])
+    # set_coordinates sustituye los elementos del array: trabajar sobre una copia
+    geometrias = shapely.set_coordinates(geometrias.copy(), np.column_stack((x, y)))
+
+    gdf = gdf.copy()
+    gdf[gdf.geometry.name] = geometrias
+    return gdf.set_crs("EPSG:4326", allow_override=True)
+
+def _json_bytes(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str, ensure_ascii=False).encode("utf-8")
+
+def _gdf_a_geojson_bytes(gdf) -> bytes:
+    """
+    FeatureCollection en bytes, con el mismo formato que gdf.to_json(): las
+    geometrías las escribe GEOS (shapely.to_geojson) y solo las propiedades
+    pasan por el serializador JSON.
+    """
+    import shapely
+
+    geometrias = shapely.to_geojson(gdf.geometry.to_numpy())
+    props = gdf.drop(columns=gdf.geometry.name)
+    props = props.astype(object).where(props.notna(), None)
+
+    features = [
+        b'{"id":' + _json_bytes(str(idx))
+        + b',"type":"Feature","properties":' + _json_bytes(registro)
+        + b',"geometry":' + (geom.encode("utf-8") if geom is not None else b"null") + b"}"
+        for idx, registro, geom in zip(gdf.index, props.to_dict("records"), geometrias)
+    ]
+    return b'{"type":"FeatureCollection","features":[' + b",".join(features) + b"]}"
+
+@lru_cache(maxsize=256)
+def _geojson_parcela(gml_path: str, gml_mtime_ns: int) -> bytes:
+    """GeoJSON (WGS84) de la parcela, cacheado mientras el GML no cambie."""
+    import geopandas as gpd
+
+    gdf = gpd.read_file(gml_path)
+    # Reproyectar a WGS84 (EPSG:4326) para Leaflet
+    gdf = _a_wgs84(gdf)
+    return _gdf_a_geojson_bytes(gdf)
+
+# Entidades máximas de una capa enviadas al visor
+MAX_ENTIDADES_VISOR = 5000
+
 @app.get("/api/v1/capas/geojson")
 async def obtener_capa_vectorial_geojson(nombre_capa: str): # Change 'ruta' to 'nombre_capa'
     """
     Convierte una capa GPKG del volumen a GeoJSON para el visor
     """
     try:
-        import json
-        import geopandas as gpd
-        
         # Obtener o descargar la capa usando urbanismo_service
-        gdf = urbanismo_service.obtener_o_descargar_capa(nombre_capa=nombre_capa)
+        gdf = await anyio.to_thread.run_sync(
+            lambda: urbanismo_service.obtener_o_descargar_capa(
+                nombre_capa=nombre_capa, max_features=MAX_ENTIDADES_VISOR
+            )
+        )
 
         if gdf is None:
             raise HTTPException(
@@ -976,16 +1409,16 @@ async def obtener_capa_vectorial_geojson(nombre_capa: str): # Change 'ruta' to '
                 detail=f"Capa '{nombre_capa}' no encontrada o no pudo ser descargada."
             )
         
-        # Limitar a 5000 entidades por rendimiento (si es necesario)
-        if len(gdf) > 5000:
-            gdf = gdf.head(5000)
+        # El límite ya lo aplica el lector; por si el origen lo ignora
+        if len(gdf) > MAX_ENTIDADES_VISOR:
+            gdf = gdf.head(MAX_ENTIDADES_VISOR)
         
-        # Reproyectar a WGS84
-        if gdf.crs and gdf.crs != "EPSG:4326":
-            gdf = gdf.to_crs("EPSG:4326")
-        
-        return json.loads(gdf.to_json())
+        # Reproyectar a WGS84 y serializar directamente a bytes GeoJSON
+        contenido = await anyio.to_thread.run_sync(lambda: _gdf_a_geojson_bytes(_a_wgs84(gdf)))
+        return Response(content=contenido, media_type="application/geo+json")
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error convirtiendo capa '{nombre_capa}' a GeoJSON: {e}")
         return JSONResponse(
@@ -999,29 +1432,20 @@ async def obtener_geojson(referencia: str):
     Convierte GML de parcela a GeoJSON para visualización en el visor GIS
     """
     try:
-        import json
-        import geopandas as gpd
-        
-        ref_limpia = referencia.replace(' ', '').strip().upper()
-        gml_path = OUTPUTS_DIR / ref_limpia / "gml" / f"{ref_limpia}_parcela.gml"
+        ref_limpia = normalizar_referencia(referencia)
+        gml_path = _gml_parcela(OUTPUTS_DIR / ref_limpia, ref_limpia)
         
-        if not gml_path.exists():
+        if not gml_path:
             raise HTTPException(
                 status_code=404,
                 detail=f"GML no encontrado para la referencia {ref_limpia}"
             )
         
-        # Leer GML con GeoPandas y convertir a GeoJSON
-        gdf = gpd.read_file(gml_path)
-        
-        # Reproyectar a WGS84 (EPSG:4326) para Leaflet
-        if gdf.crs and gdf.crs != "EPSG:4326":
-            gdf = gdf.to_crs("EPSG:4326")
-        
-        # Convertir a GeoJSON
-        geojson = json.loads(gdf.to_json())
-        
-        return geojson
+        # Leer GML y convertir a GeoJSON (cacheado por mtime del GML)
+        contenido = await anyio.to_thread.run_sync(
+            _geojson_parcela, str(gml_path), gml_path.stat().st_mtime_ns
+        )
+        return Response(content=contenido, media_type="application/geo+json")
         
     except ImportError:
         raise HTTPException(
@@ -1044,7 +1468,6 @@ async def obtener_lote_geojson(lote_id: str):
     """
     try:
         import geopandas as gpd
-        import json
         
         lotes_dir = OUTPUTS_DIR / "_lotes"
         gml_path = lotes_dir / f"{lote_id}_global.gml"
@@ -1057,12 +1480,13 @@ async def obtener_lote_geojson(lote_id: str):
         if not gml_path.exists():
             raise HTTPException(status_code=404, detail="Geometría global no encontrada para este lote")
             
-        gdf = gpd.read_file(gml_path)
-        if gdf.crs and gdf.crs != "EPSG:4326":
-            gdf = gdf.to_crs("EPSG:4326")
-            
-        return json.loads(gdf.to_json())
+        contenido = await anyio.to_thread.run_sync(
+            lambda: _gdf_a_geojson_bytes(_a_wgs84(gpd.read_file(gml_path)))
+        )
+        return Response(content=contenido, media_type="application/geo+json")
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error obteniendo GeoJSON lote: {e}")
         return JSONResponse(status_code=500, content={"status": "error", "error": str(e)})
@@ -1125,7 +1549,7 @@ async def obtener_kml(referencia: str, tipo: str = "parcela"):
     Sirve el archivo KML generado para la referencia (parcela o edificio)
     """
     try:
-        ref_limpia = referencia.replace(' ', '').strip().upper()
+        ref_limpia = normalizar_referencia(referencia)
         kml_path = OUTPUTS_DIR / ref_limpia / "gml" / f"{ref_limpia}_{tipo}.kml"
         
         if not kml_path.exists():
@@ -1134,7 +1558,7 @@ async def obtener_kml(referencia: str, tipo: str = "parcela"):
                 detail=f"KML de {tipo} no encontrado para la referencia {ref_limpia}"
             )
         
-        return FileResponse(
+        return DescargaArchivo(
             kml_path, 
             media_type="application/vnd.google-earth.kml+xml",
             filename=f"{ref_limpia}_{tipo}.kml"
@@ -1155,30 +1579,32 @@ async def analizar_afecciones_manual(
     """
     Endpoint para análisis manual de afecciones subiendo varios KML/GeoJSON
     """
-    import tempfile
     import json
     
     try:
         # Parsear capas solicitadas
         capas_list = json.loads(capas)
         resultados_por_archivo = {}
+        # El listado de capas del sistema es el mismo para todos los archivos
+        todas_capas_info = (
+            urbanismo_service.listar_capas() if "afecciones_totales.gpkg" in capas_list else []
+        )
+        capas_explicitas = [c for c in capas_list if c != "afecciones_totales.gpkg"]
 
         for file in archivos:
-            # Guardar archivo temporal
-            suffix = Path(file.filename).suffix
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                content = await file.read()
-                tmp.write(content)
-                tmp_path = Path(tmp.name)
-            
+            # Se analiza desde memoria: sin archivo temporal que escribir, releer y borrar
+            content = await file.read()
+
             resultados_capas = {}
-            # Analizar contra cada capa
+            # Capas pedidas explícitamente: parcela leída una vez, capas en paralelo
+            explicitas = (
+                dict(await _analizar_capas(content, capas_explicitas)) if capas_explicitas else {}
+            )
             # Analizar contra cada capa
             for capa_name in capas_list:
                 try:
                     # Si piden "afecciones_totales", analizamos TODO lo que haya en el sistema
                     if capa_name == "afecciones_totales.gpkg":
-                        todas_capas_info = urbanismo_service.listar_capas() # Use urbanismo_service
                         res_total = {
                             "afecciones": [],
                             "total_afectado_percent": 0.0,
@@ -1186,36 +1612,36 @@ async def analizar_afecciones_manual(
                             "mensaje": f"Análisis completo contra {len(todas_capas_info)} capas del sistema"
                         }
                         max_pct = 0.0
-                        
-                        for c_info in todas_capas_info: # Iterate over cap-info dicts
-                            try:
-                                r = analyzer.analizar(tmp_path, c_info["nombre"], "tipo") # Pass name
-                                if r.get("afecciones_detectadas"):
-                                    res_total["afecciones_detectadas"] = True
-                                    # Extender lista de afecciones con el nombre de la capa
-                                    nombre_capa = c_info["nombre"] # Already the name
-                                    for af in r.get("afecciones", []):
-                                        af["clase"] = f"{nombre_capa} - {af.get('clase', 'General')}"
-                                        res_total["afecciones"].append(af)
-                                    
-                                    # Maximizar porcentaje
-                                    pct = r.get("total_afectado_percent", 0)
-                                    if pct > max_pct:
-                                        max_pct = pct
-                                        res_total["area_afectada_m2"] = r.get("total_afectado_m2") # Aproximado
-                            except Exception:
+
+                        # Parcela cargada una vez y capas analizadas en el pool de hilos
+                        por_capa = await _resultados_afecciones(
+                            content, [c_info["nombre"] for c_info in todas_capas_info]
+                        )
+                        for nombre_capa, r in por_capa:
+                            if isinstance(r, Exception):
                                 continue
+                            if r.get("afecciones_detectadas"):
+                                res_total["afecciones_detectadas"] = True
+                                # Extender lista de afecciones con el nombre de la capa
+                                for af in r.get("afecciones", []):
+                                    af["clase"] = f"{nombre_capa} - {af.get('clase', 'General')}"
+                                    res_total["afecciones"].append(af)
+
+                                # Maximizar porcentaje
+                                pct = r.get("total_afectado_percent", 0)
+                                if pct > max_pct:
+                                    max_pct = pct
+                                    res_total["area_afectada_m2"] = r.get("total_afectado_m2") # Aproximado
                         
                         res_total["total_afectado_percent"] = max_pct
                         resultados_capas["Afecciones Totales (System)"] = res_total
                         
                     else:
                         # Análisis de capa específica solicitada explícitamente
-                        res = analyzer.analizar(
-                            parcela_path=tmp_path,
-                            capa_input=capa_name,
-                            campo_clasificacion="tipo"
-                        )
+                        res = explicitas[capa_name]
+                        if isinstance(res, Exception):
+                            # Igual que analyzer.analizar() cuando no se puede leer la parcela
+                            res = {"error": str(res), "afecciones": []}
                         if res.get("afecciones_detectadas"):
                             resultados_capas[capa_name] = res
 
@@ -1223,9 +1649,6 @@ async def analizar_afecciones_manual(
                     resultados_capas[capa_name] = {"error": str(e)}
             
             resultados_por_archivo[file.filename] = resultados_capas
-            # Limpiar temporal
-            if tmp_path.exists():
-                tmp_path.unlink()
         
         return {
             "status": "success",
@@ -1277,13 +1700,19 @@ async def obtener_capas_disponibles():
 
 # --- ENDPOINTS SISTEMA GLOBAL (Especificación Técnica) ---
 
+@app.post("/api/v1/refresh-capas")
+async def refrescar_capas():
+    """Invalida la caché de nombres de capas"""
+    urbanismo_service.invalidar_listado_capas()
+    return {"status": "ok", "capas": len(nombres_capas_disponibles())}
+
 @app.post("/api/v1/procesar-completo")
 async def procesar_completo(req: ProcesarCompletoRequest):
     """
     Procesamiento completo: Descarga, Siluetas, Composiciones y ZIP
     """
     try:
-        ref_limpia = req.referencia.replace(' ', '').strip().upper()
+        ref_limpia = normalizar_referencia(req.referencia)
         
         # 1. Descargar y procesar (incluye siluetas y composiciones base)
         # El buffer se gestiona internamente en el downloader (por defecto 200m para contexto)
@@ -1305,13 +1734,13 @@ async def procesar_completo(req: ProcesarCompletoRequest):
 @app.get("/api/v1/descargar-global/{referencia}")
 async def descargar_global(referencia: str):
     """Descarga el ZIP global generado con toda la documentación"""
-    ref_limpia = referencia.replace(' ', '').strip().upper()
+    ref_limpia = normalizar_referencia(referencia)
     zip_path = OUTPUTS_DIR / f"{ref_limpia}_completo.zip"
     
     if not zip_path.exists():
         raise HTTPException(status_code=404, detail="Archivo ZIP no encontrado. Procese la referencia primero.")
         
-    return FileResponse(zip_path, filename=f"{ref_limpia}_completo.zip", media_type="application/zip")
+    return DescargaArchivo(zip_path, filename=f"{ref_limpia}_completo.zip", media_type="application/zip")
 
 # ==================== FICHAS URBANÍSTICAS ====================
 # Integración de fichas urbanísticas profesionales
@@ -1322,7 +1751,6 @@ try:
     app.include_router(ficha_router)
     print("✅ Router de ficha urbanística (API) registrado correctamente")
 
-    @app.on_event("startup")
     async def setup_ficha_services():
         """Inicializar servicios de fichas urbanísticas al iniciar"""
         try:
@@ -1333,6 +1761,8 @@ try:
                 print("⚠️ No se pudieron inicializar servicios de ficha urbanística")
         except Exception as e:
             print(f"⚠️ Error inicializando servicios de ficha: {e}")
+
+    _TAREAS_INICIO.append(setup_ficha_services)
         
 except ImportError as e:
     print(f"⚠️ Módulos de ficha urbanística no disponibles: {e}")
@@ -3,6 +3,7 @@
 """
 Script para regenerar Planos Perfectos en referencias ya procesadas
 """
+import os
 import sys
 from pathlib import Path
 
@@ -20,8 +21,12 @@ def regenerar_planos_perfectos():
         print("❌ El directorio 'outputs' no existe")
         return
     
-    # Buscar subdirectorios (referencias)
-    referencias = [d for d in outputs_dir.iterdir() if d.is_dir() and not d.name.startswith('_')]
+    # Buscar subdirectorios (referencias) en una sola pasada; DirEntry ya sabe si es directorio
+    with os.scandir(outputs_dir) as it:
+        referencias = [
+            (entry.name, entry.path) for entry in it
+            if entry.is_dir() and not entry.name.startswith('_')
+        ]
     
     print(f"📁 Encontradas {len(referencias)} referencias procesadas")
     
@@ -33,29 +38,29 @@ def regenerar_planos_perfectos():
     errores = 0
     ya_existentes = 0
     
-    for ref_dir in referencias:
-        ref = ref_dir.name
+    for ref, ref_root in referencias:
         print(f"\n{'='*60}")
         print(f"🔄 Procesando: {ref}")
         print(f"{'='*60}")
         
         # Buscar GML de parcela
-        gml_file = ref_dir / f"{ref}_parcela.gml"
-        
-        if not gml_file.exists():
+        gml_file = os.path.join(ref_root, f"{ref}_parcela.gml")
+
+        if not os.path.isfile(gml_file):
             print(f"  ⚠️  No se encontró GML de parcela")
             errores += 1
             continue
         
         # Crear directorio de imágenes
-        images_dir = ref_dir / "images"
-        images_dir.mkdir(exist_ok=True)
-        
+        images_dir = os.path.join(ref_root, "images")
+        os.makedirs(images_dir, exist_ok=True)
+
         # Ruta del plano perfecto
-        plano_path = images_dir / f"{ref}_plano_perfecto.png"
-        
-        if plano_path.exists():
-            print(f"  ↩️  Plano Perfecto ya existe: {plano_path.name}")
+        plano_nombre = f"{ref}_plano_perfecto.png"
+        plano_path = os.path.join(images_dir, plano_nombre)
+
+        if os.path.exists(plano_path):
+            print(f"  ↩️  Plano Perfecto ya existe: {plano_nombre}")
             ya_existentes += 1
             continue
         
@@ -63,8 +68,8 @@ def regenerar_planos_perfectos():
         try:
             print(f"  🎨 Generando Plano Perfecto...")
             exito = downloader.generar_plano_perfecto(
-                gml_path=gml_file,
-                output_path=plano_path,
+                gml_path=Path(gml_file),
+                output_path=Path(plano_path),
                 ref=ref,
                 info_afecciones=None
             )
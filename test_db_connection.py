@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
 import os
 import sys
+from functools import lru_cache
 from sqlalchemy import create_engine, text
 
+# Sentencias reutilizadas: al ser el mismo objeto, SQLAlchemy reaprovecha su compilación
+_SQL_VERSION = text("SELECT version()")
+_SQL_GEOM_COLS = text("SELECT f_table_name, type FROM geometry_columns WHERE f_table_schema = 'public'")
+
+
+@lru_cache(maxsize=4)
+def _engine(db_url):
+    """Engine compartido por URL (pool de conexiones reutilizable entre llamadas)"""
+    return create_engine(db_url, pool_size=4, max_overflow=0, pool_pre_ping=True, future=True)
+
+
 def test_connection():
     print("="*60)
     print("PRUEBA DE CONEXIÓN A POSTGIS")
@@ -32,16 +44,15 @@ def test_connection():
     print(f"🔌 Intentando conectar a: ...@{safe_url}")
 
     try:
-        engine = create_engine(db_url)
-        with engine.connect() as conn:
+        with _engine(db_url).connect() as conn:
             # Prueba básica
-            version = conn.execute(text("SELECT version()")).fetchone()[0]
+            version = conn.execute(_SQL_VERSION).scalar()
             print(f"✅ CONEXIÓN EXITOSA!")
             print(f"📊 Versión: {version}")
             
             # Listar tablas geométricas
             print("\n🌍 Capas espaciales disponibles (geometry_columns):")
-            result = conn.execute(text("SELECT f_table_name, type FROM geometry_columns WHERE f_table_schema = 'public'"))
+            result = conn.execute(_SQL_GEOM_COLS)
             for row in result:
                 print(f"   - {row[0]} ({row[1]})")
                 
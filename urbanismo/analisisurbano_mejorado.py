@@ -17,10 +17,11 @@ from dataclasses import dataclass
 
 import geopandas as gpd
 import matplotlib.pyplot as plt
-import requests
 from io import BytesIO
 from owslib.wms import WebMapService
 
+from config.http_session import SESSION
+
 # Configuración de logging
 logger = logging.getLogger(__name__)
 
@@ -146,7 +147,7 @@ class AnalisisUrbano:
             }
 
             logger.info(f"Descargando capa WFS: {typename}")
-            response = requests.get(base_url, params=params, timeout=60)
+            response = SESSION.get(base_url, params=params, timeout=60)
             response.raise_for_status()
 
             if not response.content:
@@ -427,7 +428,7 @@ class AnalisisUrbano:
 
         try:
             url = f"{wms_url}service=WMS&version=1.1.0&request=GetLegendGraphic&layer={self.wms_layer}&format=image/png"
-            response = requests.get(url, timeout=30)
+            response = SESSION.get(url, timeout=30)
             response.raise_for_status()
 
             # Crear archivo temporal
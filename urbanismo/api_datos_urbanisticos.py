@@ -1,14 +1,17 @@
 from fastapi import APIRouter, HTTPException
 from .motor_urbanistico import MotorUrbanisticoHibrido
 from pathlib import Path
-from config.paths import CAPAS_DIR, OUTPUTS_DIR
+from config.paths import rutas_configuradas
+
+# Sin crear directorios al importar (lo hace el arranque del servidor en un hilo)
+_RUTAS = rutas_configuradas()
 
 router = APIRouter(prefix="/api/v1/urbanismo", tags=["Análisis Urbanístico"])
 
 # Inicialización única del motor
 motor = MotorUrbanisticoHibrido(
-    data_dir=str(CAPAS_DIR), 
-    output_dir=str(OUTPUTS_DIR)
+    data_dir=str(_RUTAS["CAPAS_DIR"]), 
+    output_dir=str(_RUTAS["OUTPUTS_DIR"])
 )
 
 @router.get("/analizar/{referencia}")
@@ -12,6 +12,7 @@ Incluye:
 
 import logging
 import os
+import time
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -159,10 +160,42 @@ class UrbanismoService:
             
         return capas
 
+    # Segundos que se reutiliza el listado de capas (las de PostGIS no cambian el mtime de CAPAS_DIR)
+    TTL_LISTADO_CAPAS = 60
+
     def listar_capas(self) -> List[Dict]:
         """
         Lista las capas disponibles en el directorio CAPAS_DIR.
 
+        El listado se reutiliza mientras no cambie el mtime de CAPAS_DIR (un
+        os.stat en lugar de recorrer el directorio) y no pase TTL_LISTADO_CAPAS.
+        """
+        from config.paths import CAPAS_DIR
+
+        try:
+            mtime = CAPAS_DIR.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        cache = getattr(self, "_listado_capas", None)
+        if (
+            cache is not None
+            and cache[0] == mtime
+            and time.monotonic() - cache[1] < self.TTL_LISTADO_CAPAS
+        ):
+            return list(cache[2])
+
+        capas = self._escanear_capas()
+        self._listado_capas = (mtime, time.monotonic(), capas)
+        return list(capas)
+
+    def invalidar_listado_capas(self):
+        """Fuerza a que el próximo listar_capas() vuelva a recorrer las capas"""
+        self._listado_capas = None
+
+    def _escanear_capas(self) -> List[Dict]:
+        """
+        Recorre CAPAS_DIR y PostGIS sin caché.
+
         Busca archivos .geojson, .shp y .gml (excluyendo .gpkg).
         """
         try:
@@ -222,7 +255,7 @@ class UrbanismoService:
         """
         try:
             from config.paths import CAPAS_DIR
-            import requests
+            from config.http_session import SESSION
 
             download_dir = CAPAS_DIR / "descargadas"
             download_dir.mkdir(parents=True, exist_ok=True)
@@ -234,7 +267,7 @@ class UrbanismoService:
                 f"Descargando capa '{nombre_capa}' desde {url_descarga} a {local_path}"
             )
 
-            response = requests.get(url_descarga, stream=True)
+            response = SESSION.get(url_descarga, stream=True)
             response.raise_for_status()
 
             with open(local_path, "wb") as f:
@@ -253,14 +286,22 @@ class UrbanismoService:
             return None
 
     def obtener_o_descargar_capa(
-        self, nombre_capa: str, url_descarga: Optional[str] = None, layer: Optional[str] = None
+        self, nombre_capa: str, url_descarga: Optional[str] = None, layer: Optional[str] = None,
+        bbox=None, max_features: Optional[int] = None,
     ):
         """
         Intenta cargar una capa localmente desde GeoJSON, SHP o GML.
+
+        Si se pasa bbox (GeoSeries/GeoDataFrame con CRS), la lectura local se
+        filtra por esa extensión usando el índice espacial del origen si existe.
+        Con max_features solo se leen esas primeras entidades (límite aplicado
+        por el lector, sin deserializar el resto).
         """
         from config.paths import CAPAS_DIR
         import geopandas as gpd
 
+        opciones_lectura = {"rows": max_features} if max_features else {}
+
         extensiones = {".geojson", ".shp", ".gml"}
 
         for extension in extensiones:
@@ -270,7 +311,14 @@ class UrbanismoService:
                         logger.info(
                             f"Capa '{nombre_capa}' encontrada localmente en {file_path.name}. Cargando..."
                         )
-                        capa_gdf = gpd.read_file(file_path)
+                        capa_gdf = None
+                        if bbox is not None:
+                            try:
+                                capa_gdf = gpd.read_file(file_path, bbox=bbox, **opciones_lectura)
+                            except Exception as e:
+                                logger.debug(f"Lectura filtrada de '{nombre_capa}' no disponible: {e}")
+                        if capa_gdf is None:
+                            capa_gdf = gpd.read_file(file_path, **opciones_lectura)
 
                         if capa_gdf.crs and capa_gdf.crs != "EPSG:25830":
                             capa_gdf = capa_gdf.to_crs("EPSG:25830")
@@ -290,7 +338,10 @@ class UrbanismoService:
                 if insp.has_table(nombre_capa):
                     logger.info(f"Cargando capa '{nombre_capa}' desde PostGIS...")
                     # Usar consulta SQL directa para evitar ambigüedades
-                    capa_gdf = gpd.read_postgis(f'SELECT * FROM "{nombre_capa}"', engine)
+                    consulta = f'SELECT * FROM "{nombre_capa}"'
+                    if max_features:
+                        consulta += f" LIMIT {int(max_features)}"
+                    capa_gdf = gpd.read_postgis(consulta, engine)
                     if capa_gdf.crs and capa_gdf.crs != "EPSG:25830":
                         capa_gdf = capa_gdf.to_crs("EPSG:25830")
                     return capa_gdf
@@ -310,7 +361,7 @@ class UrbanismoService:
                     logger.info(
                         f"Capa '{nombre_capa}' descargada. Cargando desde {local_path}..."
                     )
-                    capa_gdf = gpd.read_file(local_path)
+                    capa_gdf = gpd.read_file(local_path, **opciones_lectura)
                     if capa_gdf.crs and capa_gdf.crs != "EPSG:25830":
                         capa_gdf = capa_gdf.to_crs("EPSG:25830")
                     return capa_gdf